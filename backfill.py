@@ -0,0 +1,218 @@
+import argparse
+import bisect
+import csv
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from urllib.parse import urlparse
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+
+import dune_outbox
+import fetch_engine
+import http_client
+import rpc_reader
+import ttl_cache
+import tvl_data
+
+# Rebuilds token_and_contract_data rows for past dates or blocks by reading
+# the contracts at historical block heights (needs an archive node behind
+# Q_RPC_URL) and prices from CoinGecko's market charts.
+#
+# The points are split into chunks that a pool of worker processes reads in
+# parallel. Each chunk costs a few JSON-RPC batches: one per block-search
+# step and one with an aggregate3 call per point. Finished chunks are stored
+# through tvl_data.store_rows, like live snapshots, and recorded in a
+# checkpoint file, so an interrupted backfill resumes where it stopped. Rows
+# whose date is already in the CSV are skipped.
+
+CHECKPOINT_PATH = os.getenv("BACKFILL_CHECKPOINT", "backfill_checkpoint.json")
+WORKERS = int(os.getenv("BACKFILL_WORKERS", "4"))
+CHUNK_POINTS = int(os.getenv("BACKFILL_CHUNK_POINTS", "24"))
+
+# CoinGecko ids of the prices in a row. CoinGecko returns hourly points for
+# windows of up to 90 days, so longer ranges are fetched in windows.
+# Q mainnet's rows only use the non-stablecoin prices
+PRICE_IDS = tvl_data.PRICE_IDS if tvl_data.COLUMNS else ['wrapped-bitcoin', 'elk-finance', 'vnx-gold', 'weth', 'q-protocol']
+PRICE_WINDOW = 90 * 86400
+PRICE_HISTORY_URL = tvl_data.COINGECKO_URL + "/api/v3/coins/{id}/market_chart/range?vs_currency=usd&from={start}&to={end}"
+
+# Function to fetch {coin id: sorted [(unix time, usd price)]} covering start..end
+def price_history(start, end):
+    history = {}
+    for coin in PRICE_IDS:
+        points = []
+        window_start = start - 3600
+        while window_start < end:
+            window_end = min(end + 3600, window_start + PRICE_WINDOW)
+            url = PRICE_HISTORY_URL.format(id=coin, start=int(window_start), end=int(window_end))
+            points.extend((ms / 1000, price) for ms, price in fetch_engine.rate_limited_fetch(url, http_client.get_json).get('prices', []))
+            window_start = window_end
+        history[coin] = sorted(points)
+    return history
+
+# Function to get the prices dict of a row from the last price at or before `timestamp`
+def prices_at(history, timestamp):
+    prices = {}
+    for coin, points in history.items():
+        i = bisect.bisect_right(points, (timestamp, float('inf')))
+        if i:
+            prices[coin] = {'usd': points[i - 1][1]}
+    return prices
+
+# Function to slice the price history to what one chunk needs
+def _history_slice(history, first, last):
+    sliced = {}
+    for coin, points in history.items():
+        lo = max(0, bisect.bisect_right(points, (first, float('inf'))) - 1)
+        hi = bisect.bisect_right(points, (last, float('inf')))
+        sliced[coin] = points[lo:hi]
+    return sliced
+
+def _init_worker(rpc_rps):
+    # The RPC budget is shared by all workers
+    fetch_engine.HOST_RPS[urlparse(rpc_reader.RPC_URL).hostname] = rpc_rps
+
+# Runs in a worker process: read one chunk of points. Each point is
+# ('time', unix time) or ('block', number). low and high are the
+# (number, timestamp) bounds of the chain. Points that resolve to the same
+# block each keep their row. Points before genesis are reported and left
+# out. Returns (rows, late), where late counts the points after the head of
+# the chain when the run started.
+def backfill_chunk(points, tokens, history, low, high):
+    late = sum(1 for kind, value in points if (kind == 'time' and value > high[1]) or (kind == 'block' and value > high[0]))
+    times = [value for kind, value in points if kind == 'time' and value <= high[1]]
+    targets = []
+    for timestamp, block in rpc_reader.blocks_at_times(times, low, high).items():
+        if block is None:
+            print(f"Skipping {datetime.fromtimestamp(timestamp)}: before the first block")
+            continue
+        targets.append((timestamp, block))
+    block_points = [value for kind, value in points if kind == 'block' and value <= high[0]]
+    if block_points:
+        targets.extend((timestamp, block) for block, timestamp in rpc_reader.block_timestamps(block_points).items())
+
+    calls, keys = tvl_data.rpc_calls(tokens)
+    results = rpc_reader.read_at_blocks(calls, sorted({block for _, block in targets}))
+    rows = []
+    for timestamp, block in sorted(targets):
+        info, balances, stq_price = tvl_data.decode_rpc_values(keys, results[block], tokens)
+        rows.append(tvl_data.make_row(prices_at(history, timestamp), info, balances, stq_price,
+                                      datetime.fromtimestamp(timestamp)))
+    return rows, late
+
+def load_checkpoint(run_key):
+    try:
+        with open(CHECKPOINT_PATH) as file:
+            checkpoint = json.load(file)
+    except FileNotFoundError:
+        return set()
+    return set(checkpoint['done']) if checkpoint.get('run') == run_key else set()
+
+def save_checkpoint(run_key, done):
+    temp_path = CHECKPOINT_PATH + '.tmp'
+    with open(temp_path, 'w') as file:
+        json.dump({'run': run_key, 'done': sorted(done)}, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, CHECKPOINT_PATH)
+
+def existing_dates(path):
+    try:
+        with open(path, newline='') as file:
+            return {row['date'] for row in csv.DictReader(file)}
+    except FileNotFoundError:
+        return set()
+
+# Function to backfill the given points. Returns the number of rows stored.
+def backfill(points, run_key, workers=WORKERS, chunk_points=CHUNK_POINTS):
+    cache = ttl_cache.get_cache()
+    tokens = tvl_data.rpc_tokens(cache)
+    high_number = rpc_reader.block_number()
+    bounds = rpc_reader.block_timestamps([0, high_number])
+    low, high = (0, bounds[0]), (high_number, bounds[high_number])
+
+    times = [value for kind, value in points if kind == 'time']
+    if not times:
+        # Block points get their dates from the chain
+        times = list(rpc_reader.block_timestamps({points[0][1], points[-1][1]}).values())
+    history = price_history(min(times), max(times))
+
+    chunks = [points[i:i + chunk_points] for i in range(0, len(points), chunk_points)]
+    done = load_checkpoint(run_key)
+    todo = [i for i in range(len(chunks)) if i not in done]
+    print(f"Backfilling {len(points)} points in {len(chunks)} chunks, {len(chunks) - len(todo)} already done.")
+    known = existing_dates(tvl_data.csv_file_path)
+    outbox = dune_outbox.connect()
+    stored, failed, incomplete = 0, 0, 0
+    started = time.time()
+    rpc_rps = fetch_engine.HOST_RPS.get(urlparse(rpc_reader.RPC_URL).hostname, fetch_engine.DEFAULT_RPS) / workers
+    # spawn, so workers do not inherit the parent's open HTTP connections
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker, initargs=(rpc_rps,)) as pool:
+        futures = {}
+        for i in todo:
+            values = [value for _, value in chunks[i]]
+            chunk_history = _history_slice(history, min(values), max(values)) if chunks[i][0][0] == 'time' else history
+            futures[pool.submit(backfill_chunk, chunks[i], tokens, chunk_history, low, high)] = i
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                rows, late = future.result()
+            except (http_client.FetchError, rpc_reader.RPCError) as e:
+                # Left out of the checkpoint, so the next run retries it
+                print(f"Chunk {i + 1}/{len(chunks)} failed: {e}")
+                failed += 1
+                continue
+            rows = [row for row in rows if row['date'] not in known]
+            if rows:
+                tvl_data.store_rows(rows, outbox)
+                known.update(row['date'] for row in rows)
+                stored += len(rows)
+            if late:
+                # Also left out of the checkpoint, so a later run fills the points once the chain has them
+                print(f"Chunk {i + 1}/{len(chunks)}: skipped {late} points after the chain head (block {high_number})")
+                incomplete += 1
+            else:
+                done.add(i)
+                save_checkpoint(run_key, done)
+            print(f"Chunk {i + 1}/{len(chunks)}: {len(rows)} rows ({len(done)}/{len(chunks)} done, {time.time() - started:.0f}s)")
+    if failed:
+        print(f"{failed} chunks failed. Run the same command again to retry them.")
+    if incomplete:
+        print(f"{incomplete} chunks have points after the chain head. Run the same command again later to fill them.")
+    print(f"Uploaded {dune_outbox.flush(outbox, tvl_data.dune_user, tvl_data.api_key)} rows to Dune, "
+          f"{dune_outbox.pending_count(outbox)} pending.")
+    outbox.close()
+    return stored
+
+def parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d %H:%M:%S' if ' ' in value else '%Y-%m-%d').timestamp()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill token_and_contract_data rows at historical blocks.")
+    parser.add_argument('--start', help="first date, YYYY-MM-DD or 'YYYY-MM-DD HH:MM:SS' (local time)")
+    parser.add_argument('--end', help="end date, exclusive")
+    parser.add_argument('--interval', type=int, default=3600, help="seconds between points (default: hourly)")
+    parser.add_argument('--start-block', type=int)
+    parser.add_argument('--end-block', type=int, help="end block, exclusive")
+    parser.add_argument('--step-blocks', type=int, default=720)
+    parser.add_argument('--workers', type=int, default=WORKERS)
+    args = parser.parse_args()
+
+    if args.start and args.end:
+        start, end = parse_date(args.start), parse_date(args.end)
+        points = [('time', int(start + i * args.interval)) for i in range(int((end - start) // args.interval))]
+        run_key = f"time:{args.start}:{args.end}:{args.interval}"
+    elif args.start_block is not None and args.end_block is not None:
+        points = [('block', block) for block in range(args.start_block, args.end_block, args.step_blocks)]
+        run_key = f"block:{args.start_block}:{args.end_block}:{args.step_blocks}"
+    else:
+        parser.error("give --start and --end, or --start-block and --end-block")
+    print(f"Stored {backfill(points, run_key, args.workers)} rows.")
+    http_client.print_stats()
@@ -0,0 +1,63 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Cold-import budget in milliseconds per module: the median of
+# IMPORT_BENCH_RUNS imports, each in a fresh interpreter, so one slow run on a
+# busy machine does not fail the check
+IMPORT_BUDGET_MS = float(os.getenv("IMPORT_BUDGET_MS", "60"))
+IMPORT_BENCH_RUNS = int(os.getenv("IMPORT_BENCH_RUNS", "5"))
+
+# Modules a worker or test may import without running anything
+MODULES = ['collectors', 'tvl_data', 'onchain_stats', 'mintandburn', 'scheduler', 'rollups', 'dune_outbox',
+           'columnar_store', 'http_client', 'fetch_engine', 'ttl_cache', 'tx_index', 'csv_store']
+
+# Modules that must only be loaded when they are used
+HEAVY_MODULES = ['requests', 'pandas', 'numpy', 'pyarrow']
+
+# Runs in the child interpreter: times the import and records any network or
+# data file access made while importing
+CHILD = r"""
+import json, os, sys, time
+cwd = os.getcwd()
+events = []
+def hook(event, args):
+    if event in ('socket.connect', 'socket.getaddrinfo', 'sqlite3.connect'):
+        events.append(f"{event} {args[:2]!r}")
+    elif event == 'open' and isinstance(args[0], str):
+        path = os.path.abspath(args[0])
+        if path.startswith(cwd) and not path.endswith(('.py', '.pyc')) and '__pycache__' not in path:
+            events.append(f"open {args[0]}")
+sys.addaudithook(hook)
+started = time.perf_counter()
+__import__(sys.argv[1])
+elapsed = (time.perf_counter() - started) * 1000
+print(json.dumps({'ms': elapsed, 'io': events, 'heavy': [m for m in sys.argv[2:] if m in sys.modules]}))
+"""
+
+# Function to import a module in fresh interpreters, returns (median ms, io events, heavy modules loaded)
+def measure(module, runs=IMPORT_BENCH_RUNS):
+    results = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', CHILD, module] + HEAVY_MODULES,
+                                capture_output=True, text=True, check=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    return statistics.median(result['ms'] for result in results), results[0]['io'], results[0]['heavy']
+
+if __name__ == "__main__":
+    modules = sys.argv[1:] or MODULES
+    failed = False
+    for module in modules:
+        ms, io, heavy = measure(module)
+        problems = []
+        if ms > IMPORT_BUDGET_MS:
+            problems.append(f"over budget of {IMPORT_BUDGET_MS:.0f} ms")
+        if io:
+            problems.append(f"I/O on import: {', '.join(io)}")
+        if heavy:
+            problems.append(f"loads {', '.join(heavy)}")
+        failed = failed or bool(problems)
+        print(f"{module:16} {ms:7.1f} ms  {'; '.join(problems) or 'ok'}")
+    sys.exit(1 if failed else 0)
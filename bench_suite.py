@@ -0,0 +1,200 @@
+import argparse
+import csv
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import mock_server
+
+# Benchmarks the collectors against mock_server.py, so it runs without
+# network access. Each scenario runs in a fresh temporary directory holding
+# `size` rows of history, in a child interpreter whose base URLs point at the
+# mock. Reported per run: wall time of the collector's main(), requests and
+# bytes seen by the mock, and the child's peak RSS.
+#
+# With --baseline, results are compared to an earlier --json output and the
+# exit status is 1 when a run regressed beyond the tolerance, for use in CI.
+
+SCENARIOS = ['tvl_data', 'onchain_stats', 'mintandburn']
+DEFAULT_SIZES = [1000, 10000, 100000]
+# New points a run finds: stats days and mint/burn transfers per token
+NEW_DAYS = 5
+NEW_TRANSFERS = int(os.getenv("BENCH_NEW_TRANSFERS", "500"))
+# Metrics checked against the baseline; requests must not grow at all
+TOLERANT_METRICS = ['seconds', 'bytes_in', 'bytes_out', 'max_rss_mb']
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Runs in the child interpreter: times the collector's main() and reports peak RSS
+CHILD = r"""
+import json, resource, sys, time
+sys.path.insert(0, sys.argv[1])
+module = __import__(sys.argv[2])
+started = time.perf_counter()
+module.main()
+elapsed = time.perf_counter() - started
+print(json.dumps({'seconds': elapsed, 'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))
+"""
+
+def _write_csv(path, fieldnames, rows):
+    with open(path, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+
+# Function to get `count` dates, one per step, oldest first and ending at `last`
+def _dates(last, count, step, fmt):
+    return ((last - step * i).strftime(fmt) for i in range(count - 1, -1, -1))
+
+def seed_tvl_data(workdir, size, state):
+    import tvl_data
+    # The history rows copy the shape of a real snapshot row
+    row = tvl_data.build_row({}, {name: {'name': 'Unknown', 'total_supply': 1.0} for name in tvl_data.TOKEN_ADDRESSES},
+                             {name: {} for name in tvl_data.CONTRACT_ADDRESSES}, 1.0, datetime.now())
+    last = datetime.now().replace(minute=0, second=0, microsecond=0) - timedelta(hours=1)
+    _write_csv(os.path.join(workdir, tvl_data.csv_file_path), list(row),
+               (dict(row, date=date) for date in _dates(last, size, timedelta(hours=1), '%Y-%m-%d %H:%M:%S')))
+
+def seed_onchain_stats(workdir, size, state):
+    import onchain_stats
+    # A daily series cannot hold millions of distinct days; filler rows at the
+    # head repeat the oldest date, only the tail is read by a run
+    days = min(size, 20000)
+    last = datetime.now() - timedelta(days=NEW_DAYS + 1)
+    for series in ('active_accounts', 'transactions_growth'):
+        filename, _ = onchain_stats.SERIES_FILES[series]
+        dates = list(_dates(last, days, timedelta(days=1), '%Y-%m-%d'))
+        rows = ({'date': dates[0], 'value': '1000'} for _ in range(size - days))
+        _write_csv(os.path.join(workdir, filename), ['date', 'value'], rows)
+        with open(os.path.join(workdir, filename), 'a', newline='') as file:
+            csv.writer(file).writerows([date, '1000'] for date in dates)
+    filename, _ = onchain_stats.SERIES_FILES['general_stats']
+    _write_csv(os.path.join(workdir, filename), onchain_stats.GENERAL_STATS_FIELDNAMES,
+               ({'timestamp': date} for date in _dates(last, size, timedelta(minutes=1), '%Y-%m-%d %H:%M:%S')))
+    state.configure(chart_points=days + NEW_DAYS + 1)
+
+def seed_mintandburn(workdir, size, state):
+    import mintandburn
+    import supply_ledger
+    from tx_index import TxIndex
+    csv_path = os.path.join(workdir, 'mint_burn_data.csv')
+    tokens = list(mintandburn.TOKENS)
+    rows = ({'tx_hash': f"0x{i:064x}", 'log_index': 0, 'from': '0x0', 'to': '0x0', 'token_name': tokens[i % len(tokens)],
+             'token_symbol': tokens[i % len(tokens)], 'transfer_type': 'token_minting',
+             'timestamp': '2023-01-01T00:00:00.000000Z', 'value': 1.0} for i in range(size))
+    _write_csv(csv_path, mintandburn.FIELDNAMES, rows)
+    # The legacy import into the index and the first ledger build are one-offs, so they are not timed
+    TxIndex(os.path.join(workdir, 'mint_burn_index.sqlite'), csv_path).close()
+    supply_ledger.SupplyLedger(os.path.join(workdir, 'supply_ledger')).update_from_csv(csv_path)
+    # The watermark sits NEW_TRANSFERS back, so each token has that many to catch up
+    watermark = mock_server.transfer_timestamp(state, NEW_TRANSFERS)
+    with open(os.path.join(workdir, 'last_processed.json'), 'w') as file:
+        json.dump({'tokens': {token: watermark for token in tokens}}, file)
+    state.configure(transfers=NEW_TRANSFERS + state.config['page_size'])
+
+SEEDERS = {'tvl_data': seed_tvl_data, 'onchain_stats': seed_onchain_stats, 'mintandburn': seed_mintandburn}
+
+# Function to build the child's environment: every base URL points at the
+# mock, every state file lives in the work directory
+def child_env(base_url, workdir):
+    env = dict(os.environ)
+    env.update({
+        'EXPLORER_URL': base_url, 'STATS_EXPLORER_URL': base_url, 'COINGECKO_URL': base_url, 'DUNE_API_URL': base_url,
+        'TVL_SOURCE': 'explorer', 'DEFAULT_RPS': os.getenv("BENCH_RPS", "1000"),
+        'TTL_CACHE_DB': os.path.join(workdir, 'cache.sqlite'),
+        'DUNE_OUTBOX_DB': os.path.join(workdir, 'dune_outbox.sqlite'),
+        'ROLLUPS_DB': os.path.join(workdir, 'rollups.sqlite'),
+        'COLUMNAR_STORE_DIR': os.path.join(workdir, 'data'),
+    })
+    env.setdefault('HTTP_BACKOFF_BASE', '0.01')
+    for name in ('DUNE_API_KEY', 'DUNE_API_KEY2'):
+        env[name] = 'bench'
+    for name in ('NAMESPACE1', 'NAMESPACE2'):
+        env[name] = 'bench'
+    for name in ('TABLE_NAME1', 'TABLE_NAME2', 'TABLE_NAME3', 'TABLE_NAME4', 'TABLE_NAME_MINT_BURN'):
+        env[name] = name.lower()
+    return env
+
+# Function to run one scenario at one history size, returns its result dict
+def run_scenario(scenario, size, state, base_url):
+    workdir = tempfile.mkdtemp(prefix=f"bench_{scenario}_")
+    try:
+        SEEDERS[scenario](workdir, size, state)
+        state.reset()
+        started = time.perf_counter()
+        output = subprocess.run([sys.executable, '-c', CHILD, REPO_DIR, scenario], cwd=workdir,
+                                env=child_env(base_url, workdir), capture_output=True, text=True)
+        total = time.perf_counter() - started
+        if output.returncode:
+            raise RuntimeError(f"{scenario} at {size} rows failed:\n{output.stderr[-2000:]}")
+        result = json.loads(output.stdout.strip().splitlines()[-1])
+        stats = state.snapshot()
+        return {'scenario': scenario, 'size': size, 'seconds': round(result['seconds'], 4),
+                'process_seconds': round(total, 4), 'requests': stats['requests'], 'errors': stats['errors'],
+                'bytes_in': stats['bytes_in'], 'bytes_out': stats['bytes_out'],
+                'rows_uploaded': stats['rows_uploaded'], 'max_rss_mb': round(result['max_rss_mb'], 1)}
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+# Function to list the regressions of `results` against a baseline result list
+def compare(results, baseline, tolerance):
+    previous = {(entry['scenario'], entry['size']): entry for entry in baseline}
+    regressions = []
+    for result in results:
+        before = previous.get((result['scenario'], result['size']))
+        if not before:
+            continue
+        if result['requests'] > before['requests']:
+            regressions.append(f"{result['scenario']} {result['size']}: requests {before['requests']} -> {result['requests']}")
+        for metric in TOLERANT_METRICS:
+            if before.get(metric) and result[metric] > before[metric] * (1 + tolerance):
+                regressions.append(f"{result['scenario']} {result['size']}: {metric} {before[metric]} -> {result[metric]}")
+    return regressions
+
+def print_table(results):
+    print(f"{'scenario':14} {'rows':>9} {'seconds':>8} {'requests':>8} {'bytes in':>10} {'bytes out':>10} {'rss MB':>7}")
+    for r in results:
+        print(f"{r['scenario']:14} {r['size']:>9} {r['seconds']:>8.3f} {r['requests']:>8} "
+              f"{r['bytes_in']:>10} {r['bytes_out']:>10} {r['max_rss_mb']:>7.1f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the collectors against the local mock server.")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help="history rows, comma separated (up to 10000000)")
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--fixtures', help="answer from recorded fixtures where present")
+    parser.add_argument('--json', help="write the results to this file")
+    parser.add_argument('--baseline', help="results file of an earlier run to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.5, help="allowed growth per metric (default 0.5 = 50%%)")
+    args = parser.parse_args()
+
+    server, state, base_url = mock_server.start(latency_ms=args.latency_ms, error_rate=args.error_rate,
+                                                fixtures=args.fixtures)
+    results = []
+    try:
+        for size in [int(size) for size in args.sizes.split(',')]:
+            for scenario in args.scenarios.split(','):
+                state.configure(**dict(mock_server.DEFAULT_CONFIG, latency_ms=args.latency_ms,
+                                       error_rate=args.error_rate, fixtures=args.fixtures))
+                results.append(run_scenario(scenario, size, state, base_url))
+                print(f"{scenario} at {size} rows: {results[-1]['seconds']:.3f}s, {results[-1]['requests']} requests")
+    finally:
+        server.shutdown()
+
+    print_table(results)
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump({'python': sys.version.split()[0], 'results': results}, file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file)['results'], args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,23 @@
+# Library entry points for the collectors.
+#
+# Importing this module does no network or disk I/O and does not import the
+# collector modules, requests or pyarrow. Each function imports what it needs
+# on first call and only fetches; storing and uploading stay in each script's
+# main(). Settings come from the process environment. Call
+# dotenv.load_dotenv() first to use a .env file.
+
+# Function to take one TVL snapshot, returns the row tvl_data.py would store
+def collect_tvl_snapshot():
+    import tvl_data
+    return tvl_data.collect_snapshot()
+
+# Function to fetch the active accounts, transactions growth and general stats series
+def collect_chain_stats():
+    import onchain_stats
+    return onchain_stats.collect_chain_stats()
+
+# Function to fetch mint and burn events newer than the given per-token
+# watermarks ({token_name: timestamp}), returns {token_name: [rows]}
+def collect_mint_burn(watermarks=None, tokens=None):
+    import mintandburn
+    return mintandburn.collect_mint_burn(watermarks, tokens)
@@ -0,0 +1,233 @@
+import csv
+import os
+import sys
+from datetime import datetime
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+
+# Root directory of the columnar store, one sub-directory per series
+STORE_DIR = os.getenv("COLUMNAR_STORE_DIR", "data")
+COMPRESSION = os.getenv("COLUMNAR_COMPRESSION", "zstd")
+MIGRATE_BATCH_ROWS = 100000
+# A month partition is compacted once an append leaves more files than this
+COMPACT_FILES = int(os.getenv("COLUMNAR_COMPACT_FILES", "32"))
+
+TVL_FIELDS = [
+    'btc_in_usd', 'elk_in_usd', 'vnxau_in_usd', 'weth_in_usd', 'stq_conv_rate',
+    'bridged_wbtc', 'bridged_usdc', 'bridged_dai', 'bridged_weth', 'bridged_elk', 'total_qusd',
+    'locked_wbtc', 'locked_usdc', 'locked_dai', 'saving_tvl',
+    'elk_locked_wbtc', 'elk_locked_usdc', 'elk_locked_dai', 'elk_locked_elk', 'elk_locked_qusd', 'elk_locked_vnxau',
+    'stq_supply',
+] + [f'extra_{i}' for i in range(1, 21)]
+
+GENERAL_STATS_FIELDS = [
+    'average_block_time', 'coin_price', 'gas_average', 'gas_fast', 'gas_slow',
+    'gas_used_today', 'market_cap', 'network_utilization_percentage', 'static_gas_price',
+    'total_addresses', 'total_blocks', 'total_gas_used', 'total_transactions', 'transactions_today',
+]
+
+# Column types per series: 'time' is the partition column, 'symbol' columns are
+# dictionary-encoded strings, 'string' are plain strings, 'double'/'int' are numbers
+SERIES = {
+    'token_and_contract_data': {
+        'csv': 'token_and_contract_data.csv',
+        'time': 'date',
+        'columns': {'date': 'time', **{field: 'double' for field in TVL_FIELDS}},
+    },
+    'mint_burn_data': {
+        'csv': 'mint_burn_data.csv',
+        'time': 'timestamp',
+        'columns': {
+            'tx_hash': 'string', 'log_index': 'int', 'from': 'symbol', 'to': 'symbol', 'token_name': 'symbol',
+            'token_symbol': 'symbol', 'transfer_type': 'symbol', 'timestamp': 'time', 'value': 'double',
+        },
+    },
+    'active_accounts_data': {
+        'csv': 'active_accounts_data.csv',
+        'time': 'date',
+        'columns': {'date': 'time', 'value': 'int'},
+    },
+    'transactions_growth_data': {
+        'csv': 'transactions_growth_data.csv',
+        'time': 'date',
+        'columns': {'date': 'time', 'value': 'int'},
+    },
+    'general_stats_data': {
+        'csv': 'general_stats_data.csv',
+        'time': 'timestamp',
+        'columns': {'timestamp': 'time', **{field: 'double' for field in GENERAL_STATS_FIELDS}},
+    },
+}
+
+# Function to check whether collectors should also write to the columnar store
+def is_enabled():
+    return os.getenv("COLUMNAR_STORE") == "1"
+
+def _arrow_type(pa, kind):
+    return {
+        'time': pa.timestamp('us'),
+        'symbol': pa.dictionary(pa.int32(), pa.string()),
+        'string': pa.string(),
+        'double': pa.float64(),
+        'int': pa.int64(),
+    }[kind]
+
+def schema(series):
+    import pyarrow as pa
+    return pa.schema([(name, _arrow_type(pa, kind)) for name, kind in SERIES[series]['columns'].items()])
+
+def parse_time(value):
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=None)
+    return datetime.fromisoformat(str(value).replace('Z', '+00:00')).replace(tzinfo=None)
+
+# Values such as 'Unknown' or '' are stored as nulls instead of text
+def _convert(value, kind):
+    if value is None or value == '':
+        return None
+    if kind == 'time':
+        return parse_time(value)
+    if kind in ('double', 'int'):
+        try:
+            number = float(value)
+        except (TypeError, ValueError):
+            return None
+        return int(number) if kind == 'int' else number
+    return str(value)
+
+def _to_table(series, rows):
+    import pyarrow as pa
+    columns = SERIES[series]['columns']
+    table = pa.table({
+        name: pa.array([_convert(row.get(name), kind) for row in rows],
+                       type=pa.string() if kind == 'symbol' else _arrow_type(pa, kind))
+        for name, kind in columns.items()
+    })
+    return table.cast(schema(series))
+
+def _partition_dir(series, month):
+    return os.path.join(STORE_DIR, series, f"month={month}")
+
+def _part_path(directory):
+    import uuid
+    return os.path.join(directory, f"part-{uuid.uuid4().hex}.parquet")
+
+# Function to append rows (dicts as written to the CSVs) to a series, one
+# Parquet file per touched month partition. A partition past COMPACT_FILES
+# files is merged, so live appends do not leave thousands of tiny files.
+def append(series, rows):
+    if not rows:
+        return
+    import pyarrow.parquet as pq
+    time_column = SERIES[series]['time']
+    by_month = {}
+    for row in rows:
+        by_month.setdefault(parse_time(row[time_column]).strftime('%Y-%m'), []).append(row)
+    for month, month_rows in by_month.items():
+        directory = _partition_dir(series, month)
+        os.makedirs(directory, exist_ok=True)
+        path = _part_path(directory)
+        temp_path = f"{path}.tmp"
+        pq.write_table(_to_table(series, month_rows), temp_path, compression=COMPRESSION, use_dictionary=True)
+        os.replace(temp_path, path)
+        if sum(name.endswith('.parquet') for name in os.listdir(directory)) > COMPACT_FILES:
+            compact(series, month)
+
+# Function to append to the store only when COLUMNAR_STORE=1
+def append_if_enabled(series, rows):
+    if is_enabled():
+        append(series, rows)
+
+# Function to merge the small files of one month partition into a single file
+def compact(series, month):
+    import pyarrow.parquet as pq
+    directory = _partition_dir(series, month)
+    parts = sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.endswith('.parquet'))
+    if len(parts) < 2:
+        return
+    table = pq.read_table(parts, schema=schema(series)).sort_by(SERIES[series]['time'])
+    path = _part_path(directory)
+    pq.write_table(table, f"{path}.tmp", compression=COMPRESSION, use_dictionary=True)
+    os.replace(f"{path}.tmp", path)
+    for part in parts:
+        os.remove(part)
+
+def _months(series, start, end):
+    directory = os.path.join(STORE_DIR, series)
+    if not os.path.isdir(directory):
+        return []
+    first = parse_time(start).strftime('%Y-%m') if start is not None else None
+    last = parse_time(end).strftime('%Y-%m') if end is not None else None
+    months = []
+    for name in sorted(os.listdir(directory)):
+        if not name.startswith('month='):
+            continue
+        month = name[len('month='):]
+        if (first is None or month >= first) and (last is None or month <= last):
+            months.append(month)
+    return months
+
+# Function to read a series as an Arrow table. Only the month partitions that
+# overlap [start, end) are opened and only the requested columns are decoded.
+def read(series, columns=None, start=None, end=None):
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+    time_column = SERIES[series]['time']
+    read_columns = list(columns) if columns else list(SERIES[series]['columns'])
+    if time_column not in read_columns:
+        read_columns.append(time_column)
+    parts = []
+    for month in _months(series, start, end):
+        directory = _partition_dir(series, month)
+        parts.extend(os.path.join(directory, name) for name in sorted(os.listdir(directory)) if name.endswith('.parquet'))
+    if not parts:
+        return schema(series).empty_table().select(read_columns)
+    table = pq.read_table(parts, columns=read_columns, schema=schema(series))
+    mask = None
+    if start is not None:
+        mask = pc.greater_equal(table[time_column], pa.scalar(parse_time(start), pa.timestamp('us')))
+    if end is not None:
+        end_mask = pc.less(table[time_column], pa.scalar(parse_time(end), pa.timestamp('us')))
+        mask = end_mask if mask is None else pc.and_(mask, end_mask)
+    if mask is not None:
+        table = table.filter(mask)
+    table = table.sort_by(time_column)
+    return table.select(list(columns)) if columns else table
+
+# Function to read a series as a pandas DataFrame
+def read_pandas(series, columns=None, start=None, end=None):
+    return read(series, columns, start, end).to_pandas()
+
+# One-time migration of the existing CSV histories into the store
+def migrate_csvs(series_names=None):
+    for series in series_names or SERIES:
+        csv_path = SERIES[series]['csv']
+        if not os.path.exists(csv_path):
+            print(f"No {csv_path} found. Skipping {series}.")
+            continue
+        if _months(series, None, None):
+            print(f"{series} already has data in {STORE_DIR}. Skipping.")
+            continue
+        count = 0
+        with open(csv_path, mode='r', newline='') as file:
+            batch = []
+            for row in csv.DictReader(file):
+                batch.append(row)
+                if len(batch) >= MIGRATE_BATCH_ROWS:
+                    append(series, batch)
+                    count += len(batch)
+                    batch = []
+            append(series, batch)
+            count += len(batch)
+        for month in _months(series, None, None):
+            compact(series, month)
+        print(f"Migrated {count} rows from {csv_path} into {series}.")
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "migrate":
+        migrate_csvs(sys.argv[2:] or None)
+    else:
+        print("Usage: python columnar_store.py migrate [series ...]")
@@ -0,0 +1,130 @@
+import csv
+import io
+import os
+
+_headers = {}
+_terminators = {}
+
+# Function to read only the header line of a CSV, cached per path for the process
+def read_header(path):
+    if path not in _headers:
+        with open(path, mode='r', newline='') as file:
+            line = file.readline()
+        _headers[path] = next(csv.reader([line])) if line.strip() else None
+        _terminators[path] = '\r\n' if line.endswith('\r\n') else '\n'
+    return _headers[path]
+
+# Function to get the line ending of a CSV, from its header line: csv's own
+# default '\r\n' for files written by DictWriter, '\n' for write_csv's
+def line_terminator(path):
+    read_header(path)
+    return _terminators[path]
+
+def _fsync_dir(path):
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def _encode(fieldnames, rows, header, lineterminator='\n'):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fieldnames, lineterminator=lineterminator)
+    if header:
+        writer.writeheader()
+    writer.writerows(rows)
+    return buffer.getvalue().encode()
+
+# Function to write a whole CSV atomically: temp file, fsync, rename
+def write_csv(path, fieldnames, rows):
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'wb') as file:
+        file.write(_encode(fieldnames, rows, True))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+    _fsync_dir(path)
+    _headers[path] = list(fieldnames)
+    _terminators[path] = '\n'
+
+# Function to append rows to a CSV without reading or rewriting its history.
+# The header is checked once, the rows go out in a single write followed by
+# fsync, and a failed write is truncated away so the file never keeps half a batch.
+# Rows use the file's own line ending.
+def append_rows(path, fieldnames, rows):
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        write_csv(path, fieldnames, rows)
+        return
+    header = read_header(path)
+    if header != list(fieldnames):
+        if header is None or set(header) != set(fieldnames):
+            raise ValueError(f"{path} has columns {header}, expected {list(fieldnames)}")
+        fieldnames = header
+    terminator = line_terminator(path)
+    with open(path, 'r+b') as file:
+        size = file.seek(0, os.SEEK_END)
+        file.seek(size - 1)
+        if file.read(1) != b'\n':
+            size = _end_last_line(file, size, len(header), terminator)
+        file.seek(size)
+        try:
+            file.write(_encode(fieldnames, rows, False, terminator))
+            file.flush()
+            os.fsync(file.fileno())
+        except BaseException:
+            file.truncate(size)
+            raise
+
+# Function to deal with a last line without a line ending: a complete row
+# (one written by hand or by another tool) gets its line ending, a torn one
+# left by an earlier crash is truncated away. Returns the new size.
+def _end_last_line(file, size, columns, terminator):
+    start = _last_newline_end(file, size)
+    file.seek(start)
+    tail = file.read(size - start)
+    try:
+        records = list(csv.reader(io.StringIO(tail.decode(), newline='')))
+    except (UnicodeDecodeError, csv.Error):
+        records = []
+    if len(records) == 1 and len(records[0]) == columns:
+        ending = b'\n' if tail.endswith(b'\r') else terminator.encode()
+        file.seek(size)
+        file.write(ending)
+        return size + len(ending)
+    print(f"Dropping a torn last line of {len(tail)} bytes from {file.name}.")
+    file.truncate(start)
+    return start
+
+def _last_newline_end(file, size, block=4096):
+    position = size
+    while position > 0:
+        start = max(0, position - block)
+        file.seek(start)
+        chunk = file.read(position - start)
+        index = chunk.rfind(b'\n')
+        if index >= 0:
+            return start + index + 1
+        position = start
+    return 0
+
+# Function to read the last n rows as dicts by reading backwards from the end
+# of the file, without parsing the rest of it
+def tail_rows(path, n=5, block=8192):
+    header = read_header(path)
+    if header is None:
+        return []
+    with open(path, 'rb') as file:
+        end = file.seek(0, os.SEEK_END)
+        position = end
+        data = b''
+        while position > 0 and data.count(b'\n') <= n:
+            start = max(0, position - block)
+            file.seek(start)
+            data = file.read(position - start) + data
+            position = start
+    lines = data.decode().splitlines()
+    if position == 0:
+        lines = lines[1:]
+    elif len(lines) > n:
+        lines = lines[1:]  # first line may be partial
+    return [dict(zip(header, values)) for values in csv.reader(lines[-n:])] if n else []
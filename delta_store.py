@@ -0,0 +1,273 @@
+import bisect
+import csv
+import json
+import os
+import struct
+import sys
+from array import array
+from datetime import datetime, timedelta
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+
+# Append-only store for high-frequency snapshots, where most values repeat
+# from one row to the next.
+#
+# Rows are records in <series>.bin, encoded in the style of Gorilla
+# (Facebook's in-memory TSDB), byte-aligned:
+# - times are unix seconds stored as the zigzag varint delta-of-delta, one
+#   byte for a steady sampling interval
+# - a value is stored only when it changed, as the XOR of its float64 bits
+#   with the previous value's: a byte of leading zero bytes and length, then
+#   the bytes between the leading and trailing zero bytes
+# - a row with no changes is two bytes, a row with changes carries a bitmap
+#   of the changed columns
+# Every DELTA_KEYFRAME_INTERVAL rows a keyframe stores the full row, and its
+# time and offset go into <series>.keyframes.bin. A range read seeks to the
+# keyframe before its start and decodes forward from there.
+#
+# <series>.json holds the columns, the committed length and the encoder
+# state. It is written last, so a crash during an append leaves only a file
+# tail that is ignored and overwritten. 'Unknown' values round-trip as a
+# reserved NaN.
+
+STORE_DIR = os.getenv("DELTA_STORE_DIR", "delta_store")
+KEYFRAME_INTERVAL = int(os.getenv("DELTA_KEYFRAME_INTERVAL", "360"))
+
+DELTA, KEYFRAME, UNCHANGED = 0, 1, 2
+UNKNOWN_BITS = 0x7ff8000000000001
+EPOCH = datetime(1970, 1, 1)
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+def _to_bits(value):
+    try:
+        return struct.unpack('<Q', struct.pack('<d', float(value)))[0]
+    except (TypeError, ValueError):
+        return UNKNOWN_BITS
+
+def _from_bits(bits):
+    if bits == UNKNOWN_BITS:
+        return 'Unknown'
+    return struct.unpack('<d', struct.pack('<Q', bits))[0]
+
+def _write_varint(out, value):
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def _read_varint(data, pos):
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+def _zigzag(value):
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+def _unzigzag(value):
+    return value >> 1 if not value & 1 else -(value >> 1) - 1
+
+# Function to write the XOR of two float64 bit patterns: (leading zero bytes
+# << 4 | meaningful bytes), then the meaningful bytes
+def _write_xor(out, xor):
+    raw = xor.to_bytes(8, 'big')
+    stripped = raw.lstrip(b'\0')
+    lead = 8 - len(stripped)
+    meaningful = stripped.rstrip(b'\0')
+    out.append(lead << 4 | len(meaningful))
+    out += meaningful
+
+def _read_xor(data, pos):
+    header = data[pos]
+    lead, length = header >> 4, header & 0x0f
+    end = pos + 1 + length
+    return int.from_bytes(data[pos + 1:end], 'big') << (8 * (8 - lead - length)), end
+
+def to_epoch(date):
+    return int((datetime.fromisoformat(date) - EPOCH).total_seconds())
+
+def from_epoch(seconds):
+    return (EPOCH + timedelta(seconds=seconds)).strftime(DATE_FORMAT)
+
+class DeltaStore:
+    def __init__(self, series='token_and_contract_data', directory=STORE_DIR, keyframe_interval=KEYFRAME_INTERVAL):
+        self.directory = directory
+        self.series = series
+        self.keyframe_interval = keyframe_interval
+        self.meta = {'columns': [], 'length': 0, 'rows': 0, 'keyframes': 0,
+                     'since_keyframe': 0, 'last_time': None, 'last_delta': 0, 'last_bits': []}
+        if os.path.exists(self._path('json')):
+            with open(self._path('json')) as file:
+                self.meta = json.load(file)
+
+    def _path(self, suffix):
+        return os.path.join(self.directory, f"{self.series}.{suffix}")
+
+    def __len__(self):
+        return self.meta['rows']
+
+    # Function to encode rows ({'date', column: value}) after the stored ones.
+    # Rows at or before the last stored time are skipped. Returns the number
+    # of rows added.
+    def append(self, rows):
+        # The encoder state is updated on a copy and kept only once committed
+        meta = dict(self.meta)
+        out = bytearray()
+        keyframes = []
+        added = 0
+        for row in sorted(rows, key=lambda row: row['date']):
+            t = to_epoch(row['date'])
+            if meta['last_time'] is not None and t <= meta['last_time']:
+                print(f"Skipping {row['date']}: the delta store is already at {from_epoch(meta['last_time'])}.")
+                continue
+            new_columns = [column for column in row if column != 'date' and column not in meta['columns']]
+            if new_columns:
+                meta['columns'] = meta['columns'] + new_columns
+                meta['last_bits'] = meta['last_bits'] + [UNKNOWN_BITS] * len(new_columns)
+            bits = [_to_bits(row.get(column, 'Unknown')) for column in meta['columns']]
+            if meta['last_time'] is None or new_columns or meta['since_keyframe'] >= self.keyframe_interval:
+                keyframes.append((t, meta['length'] + len(out)))
+                out.append(KEYFRAME)
+                _write_varint(out, len(bits))
+                _write_varint(out, t)
+                for value in bits:
+                    _write_xor(out, value)
+                meta['last_delta'] = 0
+                meta['since_keyframe'] = 0
+            else:
+                delta = t - meta['last_time']
+                changed = [i for i, value in enumerate(bits) if value != meta['last_bits'][i]]
+                out.append(DELTA if changed else UNCHANGED)
+                _write_varint(out, _zigzag(delta - meta['last_delta']))
+                if changed:
+                    bitmap = 0
+                    for i in changed:
+                        bitmap |= 1 << i
+                    out += bitmap.to_bytes((len(bits) + 7) // 8, 'little')
+                    for i in changed:
+                        _write_xor(out, bits[i] ^ meta['last_bits'][i])
+                meta['last_delta'] = delta
+            meta['last_time'] = t
+            meta['last_bits'] = bits
+            meta['since_keyframe'] += 1
+            added += 1
+        if added:
+            meta['length'] += len(out)
+            meta['keyframes'] += len(keyframes)
+            meta['rows'] += added
+            self._commit(meta, out, keyframes)
+        return added
+
+    def _write_at(self, path, offset, data):
+        with open(path, 'r+b' if os.path.exists(path) else 'wb') as file:
+            file.seek(offset)
+            file.truncate()
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+
+    # Function to append the encoded rows and keyframe entries past the
+    # committed lengths, then write the metadata, which is the commit point
+    def _commit(self, meta, out, keyframes):
+        os.makedirs(self.directory, exist_ok=True)
+        self._write_at(self._path('bin'), self.meta['length'], out)
+        if keyframes:
+            entries = array('q', [value for entry in keyframes for value in entry])
+            self._write_at(self._path('keyframes.bin'), self.meta['keyframes'] * 2 * entries.itemsize, entries.tobytes())
+        temp_path = self._path('json.tmp')
+        with open(temp_path, 'w') as file:
+            json.dump(meta, file)
+        os.replace(temp_path, self._path('json'))
+        self.meta = meta
+
+    def _keyframes(self):
+        entries = array('q')
+        if self.meta['keyframes']:
+            with open(self._path('keyframes.bin'), 'rb') as file:
+                entries.fromfile(file, self.meta['keyframes'] * 2)
+        return entries[0::2], entries[1::2]
+
+    # Function to rebuild the full rows with start <= date < end (date strings,
+    # None for open ends), optionally only some columns
+    def read(self, start=None, end=None, columns=None):
+        if not self.meta['rows']:
+            return
+        times, offsets = self._keyframes()
+        low = to_epoch(start) if start else None
+        high = to_epoch(end) if end else None
+        first = max(bisect.bisect_right(times, low) - 1, 0) if low is not None else 0
+        last = bisect.bisect_left(times, high) if high is not None else len(times)
+        stop = offsets[last] if last < len(offsets) else self.meta['length']
+        with open(self._path('bin'), 'rb') as file:
+            file.seek(offsets[first])
+            data = file.read(stop - offsets[first])
+        names = self.meta['columns']
+        wanted = [(i, name) for i, name in enumerate(names) if columns is None or name in columns]
+        bits = []
+        t = delta = 0
+        pos = 0
+        while pos < len(data):
+            kind = data[pos]
+            pos += 1
+            if kind == KEYFRAME:
+                count, pos = _read_varint(data, pos)
+                t, pos = _read_varint(data, pos)
+                delta = 0
+                bits = []
+                for _ in range(count):
+                    value, pos = _read_xor(data, pos)
+                    bits.append(value)
+            else:
+                dod, pos = _read_varint(data, pos)
+                delta += _unzigzag(dod)
+                t += delta
+                if kind == DELTA:
+                    width = (len(bits) + 7) // 8
+                    bitmap = int.from_bytes(data[pos:pos + width], 'little')
+                    pos += width
+                    while bitmap:
+                        i = (bitmap & -bitmap).bit_length() - 1
+                        xor, pos = _read_xor(data, pos)
+                        bits[i] ^= xor
+                        bitmap &= bitmap - 1
+            if low is not None and t < low:
+                continue
+            if high is not None and t >= high:
+                return
+            row = {'date': from_epoch(t)}
+            for i, name in wanted:
+                row[name] = _from_bits(bits[i]) if i < len(bits) else 'Unknown'
+            yield row
+
+    # Function to get the stored rows and bytes
+    def stats(self):
+        return {'rows': self.meta['rows'], 'bytes': self.meta['length'], 'keyframes': self.meta['keyframes'],
+                'columns': len(self.meta['columns'])}
+
+# Function to load a CSV history into the store, e.g. to compare sizes
+def import_csv(store, path='token_and_contract_data.csv'):
+    with open(path, newline='') as file:
+        return store.append(list(csv.DictReader(file)))
+
+if __name__ == "__main__":
+    store = DeltaStore()
+    if len(sys.argv) > 1 and sys.argv[1] == 'import':
+        path = sys.argv[2] if len(sys.argv) > 2 else 'token_and_contract_data.csv'
+        print(f"Added {import_csv(store, path)} rows from {path}.")
+    elif len(sys.argv) > 1 and sys.argv[1] == 'export':
+        # python delta_store.py export [start] [end] > rows.csv
+        rows = store.read(*sys.argv[2:4])
+        writer = csv.DictWriter(sys.stdout, fieldnames=['date'] + store.meta['columns'])
+        writer.writeheader()
+        writer.writerows(rows)
+    else:
+        stats = store.stats()
+        per_row = stats['bytes'] / stats['rows'] if stats['rows'] else 0
+        print(f"{stats['rows']} rows of {stats['columns']} columns in {stats['bytes']} bytes "
+              f"({per_row:.1f} bytes per row, {stats['keyframes']} keyframes)")
@@ -0,0 +1,201 @@
+import json
+import os
+import sys
+import time
+from urllib.parse import urlparse
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+
+# Registry of the chains and explorers the collectors run against, and a
+# runner that collects many of them in parallel.
+#
+# deployments.json maps a deployment name to its explorer, stats explorer,
+# RPC and WebSocket URLs, rate limits, Dune namespace and tables, and
+# optionally its tokens, vaults and snapshot columns (see README). Settings
+# left out keep the built-in Q mainnet values.
+#
+# The collectors read their settings once at import, so every (deployment,
+# job) runs as its own child interpreter with the deployment's environment:
+# the URLs and limits as the usual variables, and the token and vault lists
+# as JSON in DEPLOYMENT_CONFIG. Each child runs in the deployment's
+# directory, so its CSVs, caches, checkpoints and outbox are separate. At
+# most DEPLOYMENT_WORKERS children run at a time; a deployment's jobs run
+# one after another. A host several deployments call (CoinGecko, or a
+# shared explorer) has its requests-per-second budget split between the
+# deployments that may run at the same time, as each child keeps its own
+# token bucket.
+
+REGISTRY_PATH = os.getenv("DEPLOYMENTS_FILE", "deployments.json")
+DATA_ROOT = os.getenv("DEPLOYMENTS_DIR", "deployments")
+WORKERS = int(os.getenv("DEPLOYMENT_WORKERS", str(os.cpu_count() or 4)))
+JOBS = ['tvl_data', 'onchain_stats', 'mintandburn']
+
+# Environment variable set from each deployment setting
+URL_VARIABLES = {
+    'explorer_url': 'EXPLORER_URL',
+    'stats_explorer_url': 'STATS_EXPLORER_URL',
+    'rpc_url': 'Q_RPC_URL',
+    'ws_url': 'Q_WS_URL',
+    'coingecko_url': 'COINGECKO_URL',
+}
+# URL setting and default of each rate limit; 'default' covers other hosts
+RATE_LIMIT_URLS = {
+    'explorer': ('explorer_url', "https://explorer.q.org"),
+    'stats_explorer': ('stats_explorer_url', "https://stats.explorer.q.org"),
+    'coingecko': ('coingecko_url', "https://api.coingecko.com"),
+    'rpc': ('rpc_url', "https://rpc.q.org"),
+}
+# Variable and default of each rate limit's budget, as in fetch_engine.py
+RATE_LIMIT_DEFAULTS = {
+    'explorer': ('EXPLORER_RPS', "5"),
+    'stats_explorer': ('STATS_EXPLORER_RPS', "5"),
+    'coingecko': ('COINGECKO_RPS', "0.5"),
+    'rpc': ('RPC_RPS', "20"),
+}
+# Dune table variable of each table setting; rollup tables use TABLE_NAME_<TABLE>
+TABLE_VARIABLES = {
+    'tvl': 'TABLE_NAME2',
+    'general_stats': 'TABLE_NAME1',
+    'transactions_growth': 'TABLE_NAME3',
+    'active_accounts': 'TABLE_NAME4',
+    'mint_burn': 'TABLE_NAME_MINT_BURN',
+}
+
+_current = None
+
+# Function to get a setting of the deployment this process collects for, or
+# default outside the runner (the Q mainnet values in each module)
+def setting(key, default=None):
+    global _current
+    if _current is None:
+        _current = json.loads(os.getenv("DEPLOYMENT_CONFIG") or "{}")
+    value = _current.get(key)
+    return default if value is None else value
+
+# Function to read the registry, rejecting settings the runner cannot apply
+def load_registry(path=REGISTRY_PATH):
+    with open(path) as file:
+        registry = json.load(file)
+    for name, config in registry.items():
+        validate(name, config)
+    return registry
+
+def validate(name, config):
+    unknown = set(config.get('rate_limits', {})) - set(RATE_LIMIT_URLS) - {'default'}
+    if unknown:
+        raise ValueError(f"Deployment {name} has unknown rate_limits {', '.join(sorted(unknown))}; "
+                         f"expected {', '.join(sorted(RATE_LIMIT_URLS))} or default")
+
+def _host(config, key):
+    url_key, default_url = RATE_LIMIT_URLS[key]
+    return urlparse(config.get(url_key) or default_url).hostname
+
+# Function to get, for each rate-limited host, how many of the deployments
+# may call it at the same time (at most workers of them run at once)
+def host_shares(registry, workers=WORKERS):
+    counts = {}
+    for config in registry.values():
+        for host in {_host(config, key) for key in RATE_LIMIT_URLS}:
+            counts[host] = counts.get(host, 0) + 1
+    return {host: min(count, max(1, workers)) for host, count in counts.items()}
+
+def directory(name, config):
+    return config.get('directory') or os.path.join(DATA_ROOT, name)
+
+# Function to build the environment of a deployment's child processes.
+# shares ({host: deployments}, see host_shares) splits the budget of hosts
+# other deployments use too.
+def child_env(name, config, base=None, shares=None):
+    validate(name, config)
+    env = dict(os.environ if base is None else base)
+    env['DEPLOYMENT'] = name
+    env['DEPLOYMENT_CONFIG'] = json.dumps(config)
+    for key, variable in URL_VARIABLES.items():
+        if config.get(key):
+            env[variable] = config[key]
+    # Budgets are per host and per child process, so a host's budget is
+    # divided by the number of deployments calling it at the same time
+    rate_limits = config.get('rate_limits', {})
+    if 'default' in rate_limits:
+        env['DEFAULT_RPS'] = str(rate_limits['default'])
+    host_rps = {}
+    for key in RATE_LIMIT_URLS:
+        host = _host(config, key)
+        variable, default = RATE_LIMIT_DEFAULTS[key]
+        rps = float(rate_limits.get(key, config.get('env', {}).get(variable, env.get(variable, default))))
+        host_rps[host] = rps / (shares or {}).get(host, 1)
+    env['HOST_RPS'] = json.dumps(host_rps)
+    # Without a dune section the deployment uploads with the .env settings;
+    # with one, nothing of the .env namespace is passed on
+    dune = config.get('dune')
+    if dune is not None:
+        env['NAMESPACE1'] = env['NAMESPACE2'] = dune.get('namespace', '')
+        env['DUNE_API_KEY'] = env['DUNE_API_KEY2'] = os.getenv(dune.get('api_key_env', ''), '')
+        for variable in set(TABLE_VARIABLES.values()) | {name for name in env if name.startswith('TABLE_NAME')}:
+            env[variable] = ''
+    for table, table_name in (dune or {}).get('tables', {}).items():
+        env[TABLE_VARIABLES.get(table, f"TABLE_NAME_{table.upper()}")] = table_name
+    env.update({key: str(value) for key, value in config.get('env', {}).items()})
+    # The scripts are imported from the repository, wherever the child runs
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [os.path.dirname(os.path.abspath(__file__)), env.get('PYTHONPATH')]))
+    return env
+
+# Function to run one job of a deployment in a child interpreter. Its output
+# goes to <directory>/logs/<job>.log. Returns (job, exit status, seconds).
+def run_job(name, config, job, shares=None):
+    import subprocess
+    workdir = directory(name, config)
+    os.makedirs(os.path.join(workdir, 'logs'), exist_ok=True)
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), f"{job}.py")
+    started = time.monotonic()
+    with open(os.path.join(workdir, 'logs', f"{job}.log"), 'a') as log:
+        log.write(f"--- {time.strftime('%Y-%m-%d %H:%M:%S')} {name} {job}\n")
+        log.flush()
+        result = subprocess.run([sys.executable, script], cwd=workdir, env=child_env(name, config, shares=shares),
+                                stdout=log, stderr=subprocess.STDOUT)
+    return job, result.returncode, time.monotonic() - started
+
+# Function to run a deployment's jobs one after another
+def run_deployment(name, config, jobs=None, shares=None):
+    results = []
+    for job in jobs or config.get('jobs', JOBS):
+        results.append(run_job(name, config, job, shares))
+        print(f"{name} {job}: {'ok' if results[-1][1] == 0 else f'exit {results[-1][1]}'} in {results[-1][2]:.1f}s")
+    return results
+
+# Function to run the enabled deployments, at most workers at a time.
+# Returns {name: [(job, exit status, seconds)]}.
+def run_all(registry, names=None, jobs=None, workers=WORKERS):
+    from concurrent.futures import ThreadPoolExecutor
+    selected = {name: config for name, config in registry.items()
+                if (name in names if names else config.get('enabled', True))}
+    shares = host_shares(selected, workers)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {name: pool.submit(run_deployment, name, config, jobs, shares) for name, config in selected.items()}
+        return {name: future.result() for name, future in futures.items()}
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Run the collectors for every deployment in the registry.")
+    parser.add_argument('--registry', default=REGISTRY_PATH)
+    parser.add_argument('--only', help="comma-separated deployment names (disabled ones included)")
+    parser.add_argument('--jobs', help=f"comma-separated jobs instead of each deployment's list ({','.join(JOBS)})")
+    parser.add_argument('--workers', type=int, default=WORKERS)
+    parser.add_argument('--list', action='store_true', help="print the deployments and exit")
+    args = parser.parse_args()
+
+    registry = load_registry(args.registry)
+    if args.list:
+        for name, config in registry.items():
+            state = 'enabled' if config.get('enabled', True) else 'disabled'
+            print(f"{name}: {state}, jobs {','.join(config.get('jobs', JOBS))}, directory {directory(name, config)}")
+        sys.exit(0)
+    started = time.monotonic()
+    results = run_all(registry, args.only.split(',') if args.only else None,
+                      args.jobs.split(',') if args.jobs else None, args.workers)
+    failed = [f"{name}/{job}" for name, runs in results.items() for job, status, _ in runs if status != 0]
+    print(f"Ran {sum(len(runs) for runs in results.values())} jobs for {len(results)} deployments "
+          f"in {time.monotonic() - started:.1f}s, {len(failed)} failed{': ' + ', '.join(failed) if failed else ''}")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,38 @@
+import requests
+import os
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    # rollups reads the TABLE_NAME_* variables when it is imported
+    load_dotenv()
+
+from rollups import TABLES, DUNE_TABLES, DUNE_CREDENTIALS
+
+# URL to create the table on Dune
+url = "https://api.dune.com/api/v1/table/create"
+
+# Bucket keys and updated_at are timestamps, every other rollup column is a double
+TIMESTAMP_COLUMNS = {'day', 'week_start', 'month_start', 'month_end', 'updated_at'}
+
+# Create one Dune table per rollup that has a TABLE_NAME_<ROLLUP> in .env
+for table, columns in TABLES.items():
+    table_name = DUNE_TABLES[table]
+    if not table_name:
+        print(f"TABLE_NAME_{table.upper()} not set. Skipping {table}.")
+        continue
+    # Each table is created where its collector uploads it
+    namespace_var, api_key_var = DUNE_CREDENTIALS[table]
+    headers = {
+        "X-DUNE-API-KEY": os.getenv(api_key_var),
+        "Content-Type": "application/json"
+    }
+    payload = {
+        "namespace": os.getenv(namespace_var),
+        "table_name": table_name,
+        "description": f"Pre-aggregated {table.replace('_', ' ')} rollup. Use the row with the latest updated_at per bucket.",
+        "schema": [{"name": column, "type": "timestamp" if column in TIMESTAMP_COLUMNS else "double"} for column in columns],
+        "is_private": False
+    }
+    response = requests.post(url, json=payload, headers=headers)
+    print(table, response.status_code)
+    print(response.text)
@@ -0,0 +1,147 @@
+import csv
+import gzip
+import io
+import json
+import os
+import sqlite3
+import sys
+import time
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+
+import http_client
+import metrics
+
+# Durable queue of rows waiting to be inserted into Dune tables.
+#
+# Collectors enqueue each new row with a row-identity key. Enqueueing the same
+# (namespace, table, key) twice is a no-op, so re-running a collector never
+# uploads a row twice. flush() sends pending rows in gzipped CSV batches and
+# marks them acknowledged only after Dune returns success. Failed batches stay
+# pending for the next run. Acknowledged keys are kept, without their payload,
+# so a row that was already delivered is not enqueued again.
+#
+# One gap remains: if Dune accepts a batch and the process dies before the
+# acknowledgement is committed, that batch is sent again on the next flush.
+
+DB_PATH = os.getenv("DUNE_OUTBOX_DB", "dune_outbox.sqlite")
+BATCH_SIZE = int(os.getenv("DUNE_BATCH_SIZE", "5000"))
+USE_GZIP = os.getenv("DUNE_GZIP", "1") == "1"
+MAX_BATCHES_PER_FLUSH = int(os.getenv("DUNE_MAX_BATCHES_PER_FLUSH", "100"))
+DUNE_API_URL = os.getenv("DUNE_API_URL", "https://api.dune.com")
+
+def connect(path=DB_PATH):
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            namespace TEXT NOT NULL,
+            table_name TEXT NOT NULL,
+            row_key TEXT NOT NULL,
+            header TEXT NOT NULL,
+            payload TEXT,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            enqueued_at REAL NOT NULL,
+            acked_at REAL,
+            UNIQUE (namespace, table_name, row_key)
+        );
+        CREATE INDEX IF NOT EXISTS outbox_pending ON outbox (status, namespace, table_name, header, id);
+    """)
+    return conn
+
+def _encode_line(fieldnames, row):
+    buffer = io.StringIO()
+    csv.DictWriter(buffer, fieldnames=fieldnames, lineterminator='\n', extrasaction='ignore').writerow(row)
+    return buffer.getvalue()
+
+# Function to queue rows for a Dune table. key is a list of field names or a
+# function of the row that identifies it. Returns the number of newly queued rows.
+def enqueue(conn, namespace, table_name, fieldnames, rows, key):
+    if not rows:
+        return 0
+    if not namespace or not table_name:
+        print(f"Dune namespace/table not configured. Not queuing {len(rows)} rows.")
+        return 0
+    key_of = key if callable(key) else (lambda row: '|'.join(str(row[field]) for field in key))
+    header = json.dumps(list(fieldnames))
+    now = time.time()
+    before = conn.total_changes
+    conn.executemany(
+        "INSERT OR IGNORE INTO outbox (namespace, table_name, row_key, header, payload, enqueued_at) VALUES (?, ?, ?, ?, ?, ?)",
+        [(namespace, table_name, key_of(row), header, _encode_line(fieldnames, row), now) for row in rows])
+    conn.commit()
+    return conn.total_changes - before
+
+def pending_count(conn):
+    return conn.execute("SELECT COUNT(*) FROM outbox WHERE status = 'pending'").fetchone()[0]
+
+def _send(namespace, table_name, body, api_key):
+    url = f"{DUNE_API_URL}/api/v1/table/{namespace}/{table_name}/insert"
+    headers = {"X-DUNE-API-KEY": api_key, "Content-Type": "text/csv"}
+    if USE_GZIP:
+        # mtime=0 keeps the same rows byte-identical, e.g. for recorded runs
+        body = gzip.compress(body, mtime=0)
+        headers["Content-Encoding"] = "gzip"
+    response = http_client.post(url, data=body, headers=headers)
+    metrics.inc('dune_upload_bytes', len(body), table=f"{namespace}/{table_name}")
+    print(f"Upload response for {namespace}/{table_name} ({len(body)} bytes): {response.text}")
+    return response
+
+# Function to upload the pending rows of one namespace in batches. Returns the
+# number of rows acknowledged.
+def flush(conn, namespace, api_key, batch_size=BATCH_SIZE, max_batches=MAX_BATCHES_PER_FLUSH):
+    acked = 0
+    groups = conn.execute(
+        "SELECT DISTINCT namespace, table_name, header FROM outbox WHERE status = 'pending' AND namespace = ?",
+        (namespace,)).fetchall()
+    for namespace, table_name, header in groups:
+        fieldnames = json.loads(header)
+        while max_batches > 0:
+            batch = conn.execute(
+                "SELECT id, payload FROM outbox WHERE status = 'pending' AND namespace = ? AND table_name = ? AND header = ? "
+                "ORDER BY id LIMIT ?", (namespace, table_name, header, batch_size)).fetchall()
+            if not batch:
+                break
+            max_batches -= 1
+            ids = [row_id for row_id, _ in batch]
+            body = (','.join(fieldnames) + '\n' + ''.join(payload for _, payload in batch)).encode()
+            placeholders = ','.join('?' for _ in ids)
+            try:
+                _send(namespace, table_name, body, api_key)
+            except http_client.FetchError as e:
+                print(f"Upload to {namespace}/{table_name} failed, {len(ids)} rows stay queued: {e}")
+                conn.execute(f"UPDATE outbox SET attempts = attempts + 1 WHERE id IN ({placeholders})", ids)
+                conn.commit()
+                break
+            conn.execute(f"UPDATE outbox SET status = 'acked', payload = NULL, acked_at = ?, attempts = attempts + 1 "
+                         f"WHERE id IN ({placeholders})", [time.time()] + ids)
+            conn.commit()
+            acked += len(ids)
+            metrics.inc('dune_rows_uploaded', len(ids), table=f"{namespace}/{table_name}")
+    return acked
+
+# Function to queue rows and then try to deliver everything pending
+def enqueue_and_flush(namespace, table_name, fieldnames, rows, key, api_key):
+    conn = connect()
+    try:
+        enqueue(conn, namespace, table_name, fieldnames, rows, key)
+        return flush(conn, namespace, api_key)
+    finally:
+        conn.close()
+
+# API key for each namespace used by the collectors
+NAMESPACE_KEYS = {
+    os.getenv("NAMESPACE1"): os.getenv("DUNE_API_KEY"),
+    os.getenv("NAMESPACE2"): os.getenv("DUNE_API_KEY2"),
+}
+
+if __name__ == "__main__":
+    conn = connect()
+    if len(sys.argv) > 1 and sys.argv[1] == "flush":
+        for namespace, api_key in NAMESPACE_KEYS.items():
+            if namespace:
+                print(f"Acknowledged {flush(conn, namespace, api_key)} rows for {namespace}.")
+    print(f"{pending_count(conn)} rows pending.")
@@ -0,0 +1,97 @@
+import hashlib
+import json
+import os
+import sys
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+
+import dune_outbox
+import http_client
+import tvl_metrics
+
+# Creates the long-format Dune tables of tvl_metrics.py and keeps the metric
+# catalog table in step with tvl_metrics.CATALOG.
+#
+# Each table's schema is recorded in dune_tables.json when it is created, so
+# running this again only creates what is missing. Dune tables cannot be
+# altered; a recorded schema that no longer matches is reported instead.
+# Adding a metric changes no schema: its samples go into the same
+# (timestamp, metric_id, value) table and its description into the catalog.
+
+STATE_PATH = os.getenv("DUNE_TABLES_STATE", "dune_tables.json")
+DUNE_API_KEY = os.getenv("DUNE_API_KEY2")
+NAMESPACE = os.getenv("NAMESPACE2")
+
+# name -> (Dune table name, description, schema)
+TABLES = {
+    'tvl_metrics': (tvl_metrics.DUNE_TABLE, "TVL metrics in long format. A metric's value at a time is its latest "
+                    "sample at or before it; unchanged values are sampled at least daily.",
+                    [{"name": "timestamp", "type": "timestamp"}, {"name": "metric_id", "type": "varchar"},
+                     {"name": "value", "type": "double"}]),
+    'metric_catalog': (tvl_metrics.CATALOG_DUNE_TABLE, "Units and descriptions of the metrics in the TVL metrics "
+                       "table. Use the row with the latest updated_at per metric_id.",
+                       [{"name": "metric_id", "type": "varchar"}, {"name": "unit", "type": "varchar"},
+                        {"name": "description", "type": "varchar"}, {"name": "source_column", "type": "varchar"},
+                        {"name": "updated_at", "type": "timestamp"}]),
+}
+
+def _schema_hash(schema):
+    return hashlib.sha256(json.dumps(schema, sort_keys=True).encode()).hexdigest()[:16]
+
+def read_state():
+    try:
+        with open(STATE_PATH) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+
+def write_state(state):
+    temp_path = STATE_PATH + '.tmp'
+    with open(temp_path, 'w') as file:
+        json.dump(state, file, indent=2)
+    os.replace(temp_path, STATE_PATH)
+
+def create_table(namespace, table_name, description, schema, api_key):
+    payload = {"namespace": namespace, "table_name": table_name, "description": description,
+               "schema": schema, "is_private": False}
+    headers = {"X-DUNE-API-KEY": api_key, "Content-Type": "application/json"}
+    try:
+        response = http_client.post(f"{dune_outbox.DUNE_API_URL}/api/v1/table/create", json=payload, headers=headers)
+    except http_client.FetchError as e:
+        if e.status != 409:
+            raise
+        print(f"{namespace}/{table_name} already exists.")
+        return
+    print(f"Created {namespace}/{table_name}: {response.status_code} {response.text}")
+
+# Function to create the tables that are not recorded yet. Returns the names
+# of tables whose recorded schema differs from TABLES.
+def ensure_tables(namespace=NAMESPACE, api_key=DUNE_API_KEY):
+    state = read_state()
+    mismatched = []
+    for name, (table_name, description, schema) in TABLES.items():
+        if not table_name:
+            print(f"Dune table for {name} not configured. Skipping.")
+            continue
+        key = f"{namespace}/{table_name}"
+        schema_hash = _schema_hash(schema)
+        if key not in state:
+            create_table(namespace, table_name, description, schema, api_key)
+            state[key] = schema_hash
+            write_state(state)
+        elif state[key] != schema_hash:
+            print(f"{key} was created with another schema. Dune tables cannot be altered: "
+                  f"create a new table and point the TABLE_NAME setting at it.")
+            mismatched.append(key)
+    return mismatched
+
+if __name__ == "__main__":
+    mismatched = ensure_tables()
+    outbox = dune_outbox.connect()
+    queued = tvl_metrics.enqueue_catalog(outbox, NAMESPACE)
+    uploaded = dune_outbox.flush(outbox, NAMESPACE, DUNE_API_KEY)
+    print(f"Queued {queued} catalog rows, uploaded {uploaded} rows.")
+    outbox.close()
+    sys.exit(1 if mismatched else 0)
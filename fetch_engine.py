@@ -0,0 +1,68 @@
+import json
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+# Requests-per-second budget per host. Hosts not listed use DEFAULT_RPS.
+DEFAULT_RPS = float(os.getenv("DEFAULT_RPS", "5"))
+HOST_RPS = {
+    "explorer.q.org": float(os.getenv("EXPLORER_RPS", "5")),
+    "stats.explorer.q.org": float(os.getenv("STATS_EXPLORER_RPS", "5")),
+    "api.coingecko.com": float(os.getenv("COINGECKO_RPS", "0.5")),
+    urlparse(os.getenv("Q_RPC_URL", "https://rpc.q.org")).hostname: float(os.getenv("RPC_RPS", "20")),
+}
+# More budgets as JSON {"host": rps}, e.g. for another deployment's explorer (see deployments.py)
+HOST_RPS.update(json.loads(os.getenv("HOST_RPS") or "{}"))
+MAX_WORKERS = int(os.getenv("FETCH_MAX_WORKERS", "16"))
+
+# Token bucket: refills `rate` tokens per second up to `capacity`,
+# each request takes one token and waits if none is left
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+# Function to get the shared rate limiter for a host
+def get_bucket(host):
+    with _buckets_lock:
+        if host not in _buckets:
+            _buckets[host] = TokenBucket(HOST_RPS.get(host, DEFAULT_RPS))
+        return _buckets[host]
+
+# Function to run fetch(url) for one URL after waiting for its host's budget
+def rate_limited_fetch(url, fetch):
+    get_bucket(urlparse(url).hostname).acquire()
+    return fetch(url)
+
+# Function to fetch a dict of {name: url} concurrently, returns {name: result}.
+# With rate_limit=False, fetch is expected to call rate_limited_fetch itself
+# (e.g. only on a cache miss).
+def fetch_all(urls, fetch, max_workers=MAX_WORKERS, rate_limit=True):
+    if not urls:
+        return {}
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(urls))) as pool:
+        if rate_limit:
+            futures = {name: pool.submit(rate_limited_fetch, url, fetch) for name, url in urls.items()}
+        else:
+            futures = {name: pool.submit(fetch, url) for name, url in urls.items()}
+        return {name: future.result() for name, future in futures.items()}
@@ -0,0 +1,177 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import http_client
+import metrics
+
+# On-disk HTTP response stores, used by http_client for two things:
+#
+# - Conditional GETs (http_client.get_json(url, conditional=True)): the last
+#   body of a URL is kept with its ETag and Last-Modified, and the next
+#   request carries If-None-Match / If-Modified-Since. On 304 the stored body
+#   is used; in a long-running process its parsed JSON is reused as well, so
+#   an unchanged chart costs one empty response.
+# - Record/replay (HTTP_RECORD_MODE=record or replay): every response of a
+#   run is saved under HTTP_RECORD_DIR, and a replayed run gets the same
+#   responses without touching the network.
+#
+# Bodies are stored once per content hash under <dir>/objects/, and an
+# SQLite index maps request keys to (status, headers, body hash).
+
+CACHE_DIR = os.getenv("HTTP_CACHE_DIR", "http_cache")
+RECORD_DIR = os.getenv("HTTP_RECORD_DIR", "http_recording")
+# Parsed JSON bodies kept in memory, by content hash
+PARSED_CACHE_SIZE = int(os.getenv("HTTP_CACHE_PARSED_ENTRIES", "32"))
+
+# Response headers worth keeping: validators and what callers read
+KEPT_HEADERS = ['Content-Type', 'ETag', 'Last-Modified', 'Retry-After']
+
+def digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+# Content-addressed response store in one directory
+class ContentStore:
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(os.path.join(directory, 'objects'), exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(directory, 'index.sqlite'), check_same_thread=False)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, status INTEGER NOT NULL, "
+                          "headers TEXT NOT NULL, digest TEXT NOT NULL, stored_at REAL NOT NULL)")
+        self.conn.commit()
+        self.lock = threading.Lock()
+
+    def _object_path(self, body_digest):
+        return os.path.join(self.directory, 'objects', body_digest[:2], body_digest[2:])
+
+    def read_body(self, body_digest):
+        with open(self._object_path(body_digest), 'rb') as file:
+            return file.read()
+
+    # Function to get (status, headers, body digest) stored under key, or None
+    def get(self, key):
+        with self.lock:
+            row = self.conn.execute("SELECT status, headers, digest FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None or not os.path.exists(self._object_path(row[2])):
+            return None
+        return row[0], json.loads(row[1]), row[2]
+
+    # Function to store a response under one or more keys, returns the body digest
+    def put(self, keys, status, headers, body):
+        body_digest = digest(body)
+        path = self._object_path(body_digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'wb') as file:
+                file.write(body)
+            os.replace(temp_path, path)
+        kept = {name: headers[name] for name in KEPT_HEADERS if headers.get(name) is not None}
+        with self.lock:
+            self.conn.executemany("INSERT OR REPLACE INTO responses (key, status, headers, digest, stored_at) "
+                                  "VALUES (?, ?, ?, ?, ?)",
+                                  [(key, status, json.dumps(kept), body_digest, time.time()) for key in keys])
+            self.conn.commit()
+        return body_digest
+
+    def close(self):
+        self.conn.close()
+
+_stores = {}
+_stores_lock = threading.Lock()
+_parsed = OrderedDict()
+_parsed_lock = threading.Lock()
+
+# Function to get the process-wide store of a directory
+def get_store(directory):
+    with _stores_lock:
+        if directory not in _stores:
+            _stores[directory] = ContentStore(directory)
+        return _stores[directory]
+
+def _parse(url, body_digest, body=None, store=None):
+    with _parsed_lock:
+        if body_digest in _parsed:
+            _parsed.move_to_end(body_digest)
+            return _parsed[body_digest]
+    if body is None:
+        body = store.read_body(body_digest)
+    try:
+        data = json.loads(body)
+    except ValueError as e:
+        raise http_client.FetchError(url, f"invalid JSON: {e}")
+    with _parsed_lock:
+        _parsed[body_digest] = data
+        while len(_parsed) > PARSED_CACHE_SIZE:
+            _parsed.popitem(last=False)
+    return data
+
+# Function to GET a JSON URL with If-None-Match / If-Modified-Since. The
+# result may be shared with earlier calls for the same body, so callers must
+# not modify it. On a 304 for the stored body with digest unchanged_digest
+# (one the caller has already processed) it returns None without reading it.
+def get_json(url, unchanged_digest=None, **kwargs):
+    store = get_store(CACHE_DIR)
+    cached = store.get(url)
+    headers = dict(kwargs.pop('headers', None) or {})
+    # A recorded run must hold full bodies, so record and replay skip validators
+    if cached and not http_client.RECORD_MODE:
+        _, cached_headers, _ = cached
+        if cached_headers.get('ETag'):
+            headers['If-None-Match'] = cached_headers['ETag']
+        if cached_headers.get('Last-Modified'):
+            headers['If-Modified-Since'] = cached_headers['Last-Modified']
+    response = http_client.get(url, headers=headers, **kwargs)
+    if response.status_code == 304 and cached:
+        metrics.inc('http_not_modified', endpoint=http_client.endpoint_key(url))
+        if unchanged_digest is not None and cached[2] == unchanged_digest:
+            return None
+        return _parse(url, cached[2], store=store)
+    body = response.content
+    if response.headers.get('ETag') or response.headers.get('Last-Modified'):
+        body_digest = store.put([url], response.status_code, response.headers, body)
+    else:
+        body_digest = digest(body)
+    return _parse(url, body_digest, body)
+
+# Function to get the digest of the body stored for a URL, or None
+def stored_digest(url):
+    cached = get_store(CACHE_DIR).get(url)
+    return cached[2] if cached else None
+
+def _request_keys(method, url, kwargs):
+    if kwargs.get('json') is not None:
+        body = json.dumps(kwargs['json'], sort_keys=True).encode()
+    else:
+        body = kwargs.get('data') or b''
+        body = body.encode() if isinstance(body, str) else body
+    # The exact request first; then the last response to the same method and
+    # URL, for bodies that change between runs (e.g. upload timestamps)
+    return [f"{method} {url} {digest(body)}", f"{method} {url}"]
+
+# Function to save a response of a recorded run
+def record(method, url, kwargs, response):
+    get_store(RECORD_DIR).put(_request_keys(method, url, kwargs), response.status_code, response.headers,
+                              response.content)
+
+# Function to answer a request from the recording, raises FetchError when the
+# run did not make it
+def replay(method, url, kwargs):
+    import requests
+    store = get_store(RECORD_DIR)
+    for key in _request_keys(method, url, kwargs):
+        entry = store.get(key)
+        if entry:
+            status, headers, body_digest = entry
+            response = requests.Response()
+            response.status_code = status
+            response.headers = requests.structures.CaseInsensitiveDict(headers)
+            response._content = store.read_body(body_digest)
+            response.url = url
+            response.encoding = 'utf-8'
+            return response
+    raise http_client.FetchError(url, f"no recorded response in {RECORD_DIR}")
@@ -0,0 +1,184 @@
+import os
+import random
+import re
+import threading
+import time
+from urllib.parse import urlparse
+import metrics
+
+# Timeouts in seconds, and retry settings shared by all collectors
+CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "30"))
+MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "4"))
+BACKOFF_BASE = float(os.getenv("HTTP_BACKOFF_BASE", "0.5"))
+BACKOFF_MAX = float(os.getenv("HTTP_BACKOFF_MAX", "30"))
+POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "16"))
+# 'record' saves every response under HTTP_RECORD_DIR, 'replay' answers from
+# there without network access (see http_cache.py)
+RECORD_MODE = os.getenv("HTTP_RECORD_MODE", "")
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Raised when a request still fails after all retries, so callers never
+# mistake a failed call for an empty result
+class FetchError(Exception):
+    def __init__(self, url, message, status=None):
+        super().__init__(f"{url}: {message}")
+        self.url = url
+        self.status = status
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+_stats = {}
+_stats_lock = threading.Lock()
+
+# Function to get the keep-alive session for a host, one pool per host
+def get_session(host):
+    with _sessions_lock:
+        if host not in _sessions:
+            # requests is imported on first use so that importing the collectors stays cheap
+            import requests
+            from requests.adapters import HTTPAdapter
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _sessions[host] = session
+        return _sessions[host]
+
+# Function to close all pooled sessions
+def close_sessions():
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+# Group URLs by host and path with addresses and numbers replaced, so
+# /tokens/0xabc.. and /tokens/0xdef.. count as one endpoint
+def endpoint_key(url):
+    parsed = urlparse(url)
+    path = re.sub(r"0x[0-9a-fA-F]+", "{address}", parsed.path)
+    path = re.sub(r"/\d+(?=/|$)", "/{n}", path)
+    return f"{parsed.hostname}{path}"
+
+def _record(url, latency, retries, failed):
+    key = endpoint_key(url)
+    metrics.observe('http_request_duration_seconds', latency, endpoint=key)
+    metrics.span(key, time.time() - latency, latency, 'http', retries=retries, failed=failed)
+    if retries:
+        metrics.inc('http_retries', retries, endpoint=key)
+    if failed:
+        metrics.inc('http_failures', endpoint=key)
+    with _stats_lock:
+        stats = _stats.setdefault(key, {'requests': 0, 'retries': 0, 'failures': 0, 'total_latency': 0.0, 'max_latency': 0.0})
+        stats['requests'] += 1
+        stats['retries'] += retries
+        stats['failures'] += 1 if failed else 0
+        stats['total_latency'] += latency
+        stats['max_latency'] = max(stats['max_latency'], latency)
+
+# Function to get a copy of the per-endpoint counters
+def get_stats():
+    with _stats_lock:
+        return {key: dict(value) for key, value in _stats.items()}
+
+def reset_stats():
+    with _stats_lock:
+        _stats.clear()
+
+def print_stats():
+    for key, stats in sorted(get_stats().items()):
+        average = stats['total_latency'] / stats['requests'] if stats['requests'] else 0
+        print(f"{key}: {stats['requests']} requests, {stats['retries']} retries, "
+              f"{stats['failures']} failures, avg {average:.3f}s, max {stats['max_latency']:.3f}s")
+
+# Seconds to wait from a Retry-After header, either delta-seconds or an HTTP date
+def parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    # email.utils takes longer to import than the rest of this module
+    from email.utils import parsedate_to_datetime
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+# Full-jitter exponential backoff
+def backoff_delay(attempt):
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+# Function to tell whether a request failed before anything was sent: the
+# connection was refused, the host name did not resolve or connecting timed
+# out. A connection lost later may have delivered the request.
+def _not_sent(error):
+    import requests
+    from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, (NewConnectionError, ConnectTimeoutError))
+
+# Function to send a request with pooling, timeouts and retries.
+# Non-idempotent requests (e.g. Dune inserts) are only retried when the server
+# surely did not process them: failures to connect (see _not_sent), 429 and 503.
+def request(method, url, idempotent=True, **kwargs):
+    import requests
+    if RECORD_MODE == 'replay':
+        import http_cache
+        return http_cache.replay(method, url, kwargs)
+    kwargs.setdefault('timeout', (CONNECT_TIMEOUT, READ_TIMEOUT))
+    # A file body can only be sent once; read it so a retry re-sends all of it
+    if hasattr(kwargs.get('data'), 'read'):
+        kwargs['data'] = kwargs['data'].read()
+    session = get_session(urlparse(url).hostname)
+    started = time.monotonic()
+    attempt = 0
+    while True:
+        delay = None
+        try:
+            response = session.request(method, url, **kwargs)
+            if response.status_code in RETRY_STATUSES and (idempotent or response.status_code in (429, 503)):
+                error = FetchError(url, f"HTTP {response.status_code}", response.status_code)
+                delay = parse_retry_after(response.headers.get('Retry-After'))
+            elif response.status_code >= 400:
+                _record(url, time.monotonic() - started, attempt, True)
+                raise FetchError(url, f"HTTP {response.status_code}: {response.text[:200]}", response.status_code)
+            else:
+                _record(url, time.monotonic() - started, attempt, False)
+                if RECORD_MODE == 'record':
+                    import http_cache
+                    http_cache.record(method, url, kwargs, response)
+                return response
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if not idempotent and not _not_sent(e):
+                _record(url, time.monotonic() - started, attempt, True)
+                raise FetchError(url, str(e))
+            error = FetchError(url, str(e))
+        if attempt >= MAX_RETRIES:
+            _record(url, time.monotonic() - started, attempt, True)
+            raise error
+        time.sleep(min(BACKOFF_MAX, delay) if delay is not None else backoff_delay(attempt))
+        attempt += 1
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+def post(url, idempotent=False, **kwargs):
+    return request("POST", url, idempotent=idempotent, **kwargs)
+
+# Function to GET a URL and decode its JSON body. With conditional=True the
+# last body is kept on disk and only re-sent by the server when it changed;
+# the result may then be shared between calls and must not be modified.
+def get_json(url, conditional=False, **kwargs):
+    if conditional:
+        import http_cache
+        return http_cache.get_json(url, **kwargs)
+    response = get(url, **kwargs)
+    try:
+        return response.json()
+    except ValueError as e:
+        raise FetchError(url, f"invalid JSON: {e}", response.status_code)
@@ -0,0 +1,172 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+# In-process metrics and tracing for the collectors.
+#
+# Counters and histograms live in one registry for the life of the process,
+# so in the scheduler they are cumulative like Prometheus expects. Each
+# collector's main() ends with write_run(job), which writes the registry to
+# one file per process in the OpenMetrics text format (readable by the
+# node_exporter textfile collector): METRICS_DIR/<job>.prom for a single
+# collector, or the name given to set_process() by a process that runs
+# several (scheduler, mint_burn_stream). Every sample carries a process
+# label, so no two files hold the same series. With METRICS_TRACE=1 it also
+# writes the run's stage and request spans to a Chrome trace file (chrome://tracing or
+# ui.perfetto.dev). Set METRICS_DIR to an empty string to write nothing.
+
+METRICS_DIR = os.getenv("METRICS_DIR", "metrics")
+METRICS_TRACE = os.getenv("METRICS_TRACE") == "1"
+# Seconds; wide enough for a single request and for a whole stage
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+MAX_SPANS = 100000
+
+HELP = {
+    'http_request_duration_seconds': ('histogram', "Request latency including retries, per endpoint"),
+    'http_retries': ('counter', "Retried request attempts, per endpoint"),
+    'http_failures': ('counter', "Requests that failed after all retries, per endpoint"),
+    'http_not_modified': ('counter', "Conditional requests answered 304 from the HTTP cache, per endpoint"),
+    'collector_stage_duration_seconds': ('histogram', "Duration of a collector stage: fetch, dedupe, persist or upload"),
+    'collector_rows': ('counter', "Rows per collector and stage: fetched, new, written or uploaded"),
+    'collector_last_run_timestamp_seconds': ('gauge', "Unix time the collector's last run finished"),
+    'mint_burn_stream_lag_seconds': ('histogram', "Time from a streamed mint or burn's block to its commit"),
+    'tvl_events_logs': ('counter', "Transfer logs applied to the tracked vault balances"),
+    'tvl_events_drift': ('counter', "Vault balances corrected by a reconciliation poll"),
+    'dune_upload_bytes': ('counter', "Bytes sent to Dune, per table"),
+    'dune_rows_uploaded': ('counter', "Rows acknowledged by Dune, per table"),
+}
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_histograms = {}
+_spans = deque(maxlen=MAX_SPANS)
+# Name of this process's metrics file, None to use the job of write_run()
+_process = None
+# Jobs of one process finish in their own threads but share its file
+_write_lock = threading.Lock()
+
+# Function to write all of this process's metrics to METRICS_DIR/<name>.prom
+# instead of one file per job, which would repeat the shared registry
+def set_process(name):
+    global _process
+    _process = name
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+def inc(name, value=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+def set_gauge(name, value, **labels):
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+def observe(name, value, **labels):
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = {'buckets': [0] * len(BUCKETS), 'count': 0, 'sum': 0.0}
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                histogram['buckets'][i] += 1
+        histogram['count'] += 1
+        histogram['sum'] += value
+
+# Function to record a finished span for the trace. start is a time.time() value.
+def span(name, start, duration, category, **args):
+    if METRICS_TRACE:
+        _spans.append({'name': name, 'cat': category, 'ph': 'X', 'ts': int(start * 1e6), 'dur': int(duration * 1e6),
+                       'pid': os.getpid(), 'tid': threading.get_ident(), 'args': args})
+
+# Times the body as one stage of a collector run
+@contextmanager
+def stage(job, name):
+    start, started = time.time(), time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - started
+        observe('collector_stage_duration_seconds', duration, job=job, stage=name)
+        span(name, start, duration, job)
+
+def rows(job, stage, count):
+    inc('collector_rows', count, job=job, stage=stage)
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _histograms.clear()
+        _spans.clear()
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(labels, extra=(), common=()):
+    pairs = list(common) + list(labels) + list(extra)
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}' if pairs else ''
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+# Function to render the registry in the OpenMetrics text format, with
+# labels (e.g. {'process': ...}) added to every sample
+def render(**common_labels):
+    common = sorted(common_labels.items())
+    with _lock:
+        # {family: [(labels, sample lines)]}, so a histogram's lines stay in order
+        families = {}
+        for (name, labels), value in _counters.items():
+            families.setdefault(name, []).append((labels, [f"{name}_total{_labels(labels, common=common)} {_number(value)}"]))
+        for (name, labels), value in _gauges.items():
+            families.setdefault(name, []).append((labels, [f"{name}{_labels(labels, common=common)} {_number(value)}"]))
+        for (name, labels), histogram in _histograms.items():
+            lines = [f"{name}_bucket{_labels(labels, [('le', bound)], common)} {count}"
+                     for bound, count in zip(BUCKETS, histogram['buckets'])]
+            lines.append(f"{name}_bucket{_labels(labels, [('le', '+Inf')], common)} {histogram['count']}")
+            lines.append(f"{name}_count{_labels(labels, common=common)} {histogram['count']}")
+            lines.append(f"{name}_sum{_labels(labels, common=common)} {_number(histogram['sum'])}")
+            families.setdefault(name, []).append((labels, lines))
+    output = []
+    for name in sorted(families):
+        kind, help_text = HELP.get(name, ('unknown', ''))
+        output.append(f"# TYPE {name} {kind}")
+        if help_text:
+            output.append(f"# HELP {name} {help_text}")
+        for _, lines in sorted(families[name]):
+            output.extend(lines)
+    output.append("# EOF")
+    return '\n'.join(output) + '\n'
+
+def _write(path, text):
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as file:
+        file.write(text)
+    os.replace(temp_path, path)
+
+# Function to end a collector run: stamp it and write the process's metrics
+# file, and the trace of spans since `started` (a time.time() value) when
+# tracing is on. Returns the metrics file path, or None when METRICS_DIR is empty.
+def write_run(job, started=None):
+    set_gauge('collector_last_run_timestamp_seconds', round(time.time(), 3), job=job)
+    if not METRICS_DIR:
+        return None
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    process = _process or job
+    path = os.path.join(METRICS_DIR, f"{process}.prom")
+    with _write_lock:
+        _write(path, render(process=process))
+    if METRICS_TRACE:
+        since = int((started or 0) * 1e6)
+        events = [event for event in list(_spans) if event['ts'] >= since]
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+        _write(os.path.join(METRICS_DIR, f"{job}-{stamp}.trace.json"), json.dumps({'traceEvents': events}))
+    return path
@@ -0,0 +1,275 @@
+import json
+import os
+import signal
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+
+import dune_outbox
+import http_client
+import metrics
+import mintandburn
+import rpc_reader
+import supply_ledger
+from tvl_events import TRANSFER_TOPIC
+from tx_index import TxIndex
+
+# Streaming mode of mintandburn.py: new mints and burns are pushed by the
+# node instead of found by polling the explorer.
+#
+# Two eth_subscribe "logs" subscriptions over Q_WS_URL deliver the Transfer
+# logs of the tracked tokens from the zero address (mints) and to it (burns).
+# Each log is turned into the explorer's transfer shape and goes through the
+# same classification and tx index dedupe as a polled page, then the same
+# CSV / index / Dune outbox commit. The Dune upload and the supply ledger
+# update run every MINT_BURN_STREAM_FLUSH_INTERVAL seconds.
+#
+# The last block seen is kept in mint_burn_stream.json. After a disconnect
+# the stream subscribes again and reads the logs from that block to the head
+# with eth_getLogs, so nothing in the gap is lost; events seen twice are
+# dropped by the index. The first start with no checkpoint runs a polling
+# catch-up (mintandburn.main) first.
+
+WS_URL = os.getenv("Q_WS_URL", "wss://rpc.q.org")
+CHECKPOINT_PATH = os.getenv("MINT_BURN_STREAM_CHECKPOINT", "mint_burn_stream.json")
+# Largest block range of one eth_getLogs request when filling a gap
+MAX_LOG_RANGE = int(os.getenv("MINT_BURN_STREAM_MAX_RANGE", "5000"))
+FLUSH_INTERVAL = float(os.getenv("MINT_BURN_STREAM_FLUSH_INTERVAL", "60"))
+# Longest wait between reconnection attempts, in seconds
+RECONNECT_MAX = float(os.getenv("MINT_BURN_STREAM_RECONNECT_MAX", "60"))
+
+ZERO_ADDRESS = '0x' + '0' * 40
+ZERO_TOPIC = '0x' + '0' * 64
+
+# JSON-RPC over one WebSocket connection. Subscription notifications that
+# arrive while waiting for a reply are queued for next_notification().
+class RPCSocket:
+    def __init__(self, url):
+        from websockets.sync.client import connect
+        # eth_getLogs replies over a long gap can be large
+        self.conn = connect(url, max_size=None, open_timeout=http_client.CONNECT_TIMEOUT)
+        self.next_id = 0
+        self.notifications = deque()
+
+    def _receive(self, timeout=None):
+        message = json.loads(self.conn.recv(timeout))
+        if message.get('method') == 'eth_subscription':
+            self.notifications.append(message['params'])
+            return None
+        return message
+
+    def call(self, method, params):
+        self.next_id += 1
+        self.conn.send(json.dumps({'jsonrpc': '2.0', 'id': self.next_id, 'method': method, 'params': params}))
+        deadline = time.monotonic() + http_client.READ_TIMEOUT
+        while True:
+            message = self._receive(max(deadline - time.monotonic(), 0))
+            if message is not None and message.get('id') == self.next_id:
+                if 'error' in message:
+                    raise rpc_reader.RPCError(f"{method}: {message['error'].get('code')}: {message['error'].get('message')}")
+                return message['result']
+
+    # Function to get the next {'subscription', 'result'} notification, or
+    # None when nothing arrives within timeout seconds
+    def next_notification(self, timeout):
+        if not self.notifications:
+            try:
+                self._receive(timeout)
+            except TimeoutError:
+                return None
+        return self.notifications.popleft() if self.notifications else None
+
+    def close(self):
+        self.conn.close()
+
+class MintBurnStream:
+    def __init__(self, url=WS_URL, path=CHECKPOINT_PATH, tokens=None):
+        self.url = url
+        self.path = path
+        self.tokens = {address.lower(): (symbol, address) for symbol, address in (tokens or mintandburn.TOKENS).items()}
+        self.cursor = None
+        self.block_times = {}
+        try:
+            with open(path) as file:
+                self.cursor = json.load(file)['block']
+        except FileNotFoundError:
+            pass
+
+    def save(self):
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump({'block': self.cursor}, file)
+        os.replace(temp_path, self.path)
+
+    # Function to get both Transfer filters: from the zero address, to it
+    def filters(self):
+        addresses = sorted(self.tokens)
+        return [{'address': addresses, 'topics': [TRANSFER_TOPIC, [ZERO_TOPIC]]},
+                {'address': addresses, 'topics': [TRANSFER_TOPIC, None, [ZERO_TOPIC]]}]
+
+    def _block_time(self, rpc, block):
+        if block not in self.block_times:
+            if len(self.block_times) > 1000:
+                self.block_times.clear()
+            header = rpc.call('eth_getBlockByNumber', [hex(block), False])
+            self.block_times[block] = int(header['timestamp'], 16)
+        return self.block_times[block]
+
+    # Function to turn a Transfer log into a transfer item as the explorer
+    # returns it, for mintandburn.new_mint_burn_events. The token's name and
+    # symbol come from its explorer metadata, as in a polled page, so both
+    # paths write and dedupe the same token_symbol.
+    def transfer_item(self, rpc, log):
+        import tvl_data
+        symbol, address = self.tokens[log['address'].lower()]
+        meta = tvl_data.get_token_meta(address)
+        sender, receiver = '0x' + log['topics'][1][-40:], '0x' + log['topics'][2][-40:]
+        block = int(log['blockNumber'], 16)
+        moment = datetime.fromtimestamp(self._block_time(rpc, block), timezone.utc)
+        if sender == ZERO_ADDRESS:
+            transfer_type = 'token_minting'
+        elif receiver == ZERO_ADDRESS:
+            transfer_type = 'token_burning'
+        else:
+            transfer_type = 'token_transfer'
+        return {
+            'tx_hash': log['transactionHash'],
+            'log_index': int(log['logIndex'], 16),
+            'timestamp': moment.strftime('%Y-%m-%dT%H:%M:%S.000000Z'),
+            'type': transfer_type,
+            'token': {'symbol': meta.get('symbol') or symbol, 'name': meta['name']},
+            'from': {'hash': sender},
+            'to': {'hash': receiver},
+            'total': {'value': str(int(log['data'], 16) if log['data'] != '0x' else 0), 'decimals': meta['decimals']},
+        }
+
+    # Function to write the new events among the logs and commit them.
+    # Returns the number of rows written.
+    def apply(self, rpc, logs, watermarks, index, sink, commit):
+        items = []
+        # Watermarks are kept per TOKENS name, as mintandburn.main keeps them
+        names = {}
+        for log in logs:
+            if log.get('removed'):
+                # Dropped by a reorg; a row already written stays in the CSV
+                print(f"Ignoring removed log {log['transactionHash']}:{int(log['logIndex'], 16)}")
+                continue
+            items.append(self.transfer_item(rpc, log))
+            names[items[-1]['token']['symbol']] = self.tokens[log['address'].lower()][0]
+        with metrics.stage('mint_burn_stream', 'dedupe'):
+            rows, _ = mintandburn.new_mint_burn_events(items, None, index)
+        metrics.rows('mint_burn_stream', 'fetched', len(items))
+        metrics.rows('mint_burn_stream', 'new', len(rows))
+        for row in rows:
+            sink(row)
+        commit()
+        # The cursor only moves past committed logs
+        self.cursor = max([self.cursor] + [int(log['blockNumber'], 16) for log in logs])
+        now = time.time()
+        for row in rows:
+            metrics.observe('mint_burn_stream_lag_seconds', now - supply_ledger.to_epoch(row['timestamp']))
+            name = names[row['token_symbol']]
+            if row['timestamp'] > watermarks.get(name, ''):
+                mintandburn.update_last_processed_timestamp(name, row['timestamp'], watermarks)
+        self.save()
+        return len(rows)
+
+    # Function to read the mint and burn logs of blocks start..end
+    def logs_between(self, rpc, start, end):
+        logs = {}
+        for low in range(start, end + 1, MAX_LOG_RANGE):
+            span = {'fromBlock': hex(low), 'toBlock': hex(min(low + MAX_LOG_RANGE - 1, end))}
+            for log_filter in self.filters():
+                for log in rpc.call('eth_getLogs', [dict(log_filter, **span)]):
+                    logs[(int(log['blockNumber'], 16), int(log['logIndex'], 16))] = log
+        return [logs[key] for key in sorted(logs)]
+
+    # Function to subscribe and follow new events until stop is set. Each
+    # (re)connection subscribes first and then fills the gap since the cursor,
+    # so events mined in between arrive at least once.
+    def follow(self, stop, watermarks, index, sink, commit, flush):
+        from websockets.exceptions import WebSocketException
+        delay = 1.0
+        while not stop.is_set():
+            rpc = None
+            try:
+                rpc = RPCSocket(self.url)
+                subscriptions = {rpc.call('eth_subscribe', ['logs', log_filter]) for log_filter in self.filters()}
+                head = int(rpc.call('eth_blockNumber', []), 16)
+                if head > self.cursor:
+                    start = self.cursor
+                    count = self.apply(rpc, self.logs_between(rpc, start, head), watermarks, index, sink, commit)
+                    self.cursor = max(self.cursor, head)
+                    self.save()
+                    print(f"Filled blocks {start}..{head} after connecting: {count} new events")
+                print(f"Streaming mint and burn events from {self.url}")
+                delay = 1.0
+                flushed = time.monotonic()
+                while not stop.is_set():
+                    notification = rpc.next_notification(1.0)
+                    if notification is not None and notification['subscription'] in subscriptions:
+                        count = self.apply(rpc, [notification['result']], watermarks, index, sink, commit)
+                        if count:
+                            print(f"Streamed {count} new events at block {self.cursor}")
+                    if time.monotonic() - flushed >= FLUSH_INTERVAL:
+                        flush()
+                        flushed = time.monotonic()
+            except (OSError, WebSocketException, rpc_reader.RPCError, http_client.FetchError) as e:
+                # Rows read before the failure are kept
+                commit()
+                print(f"Stream disconnected ({e!r}), reconnecting in {delay:.0f}s")
+                stop.wait(delay)
+                delay = min(delay * 2, RECONNECT_MAX)
+            finally:
+                if rpc is not None:
+                    rpc.close()
+
+# Function to run the stream until SIGINT/SIGTERM or until stop is set
+def run(stop=None, url=WS_URL):
+    stop = stop or threading.Event()
+    if threading.current_thread() is threading.main_thread():
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: stop.set())
+    started = time.time()
+    # The catch-up runs mintandburn.main(), whose metrics go in the stream's file
+    metrics.set_process('mint_burn_stream')
+    csv_file_path = 'mint_burn_data.csv'
+    stream = MintBurnStream(url)
+    index = TxIndex(csv_path=csv_file_path, use_bloom=os.getenv("TX_INDEX_BLOOM") == "1")
+    if stream.cursor is None:
+        rpc = RPCSocket(url)
+        head = int(rpc.call('eth_blockNumber', []), 16)
+        rpc.close()
+        print(f"No stream checkpoint, catching up by polling before following block {head}")
+        mintandburn.main(index)
+        stream.cursor = head
+        stream.save()
+    watermarks = mintandburn.read_last_processed_timestamps()
+    file, csv_sink = mintandburn.open_csv_sink(csv_file_path)
+    outbox = dune_outbox.connect()
+    sink, commit = mintandburn.make_writer(index, file, csv_sink, outbox, job='mint_burn_stream')
+    ledger = supply_ledger.SupplyLedger()
+
+    def flush():
+        with metrics.stage('mint_burn_stream', 'persist'):
+            ledger.update_from_csv(csv_file_path)
+        if dune_outbox.pending_count(outbox):
+            with metrics.stage('mint_burn_stream', 'upload'):
+                uploaded = dune_outbox.flush(outbox, mintandburn.NAMESPACE, mintandburn.DUNE_API_KEY)
+            metrics.rows('mint_burn_stream', 'uploaded', uploaded)
+        metrics.write_run('mint_burn_stream', started)
+
+    with file:
+        stream.follow(stop, watermarks, index, sink, commit, flush)
+        flush()
+    print(f"Stream stopped at block {stream.cursor}, {dune_outbox.pending_count(outbox)} rows pending for Dune.")
+    outbox.close()
+    index.close()
+
+if __name__ == "__main__":
+    run()
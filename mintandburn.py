@@ -1,115 +1,248 @@
-import requests
 import csv
 import json
 import os
+import time
+from urllib.parse import urlencode
 
-def fetch_data(token_address):
-    # Fetch token transfer data from a blockchain explorer API
-    url = f"https://explorer.q.org/api/v2/tokens/{token_address}/transfers"
-    try:
-        response = requests.get(url)
-        response.raise_for_status()
-        return response.json()
-    except requests.RequestException as e:
-        print(f"Error fetching data for token {token_address}: {e}")
-        return None
-
-def read_last_processed_timestamp():
-    # Read the last processed timestamp from JSON storage
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+
+import columnar_store
+import deployments
+import dune_outbox
+import http_client
+import metrics
+import supply_ledger
+from tx_index import TxIndex
+
+DUNE_API_KEY = os.getenv("DUNE_API_KEY")
+NAMESPACE = os.getenv("NAMESPACE1")
+TABLE_NAME = os.getenv("TABLE_NAME_MINT_BURN")
+EXPLORER_URL = os.getenv("EXPLORER_URL", "https://explorer.q.org")
+
+# Tokens whose mints and burns are collected, Q mainnet's unless the
+# deployment sets mint_burn_tokens (see deployments.py)
+TOKENS = deployments.setting('mint_burn_tokens', {
+    'WETH': '0xd56F9ffF3fe3BD0C7B52afF9A42eb70E05A287Cc',
+    'WBTC': '0xde397e6C442A3E697367DecBF0d50733dc916b79',
+    'USDC': '0x79Cb92a2806BF4f82B614A84b6805963b8b1D8BB',
+    'USDT': '0xCdb1CEaE11E4Dd46E908F01CF85Ed6AB4aE59dcc',
+    '0xMR': '0x79187B0D66249ac375EBd94861B344a0Dc170C14',
+    'DAI': '0xDeb87c37Dcf7F5197026f574cd40B3Fc8Aa126D1'
+})
+
+# Long catch-ups commit in chunks so memory stays bounded
+COMMIT_EVERY_ROWS = 1000
+
+FIELDNAMES = ['tx_hash', 'log_index', 'from', 'to', 'token_name', 'token_symbol', 'transfer_type', 'timestamp', 'value']
+# Columns of the Dune table, which predates log_index
+DUNE_FIELDNAMES = [field for field in FIELDNAMES if field != 'log_index']
+
+def fetch_data(token_address, page_params=None):
+    # Fetch one page of token transfer data from a blockchain explorer API, raises http_client.FetchError on failure
+    url = f"{EXPLORER_URL}/api/v2/tokens/{token_address}/transfers"
+    if page_params:
+        url = f"{url}?{urlencode(page_params)}"
+    return http_client.get_json(url)
+
+def iter_transfer_pages(token_address):
+    # Follow the explorer's next_page_params cursor, newest page first
+    page_params = None
+    while True:
+        with metrics.stage('mintandburn', 'fetch'):
+            data = fetch_data(token_address, page_params)
+        yield data.get('items', [])
+        page_params = data.get('next_page_params')
+        if not page_params:
+            return
+
+def read_last_processed_timestamps():
+    # Read the per-token watermarks from JSON storage. The old single
+    # 'last_timestamp' format is ignored, so each token catches up once.
     try:
         with open('last_processed.json', 'r') as file:
-            data = json.load(file)
-            return data['last_timestamp']
+            return json.load(file).get('tokens', {})
     except FileNotFoundError:
-        return None
+        return {}
 
-def update_last_processed_timestamp(timestamp):
-    # Update the last processed timestamp in JSON storage
+def update_last_processed_timestamp(token_name, timestamp, watermarks):
+    # Update one token's watermark in JSON storage
+    watermarks[token_name] = timestamp
     with open('last_processed.json', 'w') as file:
-        json.dump({'last_timestamp': timestamp}, file)
+        json.dump({'tokens': watermarks}, file)
 
-def load_existing_tx_hashes(filename='mint_burn_data.csv'):
-    # Load existing transaction hashes from CSV to avoid reprocessing
-    try:
-        with open(filename, mode='r', newline='') as file:
-            reader = csv.DictReader(file)
-            return {row['tx_hash'] for row in reader}
-    except FileNotFoundError:
-        return set()
+def iter_mint_burn_events(token_address, last_timestamp, index=None):
+    # Yield new minting and burning events page by page. Transfers come newest
+    # first, so paging stops at the first page that reaches the watermark.
+    # Without an index, every event after the watermark is yielded.
+    for items in iter_transfer_pages(token_address):
+        with metrics.stage('mintandburn', 'dedupe'):
+            rows, reached_watermark = new_mint_burn_events(items, last_timestamp, index)
+        metrics.rows('mintandburn', 'fetched', len(items))
+        metrics.rows('mintandburn', 'new', len(rows))
+        yield from rows
+        if reached_watermark:
+            return
+
+def new_mint_burn_events(items, last_timestamp, index=None):
+    # Pick the unseen minting and burning events out of one page of transfers.
+    # Returns (rows, reached_watermark).
+    rows = []
+    for item in items:
+        tx_hash = item['tx_hash']
+        timestamp = item['timestamp']
+        if last_timestamp and timestamp < last_timestamp:
+            return rows, True
+        if item['type'] not in ['token_minting', 'token_burning']:
+            continue
+        log_index = int(item['log_index'])
+        token_symbol = item['token']['symbol']
+        # The index only learns the key when the row is committed (make_writer)
+        if index is None or not index.seen(tx_hash, log_index, token_symbol):
+            rows.append({
+                'tx_hash': tx_hash,
+                'log_index': log_index,
+                'from': item['from']['hash'],
+                'to': item['to']['hash'],
+                'token_name': item['token']['name'],
+                'token_symbol': token_symbol,
+                'transfer_type': item['type'],
+                'timestamp': timestamp,
+                'value': int(item['total']['value']) / (10 ** int(item['total']['decimals']))
+            })
+    return rows, False
 
-def process_mint_burn_events(token_address, last_timestamp, seen_tx_hashes):
-    # Process minting and burning events and record new data
-    data = fetch_data(token_address)
-    mint_burn_data = []
+def process_mint_burn_events(token_name, token_address, watermarks, index, sink, commit):
+    # Stream one token's new events into the sink, commit them, then advance its
+    # watermark. The watermark only moves once the whole gap has been read, so
+    # an interrupted catch-up resumes from the old watermark next run.
+    last_timestamp = watermarks.get(token_name)
     latest_timestamp = last_timestamp
+    count = 0
+    for row in iter_mint_burn_events(token_address, last_timestamp, index):
+        sink(row)
+        count += 1
+        if not latest_timestamp or row['timestamp'] > latest_timestamp:
+            latest_timestamp = row['timestamp']
+    commit()
+    if latest_timestamp and latest_timestamp != last_timestamp:
+        update_last_processed_timestamp(token_name, latest_timestamp, watermarks)
+    return count
 
-    if data:
-        for item in data.get('items', []):
-            tx_hash = item['tx_hash']
-            timestamp = item['timestamp']
-            if item['type'] in ['token_minting', 'token_burning'] and tx_hash not in seen_tx_hashes:
-                seen_tx_hashes.add(tx_hash)
-                mint_burn_data.append({
-                    'tx_hash': tx_hash,
-                    'from': item['from']['hash'],
-                    'to': item['to']['hash'],
-                    'token_name': item['token']['name'],
-                    'token_symbol': item['token']['symbol'],
-                    'transfer_type': item['type'],
-                    'timestamp': timestamp,
-                    'value': int(item['total']['value']) / (10 ** int(item['total']['decimals']))
-                })
-                if not latest_timestamp or timestamp > latest_timestamp:
-                    latest_timestamp = timestamp
-
-    if latest_timestamp:
-        update_last_processed_timestamp(latest_timestamp)
-
-    return mint_burn_data
+def open_csv_sink(filename='mint_burn_data.csv'):
+    # Open the CSV for appending and return (file, sink) where sink writes one row.
+    # A file started before log_index was stored keeps its columns (legacy file).
+    needs_header = not os.path.isfile(filename) or os.path.getsize(filename) == 0
+    fieldnames = FIELDNAMES
+    if not needs_header:
+        with open(filename, newline='') as file:
+            fieldnames = next(csv.reader(file))
+        if 'log_index' not in fieldnames:
+            print(f"{filename} has no log_index column; its rows are deduplicated on (tx_hash, token) "
+                  f"when the index is rebuilt from it.")
+    file = open(filename, mode='a', newline='')
+    writer = csv.DictWriter(file, fieldnames=fieldnames, extrasaction='ignore')
+    if needs_header:
+        writer.writeheader()
+    return file, writer.writerow
 
 def save_data_to_csv(data, filename='mint_burn_data.csv'):
     # Save new minting and burning data to CSV
-    file_exists = os.path.isfile(filename)
-    with open(filename, mode='a', newline='') as file:
-        fieldnames = ['tx_hash', 'from', 'to', 'token_name', 'token_symbol', 'transfer_type', 'timestamp', 'value']
-        writer = csv.DictWriter(file, fieldnames=fieldnames)
-        if not file_exists:
-            writer.writeheader()
+    file, sink = open_csv_sink(filename)
+    with file:
         for row in data:
-            writer.writerow(row)
-
-def upload_to_dune(csv_path):
-    # Upload data to Dune for analysis
-    url = "https://api.dune.com/api/v1/table/{space}/{tablename}/insert"
-    headers = {
-        "X-DUNE-API-KEY": "",
-        "Content-Type": "text/csv"
-    }
-    with open(csv_path, "rb") as data:
-        response = requests.request("POST", url, data=data, headers=headers)
-        print(response.text)
+            sink(row)
 
-if __name__ == "__main__":
-    # Main execution block
-    existing_tx_hashes = load_existing_tx_hashes()
-    last_timestamp = read_last_processed_timestamp()
-    tokens = {
-        'WETH': '0xd56F9ffF3fe3BD0C7B52afF9A42eb70E05A287Cc',
-        'WBTC': '0xde397e6C442A3E697367DecBF0d50733dc916b79',
-        'USDC': '0x79Cb92a2806BF4f82B614A84b6805963b8b1D8BB',
-        'USDT': '0xCdb1CEaE11E4Dd46E908F01CF85Ed6AB4aE59dcc',
-        '0xMR': '0x79187B0D66249ac375EBd94861B344a0Dc170C14',
-        'DAI': '0xDeb87c37Dcf7F5197026f574cd40B3Fc8Aa126D1'
-    }
-    all_events = []
-    for token_name, address in tokens.items():
-        events = process_mint_burn_events(address, last_timestamp, existing_tx_hashes)
-        all_events.extend(events)
-        print(f"Processed {token_name} events")
-
-    if all_events:
-        csv_file_path = 'mint_burn_data.csv'
-        save_data_to_csv(all_events, csv_file_path)
-        upload_to_dune(csv_file_path)
+def collect_mint_burn(watermarks=None, tokens=None):
+    # Fetch mint and burn events newer than each token's watermark without
+    # writing anything. Returns {token_name: [rows]}.
+    watermarks = watermarks or {}
+    return {token_name: list(iter_mint_burn_events(address, watermarks.get(token_name)))
+            for token_name, address in (tokens or TOKENS).items()}
+
+# Outbox key of an event, the same identity as in the tx index
+def event_key(row):
+    return f"{row['tx_hash']}:{row['log_index']}:{row['token_symbol']}"
+
+# Function to build (sink, commit) for new rows. sink writes a row to the CSV;
+# commit queues the rows since the last commit for Dune, adds their keys to
+# the tx index, commits the CSV and the index together and appends the rows
+# to the columnar store. A key is only in the index once its row is queued.
+def make_writer(index, file, csv_sink, outbox, job='mintandburn'):
+    # Rows of the current token, handed to the outbox and the columnar store on commit
+    pending_rows = []
+    # Keys of pending_rows; an event on two pages of one catch-up is written once
+    pending_keys = set()
+    def sink(row):
+        key = event_key(row)
+        if key in pending_keys:
+            return
+        csv_sink(row)
+        pending_rows.append(row)
+        pending_keys.add(key)
+        if len(pending_rows) >= COMMIT_EVERY_ROWS:
+            commit()
+    def commit():
+        # Queue for Dune before the CSV/index commit: after a crash the rows are
+        # fetched again and re-queuing them with the same keys is a no-op
+        with metrics.stage(job, 'persist'):
+            dune_outbox.enqueue(outbox, NAMESPACE, TABLE_NAME, DUNE_FIELDNAMES, pending_rows, event_key)
+            for row in pending_rows:
+                index.add(row['tx_hash'], row['log_index'], row['token_symbol'])
+            index.commit(file)
+            columnar_store.append_if_enabled('mint_burn_data', pending_rows)
+        metrics.rows(job, 'written', len(pending_rows))
+        pending_rows.clear()
+        pending_keys.clear()
+    return sink, commit
+
+# Main execution. A long-running caller can pass an open TxIndex to keep it
+# (and its Bloom filter) warm between runs.
+def main(index=None):
+    started = time.time()
+    csv_file_path = 'mint_burn_data.csv'
+    own_index = index is None
+    if own_index:
+        index = TxIndex(csv_path=csv_file_path, use_bloom=os.getenv("TX_INDEX_BLOOM") == "1")
     else:
+        # A kept-open index may hold a failed run's uncommitted rows
+        index.recover()
+    watermarks = read_last_processed_timestamps()
+    total_events = 0
+    file, csv_sink = open_csv_sink(csv_file_path)
+    outbox = dune_outbox.connect()
+    sink, commit = make_writer(index, file, csv_sink, outbox)
+    with file:
+        for token_name, address in TOKENS.items():
+            try:
+                count = process_mint_burn_events(token_name, address, watermarks, index, sink, commit)
+            except http_client.FetchError as e:
+                # Keep the rows read before the failure; the watermark stays put
+                print(f"Error fetching data for token {token_name}: {e}")
+                commit()
+                continue
+            total_events += count
+            print(f"Processed {token_name} events: {count} new")
+
+    if own_index:
+        index.close()
+
+    # Extend the supply ledger with the rows just written
+    if total_events:
+        with metrics.stage('mintandburn', 'persist'):
+            supply_ledger.SupplyLedger().update_from_csv(csv_file_path)
+
+    if not total_events:
         print("No new events to process.")
+    with metrics.stage('mintandburn', 'upload'):
+        uploaded = dune_outbox.flush(outbox, NAMESPACE, DUNE_API_KEY)
+    metrics.rows('mintandburn', 'uploaded', uploaded)
+    print(f"Uploaded {uploaded} rows to Dune, {dune_outbox.pending_count(outbox)} pending.")
+    outbox.close()
+    http_client.print_stats()
+    metrics.write_run('mintandburn', started)
+    return total_events
+
+if __name__ == "__main__":
+    main()
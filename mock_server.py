@@ -0,0 +1,543 @@
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Local stand-in for every HTTP endpoint the collectors call: the explorer,
+# the stats explorer, CoinGecko and the Dune upload API, all on one port.
+# Point EXPLORER_URL, STATS_EXPLORER_URL, COINGECKO_URL and DUNE_API_URL at
+# it to run a collector without network access (bench_suite.py does this).
+#
+# Responses are synthetic and deterministic. A path with a JSON file in the
+# fixtures directory is answered from that file instead; --record fills the
+# directory from the real services. Latency and errors (503, or 429 with
+# Retry-After) can be injected. GET /__stats returns request and byte counts,
+# POST /__reset clears them and POST /__config changes the settings below.
+# With --ws-port it also runs a WebSocket JSON-RPC node that mines mints and
+# burns, for mint_burn_stream.py (set Q_WS_URL to it). The same chain answers
+# JSON-RPC over HTTP at /rpc, single requests and batches, for rpc_reader.py
+# (set Q_RPC_URL to <base>/rpc); set_call() gives contract calls their values.
+
+MOCK_HOST = os.getenv("MOCK_HOST", "127.0.0.1")
+MOCK_PORT = int(os.getenv("MOCK_PORT", "8900"))
+FIXTURES_DIR = os.getenv("MOCK_FIXTURES_DIR", "fixtures")
+
+DEFAULT_CONFIG = {
+    'latency_ms': 0.0,         # added to every response
+    'jitter_ms': 0.0,          # plus a uniform random 0..jitter_ms
+    'error_rate': 0.0,         # share of requests answered with an error
+    'transfers': 10000,        # transfers per token, newest first
+    'transfer_spacing': 60,    # seconds between two transfers
+    'page_size': 50,           # transfers per page, as on Blockscout
+    'chart_points': 365,       # daily points per stats line, ending today
+    'fixtures': None,          # directory of recorded responses
+}
+
+# Symbols in every address' token balances, enough for all snapshot columns
+BALANCE_SYMBOLS = ['WBTC', 'WETH', 'USDC', 'DAI', 'ELK', 'QUSD', 'VNXAU']
+TRANSFER_TYPES = ['token_minting', 'token_burning', 'token_transfer']
+GENERAL_STATS = {
+    'average_block_time': 5000.0, 'coin_price': '0.015', 'gas_prices': {'average': 1.0, 'fast': 1.2, 'slow': 0.8},
+    'gas_used_today': '123456789', 'market_cap': '1500000.0', 'network_utilization_percentage': 0.5,
+    'static_gas_price': None, 'total_addresses': '250000', 'total_blocks': '15000000', 'total_gas_used': '0',
+    'total_transactions': '9000000', 'transactions_today': '12000',
+}
+
+class MockState:
+    def __init__(self, **config):
+        self.lock = threading.Lock()
+        self.config = dict(DEFAULT_CONFIG, **config)
+        # Transfers count back from here, so a run's timestamps are reproducible
+        self.epoch = time.time()
+        self.random = random.Random(0)
+        # Node behind /rpc, set by start()
+        self.chain = None
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.stats = {'requests': 0, 'errors': 0, 'bytes_in': 0, 'bytes_out': 0, 'rows_uploaded': 0, 'endpoints': {}}
+
+    def record(self, endpoint, bytes_in, bytes_out, error=False, rows=0):
+        with self.lock:
+            self.stats['requests'] += 1
+            self.stats['errors'] += error
+            self.stats['bytes_in'] += bytes_in
+            self.stats['bytes_out'] += bytes_out
+            self.stats['rows_uploaded'] += rows
+            self.stats['endpoints'][endpoint] = self.stats['endpoints'].get(endpoint, 0) + 1
+
+    def configure(self, **config):
+        with self.lock:
+            self.config.update(config)
+
+    def snapshot(self):
+        with self.lock:
+            return json.loads(json.dumps(self.stats))
+
+    def delay(self):
+        with self.lock:
+            jitter = self.random.uniform(0, self.config['jitter_ms'])
+        return (self.config['latency_ms'] + jitter) / 1000
+
+    # Function to pick the error status of the next request, None to answer it
+    def error_status(self):
+        with self.lock:
+            if self.random.random() >= self.config['error_rate']:
+                return None
+            return self.random.choice([429, 503])
+
+# Function to get the ISO timestamp of the i-th newest transfer, the format the
+# explorer uses. bench_suite.py uses it to place the mintandburn watermarks.
+def transfer_timestamp(state, i):
+    moment = datetime.fromtimestamp(state.epoch - i * state.config['transfer_spacing'], timezone.utc)
+    return moment.strftime('%Y-%m-%dT%H:%M:%S.000000Z')
+
+def _address(seed):
+    return '0x' + format(seed, '040x')
+
+def transfers_page(state, token, offset):
+    symbol = 'T' + token[2:6].upper()
+    total = state.config['transfers']
+    end = min(offset + state.config['page_size'], total)
+    items = []
+    for i in range(offset, end):
+        kind = TRANSFER_TYPES[i % len(TRANSFER_TYPES)]
+        items.append({
+            'tx_hash': '0x' + format(int(token[2:10], 16), '08x') + format(i, '056x'),
+            'log_index': str(i % 7),
+            'timestamp': transfer_timestamp(state, i),
+            'type': kind,
+            'from': {'hash': _address(0) if kind == 'token_minting' else _address(i + 1)},
+            'to': {'hash': _address(0) if kind == 'token_burning' else _address(i + 2)},
+            'token': {'address': token, 'symbol': symbol, 'name': f"Mock {symbol}", 'decimals': '18'},
+            'total': {'value': str((i % 1000 + 1) * 10 ** 18), 'decimals': '18'},
+        })
+    next_page = {'block_number': 15000000 - end, 'index': 0, 'items_count': end} if end < total else None
+    return {'items': items, 'next_page_params': next_page}
+
+def stats_line(state):
+    today = datetime.now().date()
+    points = state.config['chart_points']
+    return {'chart': [{'date': (today - timedelta(days=i)).isoformat(), 'value': str(1000 + i % 97)}
+                      for i in range(points - 1, -1, -1)]}
+
+def token_info(address):
+    symbol = 'T' + address[2:6].upper()
+    return {'address': address, 'name': f"Mock {symbol}", 'symbol': symbol,
+            'decimals': '18', 'total_supply': str((int(address[2:8], 16) % 1000 + 1) * 10 ** 21)}
+
+def token_balances(address):
+    return [{'token': {'address_hash': _address(i + 1), 'symbol': symbol, 'name': symbol, 'decimals': '18'},
+             'value': str((int(address[2:6], 16) % 100 + i + 1) * 10 ** 18)}
+            for i, symbol in enumerate(BALANCE_SYMBOLS)]
+
+def simple_price(query):
+    ids = query.get('ids', [''])[0].split(',')
+    return {coin: {'usd': round(1 + sum(map(ord, coin)) % 500 / 7, 4)} for coin in ids if coin}
+
+def market_chart(query):
+    start, end = int(float(query['from'][0])), int(float(query['to'][0]))
+    return {'prices': [[t * 1000, 1 + (t // 3600) % 100 / 10] for t in range(start - start % 3600, end + 1, 3600)]}
+
+# Routes on the path alone, since all services share the server
+ROUTES = [
+    (r'/api/v2/tokens/(0x\w+)/transfers', lambda state, m, q: transfers_page(state, m[1], int(q.get('items_count', ['0'])[0]))),
+    (r'/api/v2/tokens/(0x\w+)', lambda state, m, q: token_info(m[1])),
+    (r'/api/v2/addresses/(0x\w+)/token-balances', lambda state, m, q: token_balances(m[1])),
+    (r'/api/v2/smart-contracts/(0x\w+)/methods-read-proxy',
+     lambda state, m, q: [{'method_id': 'f2f3fea8', 'name': 'getStQPrice', 'outputs': [{'value': str(105 * 10 ** 16)}]}]),
+    (r'/api/v2/stats', lambda state, m, q: GENERAL_STATS),
+    (r'/api/v1/lines/(\w+)', lambda state, m, q: stats_line(state)),
+    (r'/api/v3/simple/price', lambda state, m, q: simple_price(q)),
+    (r'/api/v3/coins/([\w-]+)/market_chart/range', lambda state, m, q: market_chart(q)),
+]
+
+# Function to get the fixture file name of a request path and query
+def fixture_name(path, query=''):
+    return re.sub(r'[^A-Za-z0-9._-]', '_', path.strip('/') + ('?' + query if query else '')) + '.json'
+
+def load_fixture(state, path, query):
+    if not state.config['fixtures']:
+        return None
+    try:
+        with open(os.path.join(state.config['fixtures'], fixture_name(path, query)), 'rb') as file:
+            return file.read()
+    except FileNotFoundError:
+        return None
+
+def make_handler(state):
+    class MockHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # Headers and body go out as separate writes; without this, delayed ACKs add ~40 ms per request
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def _reply(self, status, body, endpoint, bytes_in=0, headers=None, rows=0):
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+            if not endpoint.startswith('/__'):
+                state.record(endpoint, bytes_in, len(body), status >= 400, rows)
+
+        def _maybe_fail(self, endpoint, bytes_in):
+            time.sleep(state.delay())
+            status = state.error_status()
+            if status is None:
+                return False
+            if status == 429:
+                self._reply(429, b'{"error": "rate limited"}', endpoint, bytes_in, {'Retry-After': '0'})
+            else:
+                self._reply(503, b'{"error": "unavailable"}', endpoint, bytes_in)
+            return True
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == '/__stats':
+                return self._reply(200, json.dumps(state.snapshot()).encode(), url.path)
+            if self._maybe_fail(url.path, 0):
+                return
+            body = load_fixture(state, url.path, url.query)
+            if body is None:
+                for pattern, route in ROUTES:
+                    match = re.fullmatch(pattern, url.path)
+                    if match:
+                        body = json.dumps(route(state, match, parse_qs(url.query))).encode()
+                        break
+                else:
+                    return self._reply(404, b'{"message": "Not found"}', url.path)
+            # Validators as the real services send them, so conditional requests get 304s
+            etag = '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+            if self.headers.get('If-None-Match') == etag:
+                return self._reply(304, b'', url.path, headers={'ETag': etag})
+            self._reply(200, body, url.path, headers={'ETag': etag})
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            if url.path == '/__reset':
+                state.reset()
+                return self._reply(200, b'{}', url.path)
+            if url.path == '/__config':
+                state.configure(**json.loads(body or b'{}'))
+                return self._reply(200, json.dumps(state.config).encode(), url.path)
+            if self._maybe_fail(url.path, len(body)):
+                return
+            if re.fullmatch(r'/api/v1/table/[\w-]+/[\w-]+/insert', url.path):
+                csv_text = gzip.decompress(body) if self.headers.get('Content-Encoding') == 'gzip' else body
+                rows = max(csv_text.count(b'\n') - 1, 0)
+                return self._reply(200, json.dumps({'rows_written': rows, 'bytes_written': len(csv_text)}).encode(),
+                                   url.path, len(body), rows=rows)
+            if url.path == '/api/v1/table/create':
+                return self._reply(201, b'{"message": "Table created successfully"}', url.path, len(body))
+            if url.path == '/rpc':
+                payload = json.loads(body)
+                replies = [state.chain.rpc(request) for request in payload] if isinstance(payload, list) \
+                    else state.chain.rpc(payload)
+                return self._reply(200, json.dumps(replies).encode(), url.path, len(body))
+            self._reply(404, b'{"message": "Not found"}', url.path, len(body))
+
+    return MockHandler
+
+# Function to start the server in a background thread, returns (server, state, base url).
+# state.chain is the node behind /rpc, a new MockChain unless one is given.
+def start(host=MOCK_HOST, port=0, chain=None, **config):
+    state = MockState(**config)
+    state.chain = chain or MockChain()
+    server = ThreadingHTTPServer((host, port), make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state, f"http://{host}:{server.server_address[1]}"
+
+TRANSFER_TOPIC = "0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef"
+
+def _topic(address):
+    return '0x' + '0' * 24 + address[2:].lower()
+
+def _log_matches(log_filter, log):
+    addresses = log_filter.get('address')
+    if addresses and log['address'].lower() not in {address.lower() for address in addresses}:
+        return False
+    for wanted, topic in zip(log_filter.get('topics') or [], log['topics']):
+        if wanted is not None and topic not in (wanted if isinstance(wanted, list) else [wanted]):
+            return False
+    return True
+
+# JSON-RPC error of a call, e.g. a revert (code 3)
+class RPCFault(ValueError):
+    def __init__(self, message, code=-32601):
+        super().__init__(message)
+        self.code = code
+
+def _word(value):
+    return value.to_bytes(32, 'big')
+
+# Function to decode aggregate3((address,bool,bytes)[]) calldata, after the
+# selector, into [(target, allow_failure, calldata)]
+def decode_aggregate3_calls(data):
+    word = lambda pos: int.from_bytes(data[pos:pos + 32], 'big')
+    array = word(0)
+    base = array + 32
+    calls = []
+    for i in range(word(array)):
+        start = base + word(base + 32 * i)
+        offset = start + word(start + 64)
+        calls.append(('0x' + data[start + 12:start + 32].hex(), word(start + 32) != 0,
+                      data[offset + 32:offset + 32 + word(offset)]))
+    return calls
+
+# Function to encode aggregate3's Result[] from [(success, return_data)]
+def encode_aggregate3_results(results):
+    tuples = [_word(int(success)) + _word(64) + _word(len(data)) + data + bytes(-len(data) % 32)
+              for success, data in results]
+    offsets, position = [], 32 * len(tuples)
+    for encoded in tuples:
+        offsets.append(_word(position))
+        position += len(encoded)
+    return _word(32) + _word(len(tuples)) + b''.join(offsets) + b''.join(tuples)
+
+# Chain of the JSON-RPC node stand-in, served over WebSocket (start_ws) for
+# mint_burn_stream.py and over HTTP at /rpc for rpc_reader.py. mine() adds a
+# block with Transfer logs and pushes the matching ones to eth_subscribe
+# "logs" subscribers; drop() closes every connection, like a node restart.
+# eth_call answers the values given to set_call(), and a Multicall3 at
+# multicall_address that exists from multicall_block on.
+class MockChain:
+    MULTICALL3_ADDRESS = '0xca11bde05977b3631167028862be2a173976ca11'
+    AGGREGATE3 = bytes.fromhex('82ad56cb')
+
+    def __init__(self, head=1000, block_seconds=5.0):
+        self.lock = threading.Lock()
+        self.head = head
+        self.multicall_address = self.MULTICALL3_ADDRESS
+        self.multicall_block = 0
+        # (target, calldata) -> [(from block, return data)], oldest first
+        self.calls = {}
+        self.block_seconds = block_seconds
+        self.genesis = time.time() - head * block_seconds
+        self.logs = []
+        # subscription id -> (connection, send lock, filter)
+        self.subscriptions = {}
+        self.connections = set()
+
+    def timestamp(self, block):
+        return int(self.genesis + block * self.block_seconds)
+
+    # Function to add a block with [(token, from, to, amount)] transfers, returns its number
+    def mine(self, transfers=()):
+        with self.lock:
+            self.head += 1
+            block = [{'address': token, 'topics': [TRANSFER_TOPIC, _topic(sender), _topic(receiver)],
+                      'data': hex(amount), 'blockNumber': hex(self.head), 'logIndex': hex(i),
+                      'transactionHash': '0x' + hashlib.sha256(f"{self.head}:{i}".encode()).hexdigest(),
+                      'removed': False}
+                     for i, (token, sender, receiver, amount) in enumerate(transfers)]
+            self.logs.extend(block)
+            subscriptions = list(self.subscriptions.items())
+        for subscription, (connection, send_lock, log_filter) in subscriptions:
+            for log in block:
+                if _log_matches(log_filter, log):
+                    message = {'jsonrpc': '2.0', 'method': 'eth_subscription',
+                               'params': {'subscription': subscription, 'result': log}}
+                    try:
+                        with send_lock:
+                            connection.send(json.dumps(message))
+                    except Exception:
+                        pass
+        return self.head
+
+    def drop(self):
+        with self.lock:
+            connections = list(self.connections)
+        for connection in connections:
+            connection.close()
+
+    # Function to make a call to target with calldata return data from block
+    # on; calls without a value revert
+    def set_call(self, target, calldata, data, block=0):
+        with self.lock:
+            values = self.calls.setdefault((target.lower(), bytes(calldata)), [])
+            values.append((block, bytes(data)))
+            values.sort(key=lambda value: value[0])
+
+    def _block(self, tag):
+        if tag in ('latest', 'pending', None):
+            return self.head
+        number = int(tag, 16)
+        if number > self.head:
+            raise RPCFault(f"header not found: block {number}", -32000)
+        return number
+
+    # Function to get the return data of a plain call, None when it reverts
+    def _call(self, target, calldata, block):
+        with self.lock:
+            values = [data for start, data in self.calls.get((target.lower(), calldata), []) if start <= block]
+        return values[-1] if values else None
+
+    def eth_call(self, call, tag='latest'):
+        block = self._block(tag)
+        target, calldata = call['to'].lower(), bytes.fromhex(call['data'][2:])
+        if target == self.multicall_address.lower():
+            if block < self.multicall_block:
+                # No code at the address yet, so the call returns nothing
+                return '0x'
+            if not calldata.startswith(self.AGGREGATE3):
+                raise RPCFault("execution reverted", 3)
+            results = []
+            for call_target, allow_failure, call_data in decode_aggregate3_calls(calldata[4:]):
+                data = self._call(call_target, call_data, block)
+                if data is None and not allow_failure:
+                    raise RPCFault("execution reverted: Multicall3: call failed", 3)
+                results.append((data is not None, data or b''))
+            return '0x' + encode_aggregate3_results(results).hex()
+        data = self._call(target, calldata, block)
+        if data is None:
+            raise RPCFault("execution reverted", 3)
+        return '0x' + data.hex()
+
+    # Function to answer one JSON-RPC request over HTTP, as a reply object
+    def rpc(self, request):
+        try:
+            return {'jsonrpc': '2.0', 'id': request['id'], 'result': self.answer(request)}
+        except ValueError as e:
+            return {'jsonrpc': '2.0', 'id': request['id'],
+                    'error': {'code': getattr(e, 'code', -32601), 'message': str(e)}}
+
+    def answer(self, request, connection=None, send_lock=None):
+        method, params = request['method'], request.get('params', [])
+        if method == 'eth_blockNumber':
+            return hex(self.head)
+        if method == 'eth_call':
+            return self.eth_call(*params)
+        if method == 'eth_getBlockByNumber':
+            number = self.head if params[0] == 'latest' else int(params[0], 16)
+            if number > self.head:
+                return None
+            return {'number': hex(number), 'timestamp': hex(self.timestamp(number))}
+        if method == 'eth_getLogs':
+            low, high = int(params[0]['fromBlock'], 16), int(params[0]['toBlock'], 16)
+            with self.lock:
+                return [log for log in self.logs
+                        if low <= int(log['blockNumber'], 16) <= high and _log_matches(params[0], log)]
+        if method == 'eth_subscribe' and params[0] == 'logs':
+            subscription = '0x' + os.urandom(16).hex()
+            with self.lock:
+                self.subscriptions[subscription] = (connection, send_lock, params[1])
+            return subscription
+        raise ValueError(f"unsupported method {method}")
+
+    def serve(self, connection):
+        send_lock = threading.Lock()
+        with self.lock:
+            self.connections.add(connection)
+        try:
+            for message in connection:
+                request = json.loads(message)
+                try:
+                    reply = {'jsonrpc': '2.0', 'id': request['id'], 'result': self.answer(request, connection, send_lock)}
+                except ValueError as e:
+                    reply = {'jsonrpc': '2.0', 'id': request['id'],
+                             'error': {'code': getattr(e, 'code', -32601), 'message': str(e)}}
+                with send_lock:
+                    connection.send(json.dumps(reply))
+        except Exception:
+            pass
+        finally:
+            with self.lock:
+                self.connections.discard(connection)
+                for subscription in [key for key, value in self.subscriptions.items() if value[0] is connection]:
+                    del self.subscriptions[subscription]
+
+# Function to start the WebSocket node stand-in in a background thread,
+# returns (server, chain, ws url). Needs the websockets package.
+def start_ws(host=MOCK_HOST, port=0, chain=None):
+    from websockets.sync.server import serve
+    chain = chain or MockChain()
+    server = serve(chain.serve, host, port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, chain, f"ws://{host}:{server.socket.getsockname()[1]}"
+
+# Function to mine a block every block_seconds with a random mint or burn of
+# one of the tokens, for a stream to follow
+def mine_forever(chain, tokens):
+    rng = random.Random(0)
+    while True:
+        time.sleep(chain.block_seconds)
+        transfers = []
+        if rng.random() < 0.5:
+            holder = _address(rng.randint(1, 1000))
+            sender, receiver = rng.choice([(_address(0), holder), (holder, _address(0))])
+            transfers.append((rng.choice(tokens), sender, receiver, rng.randint(1, 10**21)))
+        chain.mine(transfers)
+
+# Function to save the real responses of the endpoints a snapshot and a stats
+# run read, plus the first transfers page of each mint/burn token, as fixtures
+def record_fixtures(directory):
+    import http_client
+    import mintandburn
+    import onchain_stats
+    import tvl_data
+    os.makedirs(directory, exist_ok=True)
+    urls = [tvl_data.PRICES_URL, tvl_data.STQ_PRICE_URL, onchain_stats.ACTIVE_ACCOUNTS_ENDPOINT,
+            onchain_stats.TXNS_GROWTH_ENDPOINT, onchain_stats.GENERAL_STATS_ENDPOINT]
+    urls += [f"{tvl_data.EXPLORER_URL}/api/v2/tokens/{address}" for address in tvl_data.TOKEN_ADDRESSES.values()]
+    urls += [f"{tvl_data.EXPLORER_URL}/api/v2/addresses/{address}/token-balances"
+             for address in tvl_data.CONTRACT_ADDRESSES.values()]
+    urls += [f"{mintandburn.EXPLORER_URL}/api/v2/tokens/{address}/transfers" for address in mintandburn.TOKENS.values()]
+    for url in urls:
+        data = http_client.get_json(url)
+        if url.endswith('/transfers'):
+            # Later pages are synthetic, a recorded cursor would point nowhere
+            data['next_page_params'] = None
+        parsed = urlparse(url)
+        with open(os.path.join(directory, fixture_name(parsed.path, parsed.query)), 'w') as file:
+            json.dump(data, file)
+        print(f"Recorded {url}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve mock explorer, CoinGecko and Dune endpoints.")
+    parser.add_argument('--host', default=MOCK_HOST)
+    parser.add_argument('--port', type=int, default=MOCK_PORT)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--jitter-ms', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--transfers', type=int, default=DEFAULT_CONFIG['transfers'])
+    parser.add_argument('--chart-points', type=int, default=DEFAULT_CONFIG['chart_points'])
+    parser.add_argument('--fixtures', help=f"directory of recorded responses (e.g. {FIXTURES_DIR})")
+    parser.add_argument('--record', action='store_true', help="record fixtures from the real services and exit")
+    parser.add_argument('--ws-port', type=int, help="also serve a WebSocket JSON-RPC node that mines mints and burns")
+    parser.add_argument('--block-seconds', type=float, default=5.0)
+    args = parser.parse_args()
+
+    if args.record:
+        from dotenv import load_dotenv
+        load_dotenv()
+        record_fixtures(args.fixtures or FIXTURES_DIR)
+    else:
+        state = MockState(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate,
+                          transfers=args.transfers, chart_points=args.chart_points, fixtures=args.fixtures)
+        server = ThreadingHTTPServer((args.host, args.port), make_handler(state))
+        print(f"Mock server listening on http://{args.host}:{args.port}")
+        if args.ws_port is not None:
+            import mintandburn
+            _, chain, ws_url = start_ws(args.host, args.ws_port, MockChain(block_seconds=args.block_seconds))
+            threading.Thread(target=mine_forever, args=(chain, list(mintandburn.TOKENS.values())), daemon=True).start()
+            print(f"Mock node listening on {ws_url}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
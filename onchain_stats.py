@@ -1,11 +1,20 @@
-import requests
 import csv
+import json
 import os
+import time
 from datetime import datetime
-from dotenv import load_dotenv
 
-# Load environment variables from .env file
-load_dotenv()
+# Load environment variables from .env file when run as a script
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+
+import columnar_store
+import csv_store
+import dune_outbox
+import http_client
+import metrics
+import rollups
 
 # Get values from .env
 DUNE_API_KEY = os.getenv("DUNE_API_KEY")
@@ -15,10 +24,12 @@ TABLE_NAME3 = os.getenv("TABLE_NAME3")
 TABLE_NAME4 = os.getenv("TABLE_NAME4")
 
 # Configuration for API endpoints
-API_BASE_URL = "https://stats.explorer.q.org/api/v1/lines"
+STATS_EXPLORER_URL = os.getenv("STATS_EXPLORER_URL", "https://stats.explorer.q.org")
+EXPLORER_URL = os.getenv("EXPLORER_URL", "https://explorer.q.org")
+API_BASE_URL = f"{STATS_EXPLORER_URL}/api/v1/lines"
 ACTIVE_ACCOUNTS_ENDPOINT = f"{API_BASE_URL}/activeAccounts"
 TXNS_GROWTH_ENDPOINT = f"{API_BASE_URL}/txnsGrowth"
-GENERAL_STATS_ENDPOINT = "https://explorer.q.org/api/v2/stats"
+GENERAL_STATS_ENDPOINT = f"{EXPLORER_URL}/api/v2/stats"
 
 # Define the user and table names for Dune upload
 dune_user = NAMESPACE1  # Use namespace from .env
@@ -27,163 +38,205 @@ dune_table_transactions_growth = TABLE_NAME3  # Use table name for transactions
 dune_table_general_stats = TABLE_NAME1  # Use table name for general stats from .env
 api_key = DUNE_API_KEY  # Use API key from .env
 
-# Function to fetch data from API
-def fetch_data(url):
-    try:
-        response = requests.get(url)
-        response.raise_for_status()
-        data = response.json()
-        if 'chart' in data:
-            return data['chart']
-        return data
-    except requests.RequestException as e:
-        print(f"Error fetching data from {url}: {e}")
+# Function to fetch data from API, raises http_client.FetchError on failure.
+# The series change at most daily, so they are fetched with conditional
+# requests and an unchanged chart comes back as an empty 304. A 304 for the
+# body with digest unchanged_digest is not read again and gives [].
+def fetch_data(url, unchanged_digest=None):
+    data = http_client.get_json(url, conditional=True, unchanged_digest=unchanged_digest)
+    if data is None:
         return []
-
-# Function to load existing data
-def load_existing_data(filename, date_key='date'):
+    if 'chart' in data:
+        return data['chart']
+    return data
+
+GENERAL_STATS_FIELDNAMES = ['timestamp', 'average_block_time', 'coin_price', 'gas_average', 'gas_fast', 'gas_slow',
+                            'gas_used_today', 'market_cap', 'network_utilization_percentage', 'static_gas_price',
+                            'total_addresses', 'total_blocks', 'total_gas_used', 'total_transactions', 'transactions_today']
+
+# CSV file and date column of each series
+SERIES_FILES = {
+    'active_accounts': ('active_accounts_data.csv', 'date'),
+    'transactions_growth': ('transactions_growth_data.csv', 'date'),
+    'general_stats': ('general_stats_data.csv', 'timestamp'),
+}
+# Endpoint of each chart series
+CHART_ENDPOINTS = {
+    'active_accounts': ACTIVE_ACCOUNTS_ENDPOINT,
+    'transactions_growth': TXNS_GROWTH_ENDPOINT,
+}
+WATERMARKS_PATH = 'onchain_stats_watermarks.json'
+
+# Function to read all rows of a CSV, used for the first-run upload
+def read_csv_rows(filename):
+    with open(filename, mode='r', newline='') as file:
+        return list(csv.DictReader(file))
+
+# Function to get the last date written for each series. The stored value is
+# checked against the last rows of the CSV (read from the end of the file), so
+# rows appended just before a crash are not written twice.
+def read_watermarks():
     try:
-        existing_dates = set()
-        with open(filename, mode='r') as file:
-            reader = csv.DictReader(file)
-            for row in reader:
-                existing_dates.add(row[date_key])
-        print(f"Loaded existing data from {filename}.")
-        return existing_dates
+        with open(WATERMARKS_PATH) as file:
+            watermarks = json.load(file)
     except FileNotFoundError:
-        print(f"No existing data found for {filename}. Starting fresh.")
-        return set()
+        watermarks = {}
+    for series, (filename, date_key) in SERIES_FILES.items():
+        dates = [watermarks[series]] if watermarks.get(series) else []
+        if os.path.isfile(filename):
+            dates += [row[date_key] for row in csv_store.tail_rows(filename, 5) if row.get(date_key)]
+        watermarks[series] = max(dates) if dates else None
+    return watermarks
+
+# Function to get the chart bodies the watermarks already covered today,
+# {series: body digest}. Watermarks keep 'bodies' as {series: [digest, day]}.
+def covered_bodies(watermarks):
+    today_date = datetime.now().strftime('%Y-%m-%d')
+    return {series: body_digest for series, (body_digest, day) in watermarks.get('bodies', {}).items()
+            if day == today_date}
+
+# Function to record the chart bodies whose points are all written, except
+# today's, which a later day's run has to read again
+def record_covered_bodies(watermarks, stats):
+    import http_cache
+    today_date = datetime.now().strftime('%Y-%m-%d')
+    bodies = {}
+    for series, url in CHART_ENDPOINTS.items():
+        body_digest = http_cache.stored_digest(url)
+        if body_digest and all(row['date'] <= (watermarks[series] or '') or row['date'] == today_date
+                               for row in stats[series]):
+            bodies[series] = [body_digest, today_date]
+    watermarks['bodies'] = bodies
+
+def write_watermarks(watermarks):
+    temp_path = WATERMARKS_PATH + '.tmp'
+    with open(temp_path, 'w') as file:
+        json.dump(watermarks, file)
+    os.replace(temp_path, WATERMARKS_PATH)
+
+# Function to get the chart points newer than the watermark, oldest first.
+# Today's point is still changing, so it is left for a later run.
+def new_points(data, watermark, ignore_today=True):
+    today_date = datetime.now().strftime('%Y-%m-%d')  # Get today's date in 'YYYY-MM-DD' format
+    rows = [{'date': row['date'], 'value': row['value']} for row in data
+            if (watermark is None or row['date'] > watermark) and (not ignore_today or row['date'] != today_date)]
+    return sorted(rows, key=lambda row: row['date'])
 
 # Function to save data to CSV
-def save_data_to_csv(data, filename, existing_dates, ignore_today=True):
-    file_exists = os.path.isfile(filename)
-    with open(filename, mode='a', newline='') as file:
-        fieldnames = ['date', 'value']
-        writer = csv.DictWriter(file, fieldnames=fieldnames)
-        if not file_exists:
-            writer.writeheader()
-            print(f"Created new CSV file {filename}.")
-        today_date = datetime.now().strftime('%Y-%m-%d')  # Get today's date in 'YYYY-MM-DD' format
-        for row in data:
-            if row['date'] not in existing_dates and (not ignore_today or row['date'] != today_date):
-                writer.writerow(row)
-                existing_dates.add(row['date'])
-        print(f"Saved data to {filename}.")
-
-# Function to save general stats data to CSV
-def save_general_stats_to_csv(stats, filename, existing_timestamps):
-    file_exists = os.path.isfile(filename)
-    with open(filename, mode='a', newline='') as file:
-        fieldnames = ['timestamp', 'average_block_time', 'coin_price', 'gas_average', 'gas_fast', 'gas_slow', 
-                      'gas_used_today', 'market_cap', 'network_utilization_percentage', 'static_gas_price', 
-                      'total_addresses', 'total_blocks', 'total_gas_used', 'total_transactions', 'transactions_today']
-        writer = csv.DictWriter(file, fieldnames=fieldnames)
-        if not file_exists:
-            writer.writeheader()
-            print(f"Created new general stats CSV file {filename}.")
-        
-        # Format the timestamp for the CSV file
+def save_data_to_csv(rows, filename):
+    if rows:
+        csv_store.append_rows(filename, ['date', 'value'], rows)
+    print(f"Saved {len(rows)} new rows to {filename}.")
+    return rows
+
+# Function to turn the explorer's stats response into one general stats row
+def flatten_general_stats(stats):
+    # Work on a copy, the response may be shared through the HTTP cache
+    stats = dict(stats)
+    # Format the timestamp for the CSV file
+    if not stats.get('timestamp'):
         stats['timestamp'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
-        # Ensure gas_prices is properly extracted and removed
-        gas_prices = stats.pop('gas_prices', {})
-        if gas_prices:
-            stats['gas_average'] = gas_prices.get('average', '')
-            stats['gas_fast'] = gas_prices.get('fast', '')
-            stats['gas_slow'] = gas_prices.get('slow', '')
-        else:
-            stats['gas_average'], stats['gas_fast'], stats['gas_slow'] = '', '', ''
-        
-        # Check if all necessary fields are in stats; if not, set them to an empty string
-        for field in fieldnames:
-            if field not in stats or stats[field] is None:
-                stats[field] = ''
-                
-        writer.writerow(stats)
-        print(f"Saved general stats to {filename}.")
-
-# Function to upload CSV to Dune
-def upload_to_dune(csv_path, space, tablename):
-    url = f"https://api.dune.com/api/v1/table/{space}/{tablename}/insert"
-    headers = {
-        "X-DUNE-API-KEY": api_key,  # Use the Dune API key variable
-        "Content-Type": "text/csv"
+    # Ensure gas_prices is properly extracted and removed
+    if 'gas_prices' in stats:
+        gas_prices = stats.pop('gas_prices') or {}
+        stats['gas_average'] = gas_prices.get('average', '')
+        stats['gas_fast'] = gas_prices.get('fast', '')
+        stats['gas_slow'] = gas_prices.get('slow', '')
+
+    # Check if all necessary fields are in stats; if not, set them to an empty string
+    for field in GENERAL_STATS_FIELDNAMES:
+        if field not in stats or stats[field] is None:
+            stats[field] = ''
+    return stats
+
+# Function to save general stats data to CSV
+def save_general_stats_to_csv(stats, filename):
+    row = {field: stats.get(field, '') for field in GENERAL_STATS_FIELDNAMES}
+    csv_store.append_rows(filename, GENERAL_STATS_FIELDNAMES, [row])
+    print(f"Saved general stats to {filename}.")
+    return row
+
+# Function to fetch the three chain stats series without writing anything.
+# Returns {'active_accounts': [...], 'transactions_growth': [...], 'general_stats': {...}}.
+# A chart whose body is in covered ({series: body digest}) and unchanged is [].
+def collect_chain_stats(covered=None):
+    covered = covered or {}
+    return {
+        'active_accounts': fetch_data(ACTIVE_ACCOUNTS_ENDPOINT, covered.get('active_accounts')),
+        'transactions_growth': fetch_data(TXNS_GROWTH_ENDPOINT, covered.get('transactions_growth')),
+        'general_stats': flatten_general_stats(fetch_data(GENERAL_STATS_ENDPOINT)),
     }
-    with open(csv_path, "rb") as data:
-        response = requests.post(url, data=data, headers=headers)
-        print(f"Upload response for {space}/{tablename}: {response.text}")
-
-# Function to create a temporary CSV file with new data
-def create_temp_csv(new_data, filename, fieldnames):
-    if not new_data:
-        print(f"No new data to write to {filename}. Skipping temporary file creation.")
-        return None
-
-    temp_filename = f"temp_{filename}"
-    with open(temp_filename, mode='w', newline='') as file:
-        writer = csv.DictWriter(file, fieldnames=fieldnames)
-        writer.writeheader()
-        writer.writerows(new_data)
-    print(f"Created temporary CSV file {temp_filename} for upload.")
-    return temp_filename
 
 # Main execution function
 def main():
     # Manually set this flag to True for the first run, then False for subsequent runs
     first_run = False
 
-    # Fetch data from APIs
+    started = time.time()
+    watermarks = read_watermarks()
+    # Fetch data from APIs. A chart the watermarks already cover is not parsed
+    # again when the server answers 304.
     print("Fetching data from APIs...")
-    active_accounts_data = fetch_data(ACTIVE_ACCOUNTS_ENDPOINT)
-    transactions_growth_data = fetch_data(TXNS_GROWTH_ENDPOINT)
-    general_stats_data = fetch_data(GENERAL_STATS_ENDPOINT)
-
-    # Load existing data and update CSVs
-    existing_active_accounts = load_existing_data('active_accounts_data.csv')
-    existing_transactions_growth = load_existing_data('transactions_growth_data.csv')
-    existing_general_stats = load_existing_data('general_stats_data.csv', date_key='timestamp')
-    
-    save_data_to_csv(active_accounts_data, 'active_accounts_data.csv', existing_active_accounts)
-    save_data_to_csv(transactions_growth_data, 'transactions_growth_data.csv', existing_transactions_growth, ignore_today=True)
-    save_general_stats_to_csv(general_stats_data, 'general_stats_data.csv', existing_general_stats)
+    with metrics.stage('onchain_stats', 'fetch'):
+        stats = collect_chain_stats(covered_bodies(watermarks))
+    metrics.rows('onchain_stats', 'fetched', len(stats['active_accounts']) + len(stats['transactions_growth']) + 1)
+
+    # Keep only points newer than each series' watermark, so the work and the
+    # upload depend on how many points are new, not on the length of the history
+    with metrics.stage('onchain_stats', 'dedupe'):
+        new_active_accounts = new_points(stats['active_accounts'], watermarks['active_accounts'])
+        new_transactions_growth = new_points(stats['transactions_growth'], watermarks['transactions_growth'])
+        general_stats = {field: stats['general_stats'].get(field, '') for field in GENERAL_STATS_FIELDNAMES}
+    metrics.rows('onchain_stats', 'new', len(new_active_accounts) + len(new_transactions_growth) + 1)
+
+    with metrics.stage('onchain_stats', 'persist'):
+        # Queue for Dune before writing: if the run dies after queuing, the next
+        # run finds the same points and re-queuing them with the same keys is a no-op
+        outbox = dune_outbox.connect()
+        dune_outbox.enqueue(outbox, dune_user, dune_table_active_accounts, ['date', 'value'], new_active_accounts, ['date'])
+        dune_outbox.enqueue(outbox, dune_user, dune_table_transactions_growth, ['date', 'value'], new_transactions_growth, ['date'])
+        dune_outbox.enqueue(outbox, dune_user, dune_table_general_stats, GENERAL_STATS_FIELDNAMES, [general_stats], ['timestamp'])
+
+        saved_active_accounts = save_data_to_csv(new_active_accounts, 'active_accounts_data.csv')
+        saved_transactions_growth = save_data_to_csv(new_transactions_growth, 'transactions_growth_data.csv')
+        saved_general_stats = save_general_stats_to_csv(general_stats, 'general_stats_data.csv')
+
+        # Mirror the new rows into the columnar store when COLUMNAR_STORE=1
+        columnar_store.append_if_enabled('active_accounts_data', saved_active_accounts)
+        columnar_store.append_if_enabled('transactions_growth_data', saved_transactions_growth)
+        columnar_store.append_if_enabled('general_stats_data', [saved_general_stats])
+
+        # Fold the new points into the daily/monthly rollup tables
+        rollup_conn = rollups.connect()
+        rollup_changes = rollups.update_chain_stats(rollup_conn, saved_transactions_growth, saved_active_accounts)
+        rollup_conn.close()
+        rollups.enqueue_changes(outbox, rollup_changes, dune_user)
+
+        for series, rows, date_key in (('active_accounts', saved_active_accounts, 'date'),
+                                       ('transactions_growth', saved_transactions_growth, 'date'),
+                                       ('general_stats', [saved_general_stats], 'timestamp')):
+            if rows:
+                watermarks[series] = max(watermarks[series] or '', rows[-1][date_key])
+        record_covered_bodies(watermarks, stats)
+        write_watermarks(watermarks)
+    metrics.rows('onchain_stats', 'written', len(saved_active_accounts) + len(saved_transactions_growth) + 1)
 
     if first_run:
-        # Upload entire CSV files for the first run
-        print("First run: Uploading entire CSV files to Dune.")
-        upload_to_dune('active_accounts_data.csv', dune_user, dune_table_active_accounts)
-        upload_to_dune('transactions_growth_data.csv', dune_user, dune_table_transactions_growth)
-        upload_to_dune('general_stats_data.csv', dune_user, dune_table_general_stats)
-    else:
-        # Force creation of temporary CSV for active accounts data even if no new data
-        temp_active_accounts_csv = create_temp_csv(active_accounts_data, 'active_accounts_data.csv', ['date', 'value'])
-        
-        new_transactions_growth_data = [row for row in transactions_growth_data if row['date'] not in existing_transactions_growth]
-        new_general_stats_data = [general_stats_data] if general_stats_data['timestamp'] not in existing_general_stats else []
-
-        temp_transactions_growth_csv = create_temp_csv(new_transactions_growth_data, 'transactions_growth_data.csv', ['date', 'value'])
-        temp_general_stats_csv = create_temp_csv(new_general_stats_data, 'general_stats_data.csv', [
-            'timestamp', 'average_block_time', 'coin_price', 'gas_average', 'gas_fast', 'gas_slow', 
-            'gas_used_today', 'market_cap', 'network_utilization_percentage', 'static_gas_price', 
-            'total_addresses', 'total_blocks', 'total_gas_used', 'total_transactions', 'transactions_today'
-        ])
-
-        # Upload new data to Dune
-        print("Subsequent run: Uploading new data to Dune.")
-        if temp_active_accounts_csv:
-            upload_to_dune(temp_active_accounts_csv, dune_user, dune_table_active_accounts)
-        if temp_transactions_growth_csv:
-            upload_to_dune(temp_transactions_growth_csv, dune_user, dune_table_transactions_growth)
-        if temp_general_stats_csv:
-            upload_to_dune(temp_general_stats_csv, dune_user, dune_table_general_stats)
-
-        # Remove temporary CSV files
-        if temp_active_accounts_csv:
-            os.remove(temp_active_accounts_csv)
-        if temp_transactions_growth_csv:
-            os.remove(temp_transactions_growth_csv)
-        if temp_general_stats_csv:
-            os.remove(temp_general_stats_csv)
-        print("Temporary CSV files removed.")
+        # Queue entire CSV files for the first run
+        print("First run: Queuing entire CSV files for Dune.")
+        dune_outbox.enqueue(outbox, dune_user, dune_table_active_accounts, ['date', 'value'], read_csv_rows('active_accounts_data.csv'), ['date'])
+        dune_outbox.enqueue(outbox, dune_user, dune_table_transactions_growth, ['date', 'value'], read_csv_rows('transactions_growth_data.csv'), ['date'])
+        dune_outbox.enqueue(outbox, dune_user, dune_table_general_stats, GENERAL_STATS_FIELDNAMES, read_csv_rows('general_stats_data.csv'), ['timestamp'])
+
+    with metrics.stage('onchain_stats', 'upload'):
+        uploaded = dune_outbox.flush(outbox, dune_user, api_key)
+    metrics.rows('onchain_stats', 'uploaded', uploaded)
+    print(f"Uploaded {uploaded} rows to Dune, {dune_outbox.pending_count(outbox)} pending.")
+    outbox.close()
+
+    http_client.print_stats()
+    metrics.write_run('onchain_stats', started)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
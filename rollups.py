@@ -0,0 +1,303 @@
+import os
+import sqlite3
+import sys
+from datetime import datetime, timedelta
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+
+import csv_store
+
+# Pre-aggregated day/week/month tables kept next to the raw history.
+#
+# Each appended snapshot updates its day bucket in place (running sums and
+# counts), then the week and month that contain that day are recomputed from
+# their daily rows (at most 31 rows). Every changed bucket gets a new
+# updated_at, and only changed buckets are uploaded. Dune inserts are
+# append-only, so dashboards take the row with the latest updated_at per bucket.
+
+DB_PATH = os.getenv("ROLLUPS_DB", "rollups.sqlite")
+
+# Averaged TVL metrics, as in the WeeklyAverages/MonthlyAverages CTEs of tvl_analysis.sql
+TVL_METRICS = ['bridged_usd_value', 'borrowing_tvl', 'elk_tvl', 'saving_tvl', 'total_tvl']
+# Values kept from the 09:00 snapshot of each day, as filtered in infinity.sql
+ANCHOR_FIELDS = ['bridged_usdc', 'bridged_weth', 'bridged_elk', 'weth_in_usd', 'elk_in_usd']
+
+TVL_BUCKET_COLUMNS = ['snapshots'] + [f'{prefix}_{metric}' for metric in TVL_METRICS for prefix in ('sum', 'n', 'avg')]
+
+TABLES = {
+    'tvl_daily': ['day'] + TVL_BUCKET_COLUMNS + [f'anchor_{field}' for field in ANCHOR_FIELDS]
+                 + ['new_usdc_bridged', 'new_weth_bridged', 'new_elk_bridged', 'new_bridged_value_usd', 'updated_at'],
+    'tvl_weekly': ['week_start'] + TVL_BUCKET_COLUMNS + ['new_bridged_value_usd', 'updated_at'],
+    'tvl_monthly': ['month_start'] + TVL_BUCKET_COLUMNS + ['new_bridged_value_usd', 'updated_at'],
+    'chain_daily': ['day', 'tx_total', 'daily_transactions', 'active_accounts',
+                    'transaction_growth_rate', 'account_growth_rate', 'updated_at'],
+    'chain_monthly': ['month_start', 'month_end', 'monthly_transactions', 'monthly_active_accounts',
+                      'avg_transaction_growth_rate', 'avg_account_growth_rate', 'updated_at'],
+}
+
+# Dune table name for each rollup, from .env
+DUNE_TABLES = {table: os.getenv(f"TABLE_NAME_{table.upper()}") for table in TABLES}
+# .env names of the Dune namespace and API key of the collector that uploads
+# each rollup: tvl_data for the TVL tables, onchain_stats for the chain tables
+DUNE_CREDENTIALS = {table: ('NAMESPACE2', 'DUNE_API_KEY2') if table.startswith('tvl_') else ('NAMESPACE1', 'DUNE_API_KEY')
+                    for table in TABLES}
+
+def connect(path=DB_PATH):
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    for table, columns in TABLES.items():
+        key = columns[0]
+        definitions = ', '.join(f'"{column}"' + (' TEXT PRIMARY KEY' if column == key else '') for column in columns)
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({definitions})")
+    return conn
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def _multiply(*values):
+    if any(value is None for value in values):
+        return None
+    result = 1.0
+    for value in values:
+        result *= value
+    return result
+
+def _add(*values):
+    return None if any(value is None for value in values) else sum(values)
+
+# Per-snapshot TVL metrics, same formulas as the *_calc columns of tvl_analysis.sql
+def tvl_metrics(row):
+    v = {key: _number(value) for key, value in row.items()}
+    elk_tvl = _add(_multiply(v['elk_locked_wbtc'], v['btc_in_usd']), v['elk_locked_usdc'], v['elk_locked_dai'],
+                   _multiply(v['elk_locked_elk'], v['elk_in_usd']), v['elk_locked_qusd'],
+                   _multiply(v['elk_locked_vnxau'], v['vnxau_in_usd']))
+    borrowing_tvl = _add(_multiply(v['locked_wbtc'], v['btc_in_usd']), v['locked_usdc'], v['locked_dai'])
+    return {
+        'bridged_usd_value': _add(_multiply(v['bridged_wbtc'], v['btc_in_usd']), v['bridged_usdc'], v['bridged_dai'],
+                                  _multiply(v['bridged_elk'], v['elk_in_usd']), _multiply(v['bridged_weth'], v['weth_in_usd'])),
+        'borrowing_tvl': borrowing_tvl,
+        'elk_tvl': elk_tvl,
+        'saving_tvl': v['saving_tvl'],
+        'total_tvl': _add(elk_tvl, borrowing_tvl, v['saving_tvl']),
+    }
+
+def _now():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+def _week_start(day):
+    date = datetime.strptime(day, '%Y-%m-%d')
+    return (date - timedelta(days=date.weekday())).strftime('%Y-%m-%d')
+
+def _month_start(day):
+    return day[:7] + '-01'
+
+def _month_end(month_start):
+    date = datetime.strptime(month_start, '%Y-%m-%d')
+    next_month = (date.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return (next_month - timedelta(days=1)).strftime('%Y-%m-%d')
+
+def _upsert(conn, table, values):
+    columns = list(values)
+    placeholders = ', '.join('?' for _ in columns)
+    names = ', '.join(f'"{column}"' for column in columns)
+    conn.execute(f"INSERT OR REPLACE INTO {table} ({names}) VALUES ({placeholders})", [values[c] for c in columns])
+
+def _get(conn, table, key):
+    row = conn.execute(f'SELECT * FROM {table} WHERE "{TABLES[table][0]}" = ?', (key,)).fetchone()
+    return dict(row) if row else None
+
+# Function to get the bucket before key, optionally only among those matching condition
+def _previous(conn, table, key, condition='1'):
+    key_column = TABLES[table][0]
+    row = conn.execute(f'SELECT * FROM {table} WHERE "{key_column}" < ? AND {condition} '
+                       f'ORDER BY "{key_column}" DESC LIMIT 1', (key,)).fetchone()
+    return dict(row) if row else None
+
+def _next(conn, table, key, condition='1'):
+    key_column = TABLES[table][0]
+    row = conn.execute(f'SELECT * FROM {table} WHERE "{key_column}" > ? AND {condition} '
+                       f'ORDER BY "{key_column}" LIMIT 1', (key,)).fetchone()
+    return dict(row) if row else None
+
+# infinity.sql takes its LAG over the days with a 09:00 snapshot only
+ANCHORED = 'anchor_bridged_usdc IS NOT NULL'
+
+def _set_new_bridged(bucket, previous):
+    # LAG deltas of infinity.sql; the first day keeps the totals (COALESCE)
+    if bucket['anchor_bridged_usdc'] is None:
+        return
+    deltas = {}
+    for field, name in (('bridged_usdc', 'new_usdc_bridged'), ('bridged_weth', 'new_weth_bridged'), ('bridged_elk', 'new_elk_bridged')):
+        current = bucket[f'anchor_{field}']
+        before = previous[f'anchor_{field}'] if previous else None
+        deltas[name] = _add(current, -before) if before is not None and current is not None else current
+        bucket[name] = deltas[name]
+    bucket['new_bridged_value_usd'] = _add(deltas['new_usdc_bridged'],
+                                           _multiply(deltas['new_weth_bridged'], bucket['anchor_weth_in_usd']),
+                                           _multiply(deltas['new_elk_bridged'], bucket['anchor_elk_in_usd']))
+
+# Recompute one week or month bucket from its daily rows
+def _rebuild_tvl_period(conn, table, key, first_day, last_day, updated_at):
+    days = [dict(row) for row in conn.execute(
+        "SELECT * FROM tvl_daily WHERE day >= ? AND day <= ? ORDER BY day", (first_day, last_day))]
+    bucket = {TABLES[table][0]: key, 'snapshots': sum(day['snapshots'] for day in days)}
+    for metric in TVL_METRICS:
+        total = sum(day[f'sum_{metric}'] or 0 for day in days)
+        count = sum(day[f'n_{metric}'] or 0 for day in days)
+        bucket[f'sum_{metric}'], bucket[f'n_{metric}'] = total, count
+        bucket[f'avg_{metric}'] = total / count if count else None
+    new_values = [day['new_bridged_value_usd'] for day in days if day['new_bridged_value_usd'] is not None]
+    bucket['new_bridged_value_usd'] = sum(new_values) if new_values else None
+    bucket['updated_at'] = updated_at
+    _upsert(conn, table, bucket)
+    return bucket
+
+# Function to fold new token_and_contract_data rows into the TVL rollups.
+# Returns {table: [changed bucket rows]}.
+def update_tvl(conn, rows):
+    updated_at = _now()
+    changed_days = {}
+    for row in rows:
+        date = datetime.strptime(row['date'], '%Y-%m-%d %H:%M:%S')
+        day = date.strftime('%Y-%m-%d')
+        bucket = _get(conn, 'tvl_daily', day) or {column: None for column in TABLES['tvl_daily']}
+        bucket['day'] = day
+        bucket['snapshots'] = (bucket['snapshots'] or 0) + 1
+        for metric, value in tvl_metrics(row).items():
+            if value is not None:
+                bucket[f'sum_{metric}'] = (bucket[f'sum_{metric}'] or 0) + value
+                bucket[f'n_{metric}'] = (bucket[f'n_{metric}'] or 0) + 1
+            count = bucket[f'n_{metric}']
+            bucket[f'avg_{metric}'] = bucket[f'sum_{metric}'] / count if count else None
+        if date.hour == 9 and date.minute == 0 and bucket['anchor_bridged_usdc'] is None:
+            for field in ANCHOR_FIELDS:
+                bucket[f'anchor_{field}'] = _number(row.get(field))
+            _set_new_bridged(bucket, _previous(conn, 'tvl_daily', day, ANCHORED))
+            # The next anchored day's delta depends on this anchor
+            following = _next(conn, 'tvl_daily', day, ANCHORED)
+            if following:
+                _set_new_bridged(following, bucket)
+                following['updated_at'] = updated_at
+                _upsert(conn, 'tvl_daily', following)
+                changed_days[following['day']] = following
+        bucket['updated_at'] = updated_at
+        _upsert(conn, 'tvl_daily', bucket)
+        changed_days[day] = bucket
+
+    changes = {'tvl_daily': list(changed_days.values()), 'tvl_weekly': [], 'tvl_monthly': []}
+    for week_start in sorted({_week_start(day) for day in changed_days}):
+        last_day = (datetime.strptime(week_start, '%Y-%m-%d') + timedelta(days=6)).strftime('%Y-%m-%d')
+        changes['tvl_weekly'].append(_rebuild_tvl_period(conn, 'tvl_weekly', week_start, week_start, last_day, updated_at))
+    for month_start in sorted({_month_start(day) for day in changed_days}):
+        changes['tvl_monthly'].append(_rebuild_tvl_period(conn, 'tvl_monthly', month_start, month_start, _month_end(month_start), updated_at))
+    conn.commit()
+    return changes
+
+def _growth(current, previous):
+    if current is None or previous is None or previous == 0:
+        return None
+    return (current - previous) / previous * 100
+
+def _refresh_chain_day(conn, bucket, updated_at):
+    previous = _previous(conn, 'chain_daily', bucket['day'])
+    if bucket['tx_total'] is not None:
+        previous_total = previous['tx_total'] if previous else None
+        bucket['daily_transactions'] = bucket['tx_total'] - previous_total if previous_total is not None else 0
+    bucket['transaction_growth_rate'] = _growth(bucket['daily_transactions'], previous['daily_transactions'] if previous else None)
+    bucket['account_growth_rate'] = _growth(bucket['active_accounts'], previous['active_accounts'] if previous else None)
+    bucket['updated_at'] = updated_at
+    _upsert(conn, 'chain_daily', bucket)
+
+# Function to fold new transactions_growth/active_accounts points into the
+# chain rollups (account_transactions_analysis.sql). Returns {table: [changed rows]}.
+def update_chain_stats(conn, transactions_growth=(), active_accounts=()):
+    updated_at = _now()
+    changed_days = {}
+    points = [(row['date'], 'tx_total', row['value']) for row in transactions_growth] + \
+             [(row['date'], 'active_accounts', row['value']) for row in active_accounts]
+    for day, field, value in sorted(points):
+        bucket = changed_days.get(day) or _get(conn, 'chain_daily', day) or {column: None for column in TABLES['chain_daily']}
+        bucket['day'] = day
+        bucket[field] = _number(value)
+        _refresh_chain_day(conn, bucket, updated_at)
+        changed_days[day] = bucket
+    # The day after each changed day has deltas against it
+    for day in sorted(changed_days):
+        following = _next(conn, 'chain_daily', day)
+        if following and following['day'] not in changed_days:
+            _refresh_chain_day(conn, following, updated_at)
+            changed_days[following['day']] = following
+
+    changes = {'chain_daily': list(changed_days.values()), 'chain_monthly': []}
+    for month_start in sorted({_month_start(day) for day in changed_days}):
+        month_end = _month_end(month_start)
+        days = [dict(row) for row in conn.execute(
+            "SELECT * FROM chain_daily WHERE day >= ? AND day <= ? AND tx_total IS NOT NULL AND active_accounts IS NOT NULL",
+            (month_start, month_end))]
+        tx_rates = [day['transaction_growth_rate'] for day in days if day['transaction_growth_rate'] is not None]
+        account_rates = [day['account_growth_rate'] for day in days if day['account_growth_rate'] is not None]
+        bucket = {
+            'month_start': month_start,
+            'month_end': month_end,
+            'monthly_transactions': sum(day['daily_transactions'] or 0 for day in days),
+            'monthly_active_accounts': sum(day['active_accounts'] or 0 for day in days),
+            'avg_transaction_growth_rate': sum(tx_rates) / len(tx_rates) if tx_rates else None,
+            'avg_account_growth_rate': sum(account_rates) / len(account_rates) if account_rates else None,
+            'updated_at': updated_at,
+        }
+        _upsert(conn, 'chain_monthly', bucket)
+        changes['chain_monthly'].append(bucket)
+    conn.commit()
+    return changes
+
+# Function to export a rollup table to CSV for inspection or a full upload
+def export_csv(conn, table, path=None):
+    path = path or f"{table}.csv"
+    key = TABLES[table][0]
+    rows = [dict(row) for row in conn.execute(f'SELECT * FROM {table} ORDER BY "{key}"')]
+    csv_store.write_csv(path, TABLES[table], rows)
+    return path
+
+# Function to queue changed buckets for their Dune tables (skips tables without a
+# configured name). Each bucket version is its own row, keyed on bucket and updated_at.
+def enqueue_changes(outbox, changes, namespace):
+    import dune_outbox
+    for table, rows in changes.items():
+        dune_table = DUNE_TABLES.get(table)
+        if rows and dune_table:
+            dune_outbox.enqueue(outbox, namespace, dune_table, TABLES[table], rows, [TABLES[table][0], 'updated_at'])
+
+# One-time rebuild of all rollups from the full CSV histories
+def rebuild(conn):
+    import csv
+    for table in TABLES:
+        conn.execute(f"DELETE FROM {table}")
+    conn.commit()
+    if os.path.exists('token_and_contract_data.csv'):
+        with open('token_and_contract_data.csv', newline='') as file:
+            rows = sorted(csv.DictReader(file), key=lambda row: row['date'])
+        update_tvl(conn, rows)
+    series = {}
+    for name in ('transactions_growth_data.csv', 'active_accounts_data.csv'):
+        if os.path.exists(name):
+            with open(name, newline='') as file:
+                series[name] = list(csv.DictReader(file))
+    update_chain_stats(conn, series.get('transactions_growth_data.csv', []), series.get('active_accounts_data.csv', []))
+    for table in TABLES:
+        print(f"Rebuilt {table}: {conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]} rows")
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    conn = connect()
+    if command == "rebuild":
+        rebuild(conn)
+    elif command == "export":
+        for table in TABLES:
+            print(f"Exported {export_csv(conn, table)}")
+    else:
+        print("Usage: python rollups.py rebuild|export")
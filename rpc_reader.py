@@ -0,0 +1,197 @@
+import os
+import time
+from urllib.parse import urlparse
+import http_client
+from fetch_engine import get_bucket
+
+# Reads contract state straight from a Q JSON-RPC node.
+#
+# read() takes a list of (target, calldata) calls. With a Multicall3
+# contract they all go into one aggregate3 eth_call, so every value comes
+# from the same block in one round trip. With MULTICALL3_ADDRESS set to an
+# empty string, the calls are sent as one JSON-RPC batch pinned to the
+# current block number instead (two round trips).
+#
+# read_at_blocks() and blocks_at_times() serve historical reads for
+# backfill.py; they need an archive node behind Q_RPC_URL.
+
+RPC_URL = os.getenv("Q_RPC_URL", "https://rpc.q.org")
+# Multicall3 is deployed at the same address on most EVM chains
+MULTICALL3_ADDRESS = os.getenv("MULTICALL3_ADDRESS", "0xcA11bde05977b3631167028862bE2a173976CA11")
+
+# 4-byte function selectors
+TOTAL_SUPPLY = "18160ddd"  # totalSupply()
+BALANCE_OF = "70a08231"    # balanceOf(address)
+DECIMALS = "313ce567"      # decimals()
+GET_STQ_PRICE = "f2f3fea8" # getStQPrice()
+AGGREGATE3 = "82ad56cb"    # aggregate3((address,bool,bytes)[])
+
+# Raised for JSON-RPC level errors (the HTTP request itself succeeded)
+class RPCError(Exception):
+    pass
+
+def _word(value):
+    return value.to_bytes(32, 'big')
+
+def _address_word(address):
+    return bytes(12) + bytes.fromhex(address[2:] if address.startswith('0x') else address)
+
+# Function to build the calldata of a call taking only static arguments
+# (addresses and uints), e.g. encode_call(BALANCE_OF, holder)
+def encode_call(selector, *args):
+    data = bytes.fromhex(selector)
+    for arg in args:
+        data += _address_word(arg) if isinstance(arg, str) else _word(arg)
+    return data
+
+def decode_uint(data):
+    return int.from_bytes(data[:32], 'big')
+
+def _pad(data):
+    return data + bytes(-len(data) % 32)
+
+# Function to encode aggregate3(Call3[] calls) with allowFailure set on every
+# call, so one reverting call does not fail the whole snapshot
+def encode_aggregate3(calls):
+    tuples = []
+    for target, calldata in calls:
+        tuples.append(_address_word(target) + _word(1) + _word(96) + _word(len(calldata)) + _pad(calldata))
+    offsets = []
+    position = 32 * len(tuples)
+    for encoded in tuples:
+        offsets.append(_word(position))
+        position += len(encoded)
+    return bytes.fromhex(AGGREGATE3) + _word(32) + _word(len(tuples)) + b''.join(offsets) + b''.join(tuples)
+
+# Function to decode aggregate3's Result[] into a list of (success, returnData)
+def decode_aggregate3(data):
+    array = decode_uint(data[0:32])
+    count = decode_uint(data[array:array + 32])
+    base = array + 32
+    results = []
+    for i in range(count):
+        start = base + decode_uint(data[base + 32 * i:base + 32 * i + 32])
+        success = decode_uint(data[start:start + 32]) != 0
+        offset = start + decode_uint(data[start + 32:start + 64])
+        length = decode_uint(data[offset:offset + 32])
+        results.append((success, data[offset + 32:offset + 32 + length]))
+    return results
+
+def _post(payload, rpc_url):
+    # eth_call and eth_blockNumber are reads, so retrying them is safe
+    get_bucket(urlparse(rpc_url).hostname).acquire()
+    response = http_client.post(rpc_url, json=payload, idempotent=True)
+    try:
+        return response.json()
+    except ValueError as e:
+        raise http_client.FetchError(rpc_url, f"invalid JSON: {e}", response.status_code)
+
+def _result(reply):
+    if 'error' in reply:
+        raise RPCError(f"{reply['error'].get('code')}: {reply['error'].get('message')}")
+    return reply['result']
+
+def _call_params(target, calldata, block):
+    return [{'to': target, 'data': '0x' + calldata.hex()}, block]
+
+def eth_call(target, calldata, block='latest', rpc_url=RPC_URL):
+    reply = _post({'jsonrpc': '2.0', 'id': 1, 'method': 'eth_call', 'params': _call_params(target, calldata, block)}, rpc_url)
+    return bytes.fromhex(_result(reply)[2:])
+
+def block_number(rpc_url=RPC_URL):
+    return int(_result(_post({'jsonrpc': '2.0', 'id': 1, 'method': 'eth_blockNumber', 'params': []}, rpc_url)), 16)
+
+# Function to send [(method, params), ...] as one JSON-RPC batch. Returns the
+# results in request order, with None for requests that returned an error.
+def batch(requests, rpc_url=RPC_URL):
+    if not requests:
+        return []
+    payload = [{'jsonrpc': '2.0', 'id': i, 'method': method, 'params': params}
+               for i, (method, params) in enumerate(requests)]
+    replies = {reply['id']: reply for reply in _post(payload, rpc_url)}
+    return [replies.get(i, {}).get('result') for i in range(len(requests))]
+
+# Function to send the calls as one JSON-RPC batch at a fixed block.
+# A call that reverts comes back as (False, b'').
+def batch_call(calls, block, rpc_url=RPC_URL):
+    results = batch([('eth_call', _call_params(target, calldata, block)) for target, calldata in calls], rpc_url)
+    return [(False, b'') if result is None else (True, bytes.fromhex(result[2:])) for result in results]
+
+# Function to run the calls in one round trip. Returns a list of
+# (success, returnData) in call order.
+def read(calls, rpc_url=RPC_URL, multicall_address=MULTICALL3_ADDRESS, block='latest'):
+    started = time.monotonic()
+    if multicall_address:
+        results = decode_aggregate3(eth_call(multicall_address, encode_aggregate3(calls), block, rpc_url))
+    else:
+        results = batch_call(calls, hex(block_number(rpc_url)) if block == 'latest' else block, rpc_url)
+    print(f"Read {len(calls)} contract calls over RPC in {time.monotonic() - started:.2f}s")
+    return results
+
+# Function to run the same calls at many blocks, one aggregate3 eth_call per
+# block, all in one JSON-RPC batch. Returns {block: [(success, returnData), ...]}.
+# Blocks from before Multicall3 was deployed (empty result) fall back to plain
+# eth_calls, sent together in one more batch.
+def read_at_blocks(calls, blocks, rpc_url=RPC_URL, multicall_address=MULTICALL3_ADDRESS):
+    results = {}
+    fallback = list(blocks)
+    if multicall_address:
+        data = encode_aggregate3(calls)
+        replies = batch([('eth_call', _call_params(multicall_address, data, hex(block))) for block in blocks], rpc_url)
+        fallback = []
+        for block, reply in zip(blocks, replies):
+            if reply is None:
+                # aggregate3 with allowFailure does not revert, so this is a node error
+                raise RPCError(f"aggregate3 at block {block} failed")
+            if len(reply) > 2:
+                results[block] = decode_aggregate3(bytes.fromhex(reply[2:]))
+            else:
+                fallback.append(block)
+    if fallback:
+        replies = batch([('eth_call', _call_params(target, calldata, hex(block)))
+                         for block in fallback for target, calldata in calls], rpc_url)
+        for i, block in enumerate(fallback):
+            block_replies = replies[i * len(calls):(i + 1) * len(calls)]
+            results[block] = [(False, b'') if reply is None else (True, bytes.fromhex(reply[2:])) for reply in block_replies]
+    return results
+
+# Function to get {number: timestamp} for blocks, in one batch
+def block_timestamps(numbers, rpc_url=RPC_URL):
+    numbers = list(numbers)
+    replies = batch([('eth_getBlockByNumber', [hex(number), False]) for number in numbers], rpc_url)
+    timestamps = {}
+    for number, block in zip(numbers, replies):
+        if block is None:
+            raise RPCError(f"block {number} not found")
+        timestamps[number] = int(block['timestamp'], 16)
+    return timestamps
+
+# Function to find, for each unix timestamp, the last block at or before it.
+# low and high are (number, timestamp) bounds, e.g. genesis and the head.
+# All searches advance together, one batch per step: interpolation guesses
+# with a bisection step every third round so a skewed range still converges.
+def blocks_at_times(timestamps, low, high, rpc_url=RPC_URL):
+    bounds = {timestamp: [low, high] for timestamp in timestamps if timestamp >= low[1]}
+    found = {timestamp: None for timestamp in timestamps if timestamp < low[1]}
+    step = 0
+    while bounds:
+        guesses = {}
+        for timestamp, ((lo, lo_t), (hi, hi_t)) in bounds.items():
+            if hi - lo <= 1 or timestamp >= hi_t:
+                continue
+            if step % 3 == 2 or hi_t <= lo_t:
+                guess = (lo + hi) // 2
+            else:
+                guess = lo + int((timestamp - lo_t) * (hi - lo) / (hi_t - lo_t))
+            guesses[timestamp] = min(max(guess, lo + 1), hi - 1)
+        for timestamp in [t for t in bounds if t not in guesses]:
+            (lo, lo_t), (hi, hi_t) = bounds.pop(timestamp)
+            found[timestamp] = hi if timestamp >= hi_t else lo
+        if not guesses:
+            break
+        known = block_timestamps(set(guesses.values()), rpc_url)
+        for timestamp, guess in guesses.items():
+            side = 0 if known[guess] <= timestamp else 1
+            bounds[timestamp][side] = (guess, known[guess])
+        step += 1
+    return found
@@ -0,0 +1,183 @@
+import json
+import os
+import random
+import signal
+import threading
+import time
+import traceback
+from datetime import datetime
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+
+import metrics
+
+# Intervals in seconds between runs of each job
+TVL_INTERVAL = float(os.getenv("TVL_INTERVAL", "3600"))
+ONCHAIN_STATS_INTERVAL = float(os.getenv("ONCHAIN_STATS_INTERVAL", "3600"))
+MINT_BURN_INTERVAL = float(os.getenv("MINT_BURN_INTERVAL", "3600"))
+# Each wait is stretched or shortened by up to this fraction of the interval
+JITTER = float(os.getenv("SCHEDULER_JITTER", "0.1"))
+STATUS_HOST = os.getenv("SCHEDULER_STATUS_HOST", "127.0.0.1")
+STATUS_PORT = int(os.getenv("SCHEDULER_STATUS_PORT", "8765"))
+
+# One collector on a fixed interval. Each job runs in its own thread, so a
+# job can never overlap with itself, and the thread keeps whatever state the
+# job holds (open indexes, known dates) warm between runs.
+class Job:
+    def __init__(self, name, run, interval, jitter=JITTER):
+        self.name = name
+        self.run = run
+        self.interval = interval
+        self.jitter = jitter
+        self.wake = threading.Event()
+        self.status = {
+            'interval': interval, 'runs': 0, 'failures': 0, 'running': False,
+            'last_start': None, 'last_duration': None, 'last_status': None, 'last_error': None, 'next_run': None,
+        }
+
+    def next_delay(self):
+        return max(0.0, self.interval * (1 + random.uniform(-self.jitter, self.jitter)))
+
+    def run_once(self):
+        self.status['running'] = True
+        self.status['last_start'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        started = time.monotonic()
+        try:
+            self.run()
+            self.status['last_status'] = 'ok'
+            self.status['last_error'] = None
+        except Exception as e:
+            traceback.print_exc()
+            self.status['last_status'] = 'failed'
+            self.status['last_error'] = str(e)
+            self.status['failures'] += 1
+        finally:
+            self.status['runs'] += 1
+            self.status['running'] = False
+            self.status['last_duration'] = round(time.monotonic() - started, 3)
+
+    def loop(self, stop):
+        # Start at a random point in the first interval so jobs do not all fire at once
+        delay = random.uniform(0, self.interval * self.jitter)
+        while not stop.is_set():
+            self.status['next_run'] = datetime.fromtimestamp(time.time() + delay).strftime('%Y-%m-%d %H:%M:%S')
+            self.wake.wait(delay)
+            self.wake.clear()
+            if stop.is_set():
+                return
+            print(f"[{datetime.now():%Y-%m-%d %H:%M:%S}] Running {self.name}")
+            self.run_once()
+            print(f"[{datetime.now():%Y-%m-%d %H:%M:%S}] {self.name} {self.status['last_status']} "
+                  f"in {self.status['last_duration']}s")
+            delay = self.next_delay()
+
+# Build the three collector jobs. State kept across runs lives in these closures.
+def default_jobs():
+    def run_tvl():
+        import tvl_data
+        tvl_data.main()
+
+    def run_onchain_stats():
+        import onchain_stats
+        onchain_stats.main()
+
+    mint_burn_state = {}
+    def run_mint_burn():
+        import mintandburn
+        from tx_index import TxIndex
+        # Opened in the job's own thread, which is the only one that uses it
+        if 'index' not in mint_burn_state:
+            mint_burn_state['index'] = TxIndex(use_bloom=os.getenv("TX_INDEX_BLOOM") == "1")
+        mintandburn.main(index=mint_burn_state['index'])
+
+    return [
+        Job('tvl_data', run_tvl, TVL_INTERVAL),
+        Job('onchain_stats', run_onchain_stats, ONCHAIN_STATS_INTERVAL),
+        Job('mintandburn', run_mint_burn, MINT_BURN_INTERVAL),
+    ]
+
+# Status of all jobs plus the shared HTTP and cache counters
+def status_report(jobs):
+    import http_client
+    import ttl_cache
+    return {
+        'jobs': {job.name: dict(job.status) for job in jobs},
+        'http': http_client.get_stats(),
+        'cache': dict(ttl_cache.get_cache().stats),
+    }
+
+def make_status_handler(jobs):
+    # http.server (with http.client and ssl) is only loaded to serve status
+    from http.server import BaseHTTPRequestHandler
+    by_name = {job.name: job for job in jobs}
+
+    class StatusHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def _reply(self, code, body):
+            data = json.dumps(body, indent=2, default=str).encode()
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        # GET /status returns job status and timings, GET /metrics the
+        # collectors' metrics in the OpenMetrics text format
+        def do_GET(self):
+            if self.path in ('/', '/status'):
+                self._reply(200, status_report(jobs))
+            elif self.path == '/metrics':
+                data = metrics.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/openmetrics-text; version=1.0.0; charset=utf-8')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+            else:
+                self._reply(404, {'error': 'not found'})
+
+        # POST /run/<job> wakes a job so it runs now (in its own thread)
+        def do_POST(self):
+            name = self.path.rsplit('/', 1)[-1]
+            if self.path.startswith('/run/') and name in by_name:
+                by_name[name].wake.set()
+                self._reply(202, {'queued': name})
+            else:
+                self._reply(404, {'error': 'unknown job'})
+
+    return StatusHandler
+
+# Function to run the jobs until SIGINT/SIGTERM
+def run_forever(jobs=None):
+    jobs = jobs or default_jobs()
+    # One metrics file for all jobs, they share the registry
+    metrics.set_process('scheduler')
+    stop = threading.Event()
+    from http.server import ThreadingHTTPServer
+    server = ThreadingHTTPServer((STATUS_HOST, STATUS_PORT), make_status_handler(jobs))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Status endpoint on http://{STATUS_HOST}:{server.server_port}/status")
+
+    def shutdown(signum, frame):
+        print("Stopping scheduler...")
+        stop.set()
+        for job in jobs:
+            job.wake.set()
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+
+    threads = [threading.Thread(target=job.loop, args=(stop,), name=job.name) for job in jobs]
+    for thread in threads:
+        thread.start()
+    # Wait in short steps so the main thread keeps handling signals
+    while any(thread.is_alive() for thread in threads):
+        for thread in threads:
+            thread.join(timeout=1)
+    server.shutdown()
+
+if __name__ == "__main__":
+    run_forever()
@@ -0,0 +1,206 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import time
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+
+import columnar_store
+
+# Runs the repository's Dune queries (tvl_analysis.sql, infinity.sql, ...)
+# locally with DuckDB, against the collected history instead of Dune.
+#
+# The series are loaded from the CSVs, or from the columnar store when
+# COLUMNAR_STORE=1 and it has data, into the DuckDB file LOCAL_SQL_DB. A
+# series is only reloaded when its files changed. The queries see them as
+# dune."<namespace>".<table>, so the .sql files run unchanged. DuckDB already
+# has TRY_CAST, DATE_TRUNC, EXTRACT(WEEK ...) (ISO weeks, as in Trino) and
+# half-away-from-zero ROUND; Trino's DATE_ADD(unit, value, timestamp) is
+# added as a macro.
+#
+# Results are cached under SQL_CACHE_DIR, keyed on the query text, the scale
+# and the file versions of the tables it reads, so a query reruns only when
+# it or its data changed. --scale N repeats each table N times, shifted back
+# in time, to benchmark at N times the current history.
+
+LOCAL_DB = os.getenv("LOCAL_SQL_DB", "local_sql.duckdb")
+CACHE_DIR = os.getenv("SQL_CACHE_DIR", "sql_cache")
+# Namespace of the tables in the queries
+NAMESPACE = os.getenv("SQL_NAMESPACE", "0xsg")
+
+# Dune table -> columnar_store series holding its rows
+DUNE_TABLES = {
+    'token_and_contract_data': 'token_and_contract_data',
+    'transactions_growth': 'transactions_growth_data',
+    'active_accounts': 'active_accounts_data',
+    'general_stats': 'general_stats_data',
+    'mint_burn': 'mint_burn_data',
+}
+
+SQL_TYPES = {'time': 'TIMESTAMP', 'double': 'DOUBLE', 'int': 'BIGINT', 'symbol': 'VARCHAR', 'string': 'VARCHAR'}
+
+# Trino functions DuckDB lacks or defines differently
+MACROS = [
+    """CREATE OR REPLACE TEMP MACRO date_add(unit, value, ts) AS ts + CASE lower(unit)
+        WHEN 'millisecond' THEN to_milliseconds(CAST(value AS BIGINT))
+        WHEN 'second' THEN to_seconds(CAST(value AS BIGINT))
+        WHEN 'minute' THEN to_minutes(CAST(value AS BIGINT))
+        WHEN 'hour' THEN to_hours(CAST(value AS BIGINT))
+        WHEN 'day' THEN to_days(CAST(value AS INTEGER))
+        WHEN 'week' THEN to_weeks(CAST(value AS INTEGER))
+        WHEN 'month' THEN to_months(CAST(value AS INTEGER))
+        WHEN 'quarter' THEN to_months(CAST(value AS INTEGER) * 3)
+        WHEN 'year' THEN to_years(CAST(value AS INTEGER)) END""",
+]
+
+# Function to get the Dune tables a query reads
+def referenced_tables(sql):
+    pattern = rf'"?{re.escape(NAMESPACE)}"?\s*\.\s*"?(\w+)"?'
+    return sorted({name for name in re.findall(pattern, sql) if name in DUNE_TABLES})
+
+# Function to get the files holding a series: its columnar store parts when
+# the store is enabled and has data, otherwise its CSV
+def source_files(series):
+    if columnar_store.is_enabled():
+        directory = os.path.join(columnar_store.STORE_DIR, series)
+        parts = sorted(os.path.join(root, name) for root, _, names in os.walk(directory)
+                       for name in names if name.endswith('.parquet'))
+        if parts:
+            return 'parquet', parts
+    path = columnar_store.SERIES[series]['csv']
+    return 'csv', [path] if os.path.exists(path) else []
+
+def data_version(files):
+    entries = [(path, os.stat(path).st_size, os.stat(path).st_mtime_ns) for path in files]
+    return hashlib.sha256(json.dumps(entries).encode()).hexdigest()[:16]
+
+def _quote(value):
+    return "'" + value.replace("'", "''") + "'"
+
+# Function to build the SELECT reading a series with the columnar store's
+# types; 'Unknown' and empty CSV values are NULL
+def _load_query(series, kind, files):
+    columns = columnar_store.SERIES[series]['columns']
+    paths = '[' + ', '.join(_quote(path) for path in files) + ']'
+    if kind == 'parquet':
+        return f"SELECT * FROM read_parquet({paths}, hive_partitioning = false, union_by_name = true)"
+    import csv
+    with open(files[0], newline='') as file:
+        header = next(csv.reader(file), [])
+    types = ', '.join(f"{_quote(name)}: '{SQL_TYPES[columns[name]]}'" for name in header if name in columns)
+    return (f"SELECT * FROM read_csv({paths}, header = true, nullstr = ['Unknown', ''], "
+            f"types = {{{types}}})")
+
+def connect(path=LOCAL_DB):
+    import duckdb
+    conn = duckdb.connect(path)
+    conn.execute("CREATE TABLE IF NOT EXISTS _sources (name VARCHAR PRIMARY KEY, version VARCHAR, loaded_at TIMESTAMP)")
+    for macro in MACROS:
+        conn.execute(macro)
+    return conn
+
+# Function to reload the tables whose files changed. Returns {table: version},
+# leaving out tables without data.
+def refresh(conn, tables):
+    versions = {}
+    for table in tables:
+        series = DUNE_TABLES[table]
+        kind, files = source_files(series)
+        if not files:
+            print(f"No local data for {table} ({series}).")
+            continue
+        version = data_version(files)
+        stored = conn.execute("SELECT version FROM _sources WHERE name = ?", [table]).fetchone()
+        if stored is None or stored[0] != version:
+            started = time.perf_counter()
+            conn.execute(f'CREATE OR REPLACE TABLE "{table}" AS {_load_query(series, kind, files)}')
+            conn.execute("INSERT OR REPLACE INTO _sources VALUES (?, ?, now())", [table, version])
+            count = conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0]
+            print(f"Loaded {count} rows of {table} from {kind} in {time.perf_counter() - started:.2f}s")
+        versions[table] = version
+    return versions
+
+# Function to expose the loaded tables as dune."<namespace>".<table>; with
+# scale > 1 each table holds scale copies, each shifted back by the span of
+# the history plus a day
+def attach_namespace(conn, tables, scale=1):
+    conn.execute("ATTACH IF NOT EXISTS ':memory:' AS dune")
+    conn.execute(f'CREATE SCHEMA IF NOT EXISTS dune."{NAMESPACE}"')
+    database = conn.execute("SELECT current_database()").fetchone()[0]
+    for table in tables:
+        source = f'"{database}".main."{table}"'
+        target = f'dune."{NAMESPACE}"."{table}"'
+        if scale <= 1:
+            conn.execute(f"CREATE OR REPLACE VIEW {target} AS SELECT * FROM {source}")
+            continue
+        column = columnar_store.SERIES[DUNE_TABLES[table]]['time']
+        conn.execute(f'CREATE OR REPLACE TABLE {target} AS SELECT * REPLACE ("{column}" - (copy.range * span."width") AS "{column}") '
+                     f'FROM {source}, (SELECT MAX("{column}") - MIN("{column}") + INTERVAL 1 DAY AS "width" FROM {source}) AS span, '
+                     f'range({int(scale)}) AS copy')
+
+def _cache_path(sql, scale, versions):
+    key = hashlib.sha256(json.dumps([sql, scale, versions], sort_keys=True).encode()).hexdigest()[:24]
+    return os.path.join(CACHE_DIR, f"{key}.parquet")
+
+def read_query(path):
+    with open(path) as file:
+        return file.read().strip().rstrip(';').strip()
+
+# Function to run a query, or take its result from the cache. Returns
+# (result parquet path, seconds, whether it came from the cache).
+def run_query(conn, sql, scale=1, use_cache=True):
+    tables = referenced_tables(sql)
+    versions = refresh(conn, tables)
+    cache_path = _cache_path(sql, scale, versions)
+    if use_cache and os.path.exists(cache_path):
+        return cache_path, 0.0, True
+    attach_namespace(conn, list(versions), scale)
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    temp_path = cache_path + '.tmp'
+    started = time.perf_counter()
+    conn.execute(f"COPY ({sql}) TO {_quote(temp_path)} (FORMAT PARQUET)")
+    elapsed = time.perf_counter() - started
+    os.replace(temp_path, cache_path)
+    return cache_path, elapsed, False
+
+# Function to get the result rows of a query as (column names, rows)
+def query(sql, scale=1, use_cache=True):
+    conn = connect()
+    try:
+        path, _, _ = run_query(conn, sql, scale, use_cache)
+        result = conn.execute(f"SELECT * FROM read_parquet({_quote(path)})")
+        return [column[0] for column in result.description], result.fetchall()
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a Dune .sql query against the local history with DuckDB.")
+    parser.add_argument('query', help="path of a .sql file")
+    parser.add_argument('--output', help="write the result to this CSV file instead of printing it")
+    parser.add_argument('--rows', type=int, default=20, help="rows to print (default 20)")
+    parser.add_argument('--scale', type=int, default=1, help="repeat each table this many times")
+    parser.add_argument('--repeat', type=int, default=1, help="run this many times and report the fastest, bypassing the cache")
+    parser.add_argument('--no-cache', action='store_true')
+    args = parser.parse_args()
+
+    sql = read_query(args.query)
+    conn = connect()
+    timings = []
+    for _ in range(args.repeat):
+        path, elapsed, cached = run_query(conn, sql, args.scale, not args.no_cache and args.repeat == 1)
+        timings.append(elapsed)
+    if args.output:
+        conn.execute(f"COPY (SELECT * FROM read_parquet({_quote(path)})) TO {_quote(args.output)} (HEADER, DELIMITER ',')")
+        print(f"Wrote the result to {args.output}")
+    else:
+        conn.sql(f"SELECT * FROM read_parquet({_quote(path)})").show(max_rows=args.rows)
+    count = conn.execute(f"SELECT COUNT(*) FROM read_parquet({_quote(path)})").fetchone()[0]
+    if cached:
+        print(f"{count} rows from the cache ({path})")
+    else:
+        print(f"{count} rows in {min(timings) * 1000:.1f} ms (fastest of {len(timings)}, scale {args.scale})")
+    conn.close()
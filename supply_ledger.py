@@ -0,0 +1,273 @@
+import argparse
+import bisect
+import csv
+import io
+import json
+import os
+from array import array
+from datetime import datetime, timedelta, timezone
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+
+# Per-token supply ledger built from the mint/burn event log.
+#
+# Each token keeps three array-backed columns sorted by time: the event
+# timestamps and the running totals minted and burned up to each event. The
+# supply at time T is one binary search (baseline + minted - burned at the
+# last event at or before T), and the mints and burns between two times are
+# two. The ledger follows mint_burn_data.csv by byte offset, so each update
+# reads only the rows appended since the last one, and the columns are
+# appended to their files instead of rewritten.
+#
+# The event log does not reach back to each token's deployment, so the
+# supply before the first event (the baseline) comes from reconciling the
+# ledger with the token's total_supply from the explorer. A change in the
+# baseline between reconciliations means events were missed or doubled.
+#
+# Times are unix seconds, UTC.
+
+LEDGER_DIR = os.getenv("SUPPLY_LEDGER_DIR", "supply_ledger")
+# Relative baseline change reported as drift on reconciliation
+RECONCILE_TOLERANCE = float(os.getenv("SUPPLY_LEDGER_TOLERANCE", "1e-6"))
+
+COLUMNS = ['times', 'minted', 'burned']
+
+# Function to turn unix seconds, a datetime or an ISO date/time string into unix seconds
+def to_epoch(value):
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+class TokenLedger:
+    def __init__(self, times=None, minted=None, burned=None, baseline=0.0):
+        self.times = times if times is not None else array('d')
+        self.minted = minted if minted is not None else array('d')
+        self.burned = burned if burned is not None else array('d')
+        self.baseline = baseline
+
+    def __len__(self):
+        return len(self.times)
+
+    # Function to get (minted, burned) totals of the events at or before t
+    def totals_at(self, t):
+        i = bisect.bisect_right(self.times, to_epoch(t)) - 1
+        return (self.minted[i], self.burned[i]) if i >= 0 else (0.0, 0.0)
+
+    def supply_at(self, t):
+        minted, burned = self.totals_at(t)
+        return self.baseline + minted - burned
+
+    # Function to sum the events after start and up to end
+    def change(self, start, end):
+        minted_start, burned_start = self.totals_at(start)
+        minted_end, burned_end = self.totals_at(end)
+        minted, burned = minted_end - minted_start, burned_end - burned_start
+        return {'minted': minted, 'burned': burned, 'net': minted - burned}
+
+    # Function to add [(unix time, minted, burned)] events. Returns True when
+    # they all come after the last event, i.e. the columns were only appended.
+    def add(self, events):
+        events = sorted(events)
+        if not events:
+            return True
+        if not self.times or events[0][0] >= self.times[-1]:
+            minted = self.minted[-1] if self.minted else 0.0
+            burned = self.burned[-1] if self.burned else 0.0
+            for t, mint, burn in events:
+                minted += mint
+                burned += burn
+                self.times.append(t)
+                self.minted.append(minted)
+                self.burned.append(burned)
+            return True
+        # An older event: rebuild the running totals from the merged events
+        merged = sorted(list(self._events()) + events)
+        self.times, self.minted, self.burned = array('d'), array('d'), array('d')
+        self.add(merged)
+        return False
+
+    def _events(self):
+        minted = burned = 0.0
+        for t, m, b in zip(self.times, self.minted, self.burned):
+            yield t, m - minted, b - burned
+            minted, burned = m, b
+
+# All tokens' ledgers, stored under one directory
+class SupplyLedger:
+    def __init__(self, directory=LEDGER_DIR):
+        self.directory = directory
+        self.meta = {'csv_offset': 0, 'tokens': {}}
+        self.tokens = {}
+        # Number of events per token already in the column files
+        self.saved = {}
+        meta_path = os.path.join(directory, 'ledger.json')
+        if os.path.exists(meta_path):
+            with open(meta_path) as file:
+                self.meta = json.load(file)
+            for symbol, info in self.meta['tokens'].items():
+                columns = [self._read_column(symbol, column, info['count']) for column in COLUMNS]
+                self.tokens[symbol] = TokenLedger(*columns, baseline=info.get('baseline', 0.0))
+                self.saved[symbol] = info['count']
+
+    def _column_path(self, symbol, column):
+        return os.path.join(self.directory, f"{symbol}.{column}.bin")
+
+    def _read_column(self, symbol, column, count):
+        values = array('d')
+        with open(self._column_path(symbol, column), 'rb') as file:
+            # Files may hold a torn tail past the committed count; it is ignored
+            values.fromfile(file, count)
+        return values
+
+    def token(self, symbol):
+        if symbol not in self.tokens:
+            self.tokens[symbol] = TokenLedger()
+            self.saved[symbol] = 0
+        return self.tokens[symbol]
+
+    # Function to add the rows of mint_burn_data.csv written since the last
+    # update. Returns the number of events added.
+    def update_from_csv(self, path='mint_burn_data.csv'):
+        if not os.path.exists(path):
+            return 0
+        size = os.path.getsize(path)
+        if size < self.meta['csv_offset']:
+            # The file was replaced: start over
+            print(f"{path} is shorter than the ledger's offset, rebuilding the ledger.")
+            self.meta = {'csv_offset': 0, 'tokens': {}}
+            self.tokens, self.saved = {}, {}
+        with open(path, 'rb') as file:
+            header = file.readline()
+            file.seek(max(self.meta['csv_offset'], len(header)))
+            data = file.read()
+        # Only complete lines; a row still being written is read next time
+        data = data[:data.rfind(b'\n') + 1]
+        if not data:
+            return 0
+        fieldnames = next(csv.reader([header.decode()]))
+        events = {}
+        for row in csv.DictReader(io.StringIO(data.decode(), newline=''), fieldnames=fieldnames):
+            value = float(row['value'])
+            mint, burn = (value, 0.0) if row['transfer_type'] == 'token_minting' else (0.0, value)
+            events.setdefault(row['token_symbol'], []).append((to_epoch(row['timestamp']), mint, burn))
+        for symbol, token_events in events.items():
+            if not self.token(symbol).add(token_events):
+                self.saved[symbol] = None
+        self.meta['csv_offset'] = max(self.meta['csv_offset'], len(header)) + len(data)
+        self.save()
+        return sum(len(token_events) for token_events in events.values())
+
+    # Function to write new column values and then the metadata, which is the
+    # commit point: a crash in between leaves only an ignored file tail
+    def save(self):
+        os.makedirs(self.directory, exist_ok=True)
+        for symbol, ledger in self.tokens.items():
+            saved = self.saved.get(symbol)
+            for column in COLUMNS:
+                values = getattr(ledger, column)
+                if saved is None:
+                    temp_path = self._column_path(symbol, column) + '.tmp'
+                    with open(temp_path, 'wb') as file:
+                        values.tofile(file)
+                    os.replace(temp_path, self._column_path(symbol, column))
+                elif len(values) > saved:
+                    with open(self._column_path(symbol, column), 'r+b' if saved else 'wb') as file:
+                        file.seek(saved * values.itemsize)
+                        file.truncate()
+                        values[saved:].tofile(file)
+            self.saved[symbol] = len(ledger)
+            info = self.meta['tokens'].setdefault(symbol, {})
+            info['count'] = len(ledger)
+            info['baseline'] = ledger.baseline
+        temp_path = os.path.join(self.directory, 'ledger.json.tmp')
+        with open(temp_path, 'w') as file:
+            json.dump(self.meta, file)
+        os.replace(temp_path, os.path.join(self.directory, 'ledger.json'))
+
+    # Function to set each token's baseline so its current ledger supply equals
+    # the given {symbol: total_supply}. Returns {symbol: baseline change} for
+    # tokens whose baseline moved beyond the tolerance since the last time.
+    def reconcile(self, supplies):
+        drift = {}
+        now = datetime.now(timezone.utc).isoformat(timespec='seconds')
+        for symbol, total_supply in supplies.items():
+            ledger = self.token(symbol)
+            minted, burned = (ledger.minted[-1], ledger.burned[-1]) if len(ledger) else (0.0, 0.0)
+            baseline = total_supply - (minted - burned)
+            info = self.meta['tokens'].setdefault(symbol, {})
+            if info.get('reconciled_at') and abs(baseline - ledger.baseline) > RECONCILE_TOLERANCE * max(abs(total_supply), 1.0):
+                drift[symbol] = baseline - ledger.baseline
+            ledger.baseline = baseline
+            info['reconciled_at'] = now
+        self.save()
+        return drift
+
+    def supply_at(self, symbol, t):
+        return self.tokens[symbol].supply_at(t)
+
+    def change(self, symbol, start, end):
+        return self.tokens[symbol].change(start, end)
+
+    # Function to get [(day, net change)] between the given hour on consecutive
+    # days, like the 09:00 day-over-day deltas of infinity.sql
+    def daily_net(self, symbol, start, end, hour=9):
+        ledger = self.tokens[symbol]
+        day = datetime.fromtimestamp(to_epoch(start), timezone.utc).replace(hour=hour, minute=0, second=0, microsecond=0)
+        end = to_epoch(end)
+        rows = []
+        while day.timestamp() <= end:
+            rows.append((day.strftime('%Y-%m-%d'), ledger.change(day - timedelta(days=1), day)['net']))
+            day += timedelta(days=1)
+        return rows
+
+# Function to read each mint/burn token's total supply from the explorer
+def fetch_supplies():
+    import mintandburn
+    import tvl_data
+    supplies = {}
+    for symbol, address in mintandburn.TOKENS.items():
+        total_supply = tvl_data.get_token_info(address)['total_supply']
+        if total_supply != 'Unknown':
+            supplies[symbol] = total_supply
+    return supplies
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query the mint/burn supply ledger.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('update', help="add new rows of mint_burn_data.csv")
+    commands.add_parser('reconcile', help="update, then match each supply to the explorer's total_supply")
+    supply = commands.add_parser('supply', help="supply of a token at a time")
+    supply.add_argument('symbol')
+    supply.add_argument('at', help="ISO date or time, UTC")
+    change = commands.add_parser('change', help="minted, burned and net between two times")
+    change.add_argument('symbol')
+    change.add_argument('start')
+    change.add_argument('end')
+    daily = commands.add_parser('daily', help="day-over-day net change at --hour")
+    daily.add_argument('symbol')
+    daily.add_argument('start')
+    daily.add_argument('end')
+    daily.add_argument('--hour', type=int, default=9)
+    args = parser.parse_args()
+
+    ledger = SupplyLedger()
+    if args.command in ('update', 'reconcile'):
+        print(f"Added {ledger.update_from_csv()} events.")
+    if args.command == 'reconcile':
+        for symbol, amount in ledger.reconcile(fetch_supplies()).items():
+            print(f"Drift for {symbol}: baseline moved by {amount}, events may be missing")
+        for symbol, info in sorted(ledger.meta['tokens'].items()):
+            print(f"{symbol}: {info['count']} events, baseline {info['baseline']}")
+    elif args.command == 'supply':
+        print(ledger.supply_at(args.symbol, args.at))
+    elif args.command == 'change':
+        print(ledger.change(args.symbol, args.start, args.end))
+    elif args.command == 'daily':
+        for day, net in ledger.daily_net(args.symbol, args.start, args.end, args.hour):
+            print(f"{day},{net}")
@@ -0,0 +1,30 @@
+from datetime import datetime
+
+import backfill
+import mock_server
+import rpc_reader
+import tvl_data
+
+TOKEN = '0x79Cb92a2806BF4f82B614A84b6805963b8b1D8BB'
+CALL = (TOKEN, rpc_reader.encode_call(rpc_reader.TOTAL_SUPPLY))
+
+# Points five seconds apart share blocks on a 10 s chain, and the last one is
+# past the head: every point before the head keeps its row, the late one is counted
+def test_points_sharing_a_block_keep_their_rows(monkeypatch):
+    chain = mock_server.MockChain(head=100, block_seconds=10.0)
+    chain.set_call(*CALL, rpc_reader.encode_call('', 42))
+    server, state, base_url = mock_server.start(chain=chain)
+    post = rpc_reader._post
+    monkeypatch.setattr(rpc_reader, '_post', lambda payload, rpc_url: post(payload, f"{base_url}/rpc"))
+    monkeypatch.setattr(tvl_data, 'rpc_calls', lambda tokens: ([CALL], ['supply']))
+    monkeypatch.setattr(tvl_data, 'decode_rpc_values',
+                        lambda keys, results, tokens: (rpc_reader.decode_uint(results[0][1]), None, None))
+    monkeypatch.setattr(tvl_data, 'make_row', lambda prices, info, balances, stq_price, moment:
+                        {'date': moment.strftime('%Y-%m-%d %H:%M:%S'), 'supply': info})
+    low, high = (0, chain.timestamp(0)), (100, chain.timestamp(100))
+    times = [chain.timestamp(50) + offset for offset in (0, 5, 10, 15)] + [chain.timestamp(100) + 30]
+    rows, late = backfill.backfill_chunk([('time', t) for t in times], {}, {}, low, high)
+    server.shutdown()
+    assert late == 1
+    assert [row['date'] for row in rows] == [datetime.fromtimestamp(t).strftime('%Y-%m-%d %H:%M:%S') for t in times[:4]]
+    assert all(row['supply'] == 42 for row in rows)
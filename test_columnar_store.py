@@ -0,0 +1,23 @@
+import os
+
+import columnar_store
+
+def _row(i):
+    return {'tx_hash': f"0x{i:064x}", 'log_index': str(i % 3), 'from': '0x0', 'to': '0x1', 'token_name': 'Mock',
+            'token_symbol': 'M', 'transfer_type': 'token_minting', 'timestamp': f"2024-05-0{i + 1}T00:00:00.000000Z",
+            'value': '1.5'}
+
+# Live appends write a file each; past COLUMNAR_COMPACT_FILES the month is
+# merged into one file, and every row keeps its log_index
+def test_append_compacts_month_and_keeps_log_index(tmp_path, monkeypatch):
+    monkeypatch.setattr(columnar_store, 'STORE_DIR', str(tmp_path))
+    monkeypatch.setattr(columnar_store, 'COMPACT_FILES', 3)
+    directory = columnar_store._partition_dir('mint_burn_data', '2024-05')
+    counts = []
+    for i in range(5):
+        columnar_store.append('mint_burn_data', [_row(i)])
+        counts.append(len(os.listdir(directory)))
+    assert counts == [1, 2, 3, 1, 2]
+    table = columnar_store.read('mint_burn_data', ['tx_hash', 'log_index'])
+    assert table['log_index'].to_pylist() == [0, 1, 2, 0, 1]
+    assert table['tx_hash'].to_pylist() == [_row(i)['tx_hash'] for i in range(5)]
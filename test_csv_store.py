@@ -0,0 +1,22 @@
+import csv_store
+
+FIELDNAMES = ['date', 'value']
+
+def _append(path, data):
+    path.write_bytes(data)
+    csv_store._headers.pop(str(path), None)
+    csv_store.append_rows(str(path), FIELDNAMES, [{'date': '2024-05-03', 'value': '3'}])
+    return path.read_bytes()
+
+# A complete last row without a line ending is kept, in the file's own line ending
+def test_unterminated_complete_row_is_kept(tmp_path):
+    data = _append(tmp_path / 'a.csv', b'date,value\r\n2024-05-01,1\r\n2024-05-02,2')
+    assert data == b'date,value\r\n2024-05-01,1\r\n2024-05-02,2\r\n2024-05-03,3\r\n'
+
+def test_torn_row_is_dropped(tmp_path):
+    data = _append(tmp_path / 'a.csv', b'date,value\n2024-05-01,1\n2024-05-0')
+    assert data == b'date,value\n2024-05-01,1\n2024-05-03,3\n'
+
+def test_row_torn_inside_line_ending_is_completed(tmp_path):
+    data = _append(tmp_path / 'a.csv', b'date,value\r\n2024-05-01,1\r')
+    assert data == b'date,value\r\n2024-05-01,1\r\n2024-05-03,3\r\n'
@@ -0,0 +1,44 @@
+import socket
+import threading
+
+import pytest
+
+import http_client
+
+def _post(monkeypatch, url):
+    sleeps = []
+    monkeypatch.setattr(http_client.time, 'sleep', sleeps.append)
+    with pytest.raises(http_client.FetchError):
+        http_client.post(url, data=b'{}')
+    return len(sleeps)
+
+# A refused connection never reached the server, so even a POST is retried
+def test_post_retried_when_connection_refused(monkeypatch):
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    assert _post(monkeypatch, f"http://127.0.0.1:{port}/insert") == http_client.MAX_RETRIES
+
+# A connection closed after the request was read may have been processed
+def test_post_not_retried_when_connection_drops(monkeypatch):
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen()
+    accepted = []
+
+    def serve():
+        while True:
+            try:
+                connection, _ = server.accept()
+            except OSError:
+                return
+            accepted.append(connection)
+            connection.recv(65536)
+            connection.close()
+
+    threading.Thread(target=serve, daemon=True).start()
+    try:
+        assert _post(monkeypatch, f"http://127.0.0.1:{server.getsockname()[1]}/insert") == 0
+    finally:
+        server.close()
+    assert len(accepted) == 1
@@ -0,0 +1,52 @@
+import threading
+import time
+
+import mint_burn_stream
+import mintandburn
+import mock_server
+import ttl_cache
+import tvl_data
+
+TOKEN = '0x79187B0D66249ac375EBd94861B344a0Dc170C14'
+HOLDER = '0x' + '12' * 20
+
+def _wait(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return condition()
+
+# A mint mined before the stream connects is read back with eth_getLogs, a
+# burn mined after it arrives by subscription; both rows carry the symbol and
+# name the explorer gives the token, as a polled row would, and the watermark
+# stays under the TOKENS name
+def test_streamed_rows_use_explorer_symbol(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(ttl_cache, '_cache', ttl_cache.TTLCache(str(tmp_path / 'cache.sqlite')))
+    http_server, state, base_url = mock_server.start()
+    monkeypatch.setattr(tvl_data, 'EXPLORER_URL', base_url)
+    ws_server, chain, ws_url = mock_server.start_ws(chain=mock_server.MockChain(head=100))
+    stream = mint_burn_stream.MintBurnStream(ws_url, str(tmp_path / 'stream.json'), tokens={'0xMR': TOKEN})
+    stream.cursor = 100
+    chain.mine([(TOKEN, mint_burn_stream.ZERO_ADDRESS, HOLDER, 5 * 10 ** 18)])
+
+    rows, watermarks, stop = [], {}, threading.Event()
+    follower = threading.Thread(target=stream.follow, args=(stop, watermarks, None, rows.append, lambda: None, lambda: None))
+    follower.start()
+    try:
+        assert _wait(lambda: len(rows) == 1 and chain.subscriptions)
+        chain.mine([(TOKEN, HOLDER, mint_burn_stream.ZERO_ADDRESS, 2 * 10 ** 18)])
+        assert _wait(lambda: len(rows) == 2)
+    finally:
+        stop.set()
+        follower.join()
+        ws_server.shutdown()
+        http_server.shutdown()
+
+    expected = mock_server.token_info(TOKEN)
+    assert [row['transfer_type'] for row in rows] == ['token_minting', 'token_burning']
+    assert [row['value'] for row in rows] == [5.0, 2.0]
+    assert {(row['token_symbol'], row['token_name']) for row in rows} == {(expected['symbol'], expected['name'])}
+    assert expected['symbol'] == mock_server.transfers_page(state, TOKEN, 0)['items'][0]['token']['symbol']
+    assert set(watermarks) == {'0xMR'} and mintandburn.read_last_processed_timestamps() == watermarks
+    assert stream.cursor == 102
@@ -0,0 +1,42 @@
+import csv
+
+import mintandburn
+from tx_index import TxIndex
+
+def _item(i):
+    return {'tx_hash': f"0x{i:064x}", 'log_index': '0', 'timestamp': f"2024-05-01T00:00:{i:02d}.000000Z",
+            'type': 'token_minting', 'from': {'hash': '0x0'}, 'to': {'hash': '0x1'},
+            'token': {'name': 'Wrapped Ether', 'symbol': 'WETH'}, 'total': {'value': '1000', 'decimals': '3'}}
+
+# Two pages, newest first
+PAGES = {None: {'items': [_item(i) for i in (9, 8, 7)], 'next_page_params': {'page': 2}},
+         2: {'items': [_item(i) for i in (6, 5, 4)]}}
+
+def _csv_rows(path):
+    with open(path, newline='') as file:
+        return [row['tx_hash'] for row in csv.DictReader(file)]
+
+# A scheduler run that dies after the first page was written but before the
+# commit must not leave its rows behind for the next run on the same index
+def test_failed_run_on_kept_index_is_rolled_back(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(mintandburn, 'TOKENS', {'WETH': '0xweth'})
+    index = TxIndex(csv_path='mint_burn_data.csv')
+
+    def dying_fetch(token_address, page_params=None):
+        if page_params:
+            raise RuntimeError('killed mid-batch')
+        return PAGES[None]
+    monkeypatch.setattr(mintandburn, 'fetch_data', dying_fetch)
+    try:
+        mintandburn.main(index=index)
+    except RuntimeError:
+        pass
+    assert len(_csv_rows('mint_burn_data.csv')) == 3
+
+    monkeypatch.setattr(mintandburn, 'fetch_data',
+                        lambda token_address, page_params=None: PAGES[page_params and page_params['page']])
+    assert mintandburn.main(index=index) == 6
+    rows = _csv_rows('mint_burn_data.csv')
+    assert sorted(rows) == sorted(set(rows)) and len(rows) == 6
+    index.close()
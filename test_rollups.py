@@ -0,0 +1,26 @@
+import columnar_store
+import rollups
+
+def _row(date, usdc):
+    row = {'date': date, **{field: 1.0 for field in columnar_store.TVL_FIELDS}}
+    row.update(bridged_usdc=usdc, bridged_weth=0.0, bridged_elk=0.0)
+    return row
+
+def _new_usdc(conn):
+    return {row['day']: row['new_usdc_bridged'] for row in conn.execute("SELECT day, new_usdc_bridged FROM tvl_daily")}
+
+# Day 2 has no 09:00 snapshot, so day 3's delta is taken against day 1, as
+# infinity.sql's LAG over the 09:00 rows does
+def test_missed_anchor_is_skipped(tmp_path):
+    conn = rollups.connect(str(tmp_path / 'rollups.sqlite'))
+    rollups.update_tvl(conn, [_row('2024-05-01 09:00:00', 100.0), _row('2024-05-02 10:00:00', 150.0),
+                              _row('2024-05-03 09:00:00', 160.0)])
+    assert _new_usdc(conn) == {'2024-05-01': 100.0, '2024-05-02': None, '2024-05-03': 60.0}
+
+# An anchor stored after a later one re-bases the next anchored day, past a
+# day without one
+def test_late_anchor_rebases_next_anchored_day(tmp_path):
+    conn = rollups.connect(str(tmp_path / 'rollups.sqlite'))
+    rollups.update_tvl(conn, [_row('2024-05-03 09:00:00', 160.0), _row('2024-05-02 10:00:00', 150.0)])
+    rollups.update_tvl(conn, [_row('2024-05-01 09:00:00', 100.0)])
+    assert _new_usdc(conn) == {'2024-05-01': 100.0, '2024-05-02': None, '2024-05-03': 60.0}
@@ -0,0 +1,57 @@
+import pytest
+
+import mock_server
+import rpc_reader
+
+TOKEN = '0x79Cb92a2806BF4f82B614A84b6805963b8b1D8BB'
+HOLDER = '0xde397e6C442A3E697367DecBF0d50733dc916b79'
+CALLS = [(TOKEN, rpc_reader.encode_call(rpc_reader.TOTAL_SUPPLY)),
+         (TOKEN, rpc_reader.encode_call(rpc_reader.BALANCE_OF, HOLDER)),
+         # No value set, so this call reverts
+         (TOKEN, rpc_reader.encode_call(rpc_reader.DECIMALS))]
+
+@pytest.fixture
+def node():
+    server, state, base_url = mock_server.start(chain=mock_server.MockChain(head=1010))
+    chain = state.chain
+    chain.set_call(*CALLS[0], rpc_reader.encode_call('', 1000))
+    chain.set_call(*CALLS[0], rpc_reader.encode_call('', 2500), block=1005)
+    chain.set_call(*CALLS[1], rpc_reader.encode_call('', 7))
+    yield chain, f"{base_url}/rpc"
+    server.shutdown()
+
+def _values(results):
+    return [(success, rpc_reader.decode_uint(data) if success else data) for success, data in results]
+
+def test_read_through_aggregate3(node):
+    chain, rpc_url = node
+    assert _values(rpc_reader.read(CALLS, rpc_url)) == [(True, 2500), (True, 7), (False, b'')]
+    assert _values(rpc_reader.read(CALLS, rpc_url, block=hex(1001))) == [(True, 1000), (True, 7), (False, b'')]
+
+def test_read_as_batch_without_multicall(node):
+    chain, rpc_url = node
+    assert _values(rpc_reader.read(CALLS, rpc_url, multicall_address='')) == [(True, 2500), (True, 7), (False, b'')]
+
+def test_eth_call_and_block_number(node):
+    chain, rpc_url = node
+    assert rpc_reader.block_number(rpc_url) == chain.head
+    assert rpc_reader.decode_uint(rpc_reader.eth_call(*CALLS[1], rpc_url=rpc_url)) == 7
+    with pytest.raises(rpc_reader.RPCError):
+        rpc_reader.eth_call(*CALLS[2], rpc_url=rpc_url)
+
+# Blocks before Multicall3 existed fall back to plain eth_calls
+def test_read_at_blocks_before_multicall(node):
+    chain, rpc_url = node
+    chain.multicall_block = 1003
+    results = rpc_reader.read_at_blocks(CALLS, [1002, 1004, 1006], rpc_url)
+    assert {block: _values(rows) for block, rows in results.items()} == {
+        1002: [(True, 1000), (True, 7), (False, b'')],
+        1004: [(True, 1000), (True, 7), (False, b'')],
+        1006: [(True, 2500), (True, 7), (False, b'')],
+    }
+
+def test_blocks_at_times(node):
+    chain, rpc_url = node
+    low, high = (0, chain.timestamp(0)), (chain.head, chain.timestamp(chain.head))
+    times = [chain.timestamp(17), chain.timestamp(600) + 2, chain.timestamp(0) - 1]
+    assert rpc_reader.blocks_at_times(times, low, high, rpc_url) == {times[0]: 17, times[1]: 600, times[2]: None}
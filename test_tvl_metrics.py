@@ -0,0 +1,22 @@
+import tvl_metrics
+
+def _row(date, usdc):
+    return {'date': date, 'bridged_usdc': usdc}
+
+# The 02:00 and 03:00 rows are unchanged and not stored; a backfilled 01:30
+# sample must not become what they read
+def test_backfilled_sample_keeps_later_values(tmp_path):
+    conn = tvl_metrics.connect(str(tmp_path / 'metrics.sqlite'))
+    tvl_metrics.update(conn, [_row('2024-05-01 01:00:00', 100), _row('2024-05-01 02:00:00', 100),
+                              _row('2024-05-01 03:00:00', 100)])
+    new = tvl_metrics.update(conn, [_row('2024-05-01 01:30:00', 90)])
+    assert new == [{'timestamp': '2024-05-01 01:30:00', 'metric_id': 'bridged_usdc', 'value': 90.0},
+                   {'timestamp': '2024-05-01 02:00:00', 'metric_id': 'bridged_usdc', 'value': 100.0}]
+    assert tvl_metrics.values_at(conn, '2024-05-01 01:45:00') == {'bridged_usdc': 90.0}
+    assert tvl_metrics.values_at(conn, '2024-05-01 03:00:00') == {'bridged_usdc': 100.0}
+
+# A backfilled row equal to the value before it stores nothing
+def test_unchanged_backfill_stores_nothing(tmp_path):
+    conn = tvl_metrics.connect(str(tmp_path / 'metrics.sqlite'))
+    tvl_metrics.update(conn, [_row('2024-05-01 01:00:00', 100), _row('2024-05-01 03:00:00', 100)])
+    assert tvl_metrics.update(conn, [_row('2024-05-01 02:00:00', 100)]) == []
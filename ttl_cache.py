@@ -0,0 +1,107 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+CACHE_PATH = os.getenv("TTL_CACHE_DB", "cache.sqlite")
+
+# Key/value cache with a TTL per entry, backed by SQLite so entries survive
+# restarts. ttl=None never expires (immutable data such as token name and
+# decimals). With stale_ttl, an expired entry is still returned for that many
+# extra seconds while a background thread fetches a fresh value
+# (stale-while-revalidate).
+class TTLCache:
+    def __init__(self, path=CACHE_PATH):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                          "stored_at REAL NOT NULL, expires_at REAL)")
+        self.conn.commit()
+        self.lock = threading.Lock()
+        self.refreshing = set()
+        self.stats = {'hits': 0, 'stale_hits': 0, 'misses': 0, 'refreshes': 0, 'refresh_errors': 0}
+
+    def _load(self, key):
+        with self.lock:
+            row = self.conn.execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None, None
+        return json.loads(row[0]), row[1]
+
+    def set(self, key, value, ttl=None):
+        now = time.time()
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO cache (key, value, stored_at, expires_at) VALUES (?, ?, ?, ?)",
+                              (key, json.dumps(value), now, now + ttl if ttl is not None else None))
+            self.conn.commit()
+
+    def get(self, key):
+        value, expires_at = self._load(key)
+        if value is not None and (expires_at is None or expires_at > time.time()):
+            return value
+        return None
+
+    def delete(self, key):
+        with self.lock:
+            self.conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+            self.conn.commit()
+
+    def _count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def _refresh(self, key, fetch, ttl):
+        try:
+            self.set(key, fetch(), ttl)
+            self._count('refreshes')
+        except Exception as e:
+            self._count('refresh_errors')
+            print(f"Background refresh of {key} failed: {e}")
+        finally:
+            with self.lock:
+                self.refreshing.discard(key)
+
+    # Function to return the cached value for key, calling fetch() on a miss
+    def get_or_fetch(self, key, fetch, ttl=None, stale_ttl=None):
+        value, expires_at = self._load(key)
+        now = time.time()
+        if value is not None:
+            if expires_at is None or expires_at > now:
+                self._count('hits')
+                return value
+            if stale_ttl is not None and expires_at + stale_ttl > now:
+                self._count('stale_hits')
+                with self.lock:
+                    start = key not in self.refreshing
+                    self.refreshing.add(key)
+                if start:
+                    threading.Thread(target=self._refresh, args=(key, fetch, ttl)).start()
+                return value
+        self._count('misses')
+        value = fetch()
+        self.set(key, value, ttl)
+        return value
+
+    def hit_rate(self):
+        hits = self.stats['hits'] + self.stats['stale_hits']
+        total = hits + self.stats['misses']
+        return hits / total if total else 0.0
+
+    def print_stats(self):
+        print(f"Cache: {self.stats['hits']} hits, {self.stats['stale_hits']} stale hits, {self.stats['misses']} misses, "
+              f"{self.stats['refreshes']} refreshes, hit rate {self.hit_rate():.0%}")
+
+    # Function to drop entries that expired more than `grace` seconds ago
+    def purge(self, grace=86400):
+        with self.lock:
+            self.conn.execute("DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at < ?", (time.time() - grace,))
+            self.conn.commit()
+
+_cache = None
+
+# Function to get the process-wide cache
+def get_cache():
+    global _cache
+    if _cache is None:
+        _cache = TTLCache()
+    return _cache
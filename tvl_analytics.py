@@ -0,0 +1,123 @@
+import argparse
+import os
+import numpy as np
+import pandas as pd
+import columnar_store
+
+# Local, vectorized equivalent of tvl_analysis.sql. Every derived column and
+# rollup mirrors the SQL: ROUND is half away from zero like Trino, AVG skips
+# nulls, the week key is 'CW <ISO week>' grouped across years, and rows are
+# DISTINCT and ordered by "Day".
+
+CSV_PATH = 'token_and_contract_data.csv'
+
+NUMERIC_COLUMNS = columnar_store.TVL_FIELDS
+
+AVERAGED_COLUMNS = {
+    'bridged_usd_value': 'bridged_usd_value_calc',
+    'borrowing_tvl': 'borrowing_tvl_calc',
+    'elk_tvl': 'elk_tvl_calc',
+    'saving_tvl': 'saving_tvl',
+    'total_tvl': 'total_tvl_calc',
+}
+
+# Trino ROUND(x, 2): half away from zero
+def sql_round(values, digits=2):
+    factor = 10 ** digits
+    return np.sign(values) * np.floor(np.abs(values) * factor + 0.5) / factor
+
+# Function to load the snapshot history, from the columnar store when it has
+# data and from the CSV otherwise. 'Unknown' values become NaN (SQL NULL).
+def load_history(start=None, end=None, csv_path=CSV_PATH):
+    if columnar_store.is_enabled():
+        df = columnar_store.read_pandas('token_and_contract_data', ['date'] + NUMERIC_COLUMNS, start, end)
+        if not df.empty:
+            return df
+    df = pd.read_csv(csv_path, usecols=lambda column: column == 'date' or column in NUMERIC_COLUMNS)
+    df['date'] = pd.to_datetime(df['date'])
+    for column in NUMERIC_COLUMNS:
+        if column in df:
+            df[column] = pd.to_numeric(df[column], errors='coerce')
+    if start is not None:
+        df = df[df['date'] >= pd.Timestamp(start)]
+    if end is not None:
+        df = df[df['date'] < pd.Timestamp(end)]
+    return df
+
+# DailyData CTE
+def daily_data(df):
+    d = df
+    elk_tvl = (d.elk_locked_wbtc * d.btc_in_usd + d.elk_locked_usdc * 1 + d.elk_locked_dai * 1
+               + d.elk_locked_elk * d.elk_in_usd + d.elk_locked_qusd * 1 + d.elk_locked_vnxau * d.vnxau_in_usd)
+    borrowing_tvl = d.locked_wbtc * d.btc_in_usd + d.locked_usdc * 1 + d.locked_dai * 1
+    metapool_tvl = d.stq_supply * d.stq_conv_rate * 0.33
+    total_tvl = elk_tvl + borrowing_tvl + d.saving_tvl
+
+    out = pd.DataFrame({
+        'Day': d['date'],
+        'Month': d['date'].dt.to_period('M').dt.to_timestamp(),
+        'CalendarWeek': 'CW ' + d['date'].dt.isocalendar().week.astype(str),
+        'btc_in_usd': sql_round(d.btc_in_usd),
+        'elk_in_usd': sql_round(d.elk_in_usd),
+        'weth_in_usd': sql_round(d.weth_in_usd),
+        'stq_conv_rate': sql_round(d.stq_conv_rate),
+        'vnxau_in_usd': sql_round(d.vnxau_in_usd),
+        'bridged_wbtc': sql_round(d.bridged_wbtc),
+        'bridged_usdc': sql_round(d.bridged_usdc),
+        'bridged_dai': sql_round(d.bridged_dai),
+        'bridged_weth': sql_round(d.bridged_weth),
+        'bridged_elk': sql_round(d.bridged_elk),
+        'bridged_usd_value_calc': sql_round(d.bridged_wbtc * d.btc_in_usd + d.bridged_usdc * 1 + d.bridged_dai * 1
+                                            + d.bridged_elk * d.elk_in_usd + d.bridged_weth * d.weth_in_usd),
+        'total_qusd': sql_round(d.total_qusd),
+        'locked_wbtc': sql_round(d.locked_wbtc),
+        'locked_usdc': sql_round(d.locked_usdc),
+        'locked_dai': sql_round(d.locked_dai),
+        'borrowing_tvl_calc': sql_round(borrowing_tvl),
+        'saving_tvl': sql_round(d.saving_tvl),
+        'elk_locked_wbtc': sql_round(d.elk_locked_wbtc),
+        'elk_locked_usdc': sql_round(d.elk_locked_usdc),
+        'elk_locked_dai': sql_round(d.elk_locked_dai),
+        'elk_locked_elk': sql_round(d.elk_locked_elk),
+        'elk_locked_qusd': sql_round(d.elk_locked_qusd),
+        'elk_locked_vnxau': sql_round(d.elk_locked_vnxau),
+        'elk_tvl_calc': sql_round(elk_tvl),
+        'stq_supply': sql_round(d.stq_supply),
+        'metapool_tvl': sql_round(metapool_tvl),
+        'total_tvl_wth_stq_calc': sql_round(total_tvl + metapool_tvl),
+        'total_tvl_calc': sql_round(total_tvl),
+        'inf_elk': sql_round(d.extra_1),
+        'inf_weth': sql_round(d.extra_2),
+        'inf_usdc': sql_round(d.extra_3),
+    })
+    return out.drop_duplicates(ignore_index=True)
+
+# WeeklyAverages / MonthlyAverages CTEs
+def averages(daily, key, prefix):
+    grouped = daily.groupby(key)[list(AVERAGED_COLUMNS.values())].mean()
+    grouped.columns = [f'avg_{prefix}_{name}' for name in AVERAGED_COLUMNS]
+    return sql_round(grouped).reset_index()
+
+# Function to compute the full tvl_analysis.sql result. start/end apply to
+# the source rows, like the commented-out WHERE clause in the SQL.
+def tvl_analysis(df=None, start=None, end=None):
+    if df is None:
+        df = load_history(start, end)
+    daily = daily_data(df)
+    weekly = averages(daily, 'CalendarWeek', 'week')
+    monthly = averages(daily, 'Month', 'month')
+    result = daily.merge(weekly, on='CalendarWeek', how='left').merge(monthly, on='Month', how='left')
+    return result.sort_values('Day', kind='stable', ignore_index=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compute tvl_analysis.sql locally from the collected history.")
+    parser.add_argument('--start', help="first snapshot date to include, e.g. 2024-04-01")
+    parser.add_argument('--end', help="first snapshot date to exclude")
+    parser.add_argument('--output', help="write the result to this CSV instead of printing it")
+    args = parser.parse_args()
+    result = tvl_analysis(start=args.start, end=args.end)
+    if args.output:
+        result.to_csv(args.output, index=False)
+        print(f"Wrote {len(result)} rows to {os.path.abspath(args.output)}")
+    else:
+        print(result.tail(20).to_string())
@@ -1,166 +1,463 @@
-import requests
-import pandas as pd
+import csv
 from datetime import datetime
 import os
 import time  # Import the time module
-from dotenv import load_dotenv
 
-load_dotenv()
+# .env is read only when this file is run as a script, before the modules
+# below read their settings. Importing tvl_data as a library does no I/O and
+# uses the process environment as it is.
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
 
-sleeptime = 2
+import columnar_store
+import csv_store
+import deployments
+import dune_outbox
+import http_client
+import metrics
+import rollups
+import ttl_cache
+from fetch_engine import fetch_all, rate_limited_fetch
 
 DUNE_API_KEY = os.getenv("DUNE_API_KEY2")
 NAMESPACE = os.getenv("NAMESPACE2")
 TABLE_NAME = os.getenv("TABLE_NAME2") 
 
+# Cache lifetimes in seconds. Token name and decimals never expire.
+PRICE_TTL = float(os.getenv("PRICE_TTL", "300"))
+PRICE_STALE_TTL = float(os.getenv("PRICE_STALE_TTL", "900"))
+TOTAL_SUPPLY_TTL = float(os.getenv("TOTAL_SUPPLY_TTL", "60"))
+
+# Where supplies, balances and the stQ rate are read from: 'explorer' (one
+# Blockscout request per address), 'rpc' (one Multicall3 call, see
+# rpc_reader.py) or 'events' (vault balances followed from Transfer logs, see
+# tvl_events.py, and the rest read over RPC at the same block)
+TVL_SOURCE = os.getenv("TVL_SOURCE", "explorer")
+
+# How snapshots go to Dune: 'wide' (one row per snapshot in TABLE_NAME2),
+# 'long' (changed metrics only, see tvl_metrics.py) or 'both'
+DUNE_FORMAT = os.getenv("TVL_DUNE_FORMAT", "wide")
+
+# High-frequency sampling (see delta_store.py): every snapshot goes to the
+# delta store, and only the first of each TVL_CSV_INTERVAL seconds goes on to
+# the CSV, Dune and the rollups
+HIGH_FREQUENCY = os.getenv("TVL_HIGH_FREQUENCY") == "1"
+CSV_INTERVAL = int(os.getenv("TVL_CSV_INTERVAL", "3600"))
+
+# Base URLs, overridable to point the collector at a mock server (see mock_server.py)
+EXPLORER_URL = os.getenv("EXPLORER_URL", "https://explorer.q.org")
+COINGECKO_URL = os.getenv("COINGECKO_URL", "https://api.coingecko.com")
+
 def wei_to_token(wei_value, decimals):
     return float(wei_value) / (10 ** decimals)
 
+# Raises http_client.FetchError on failure instead of returning {}, so a
+# failed call never ends up as an "Unknown" value in the table
 def fetch_data(url):
-    try:
-        response = requests.get(url)
-        response.raise_for_status()
-        return response.json()
-    except requests.RequestException as e:
-        print(f"Request failed: {e}")
-        return {}
+    return http_client.get_json(url)
+
+# CoinGecko ids of the prices in each snapshot
+PRICE_IDS = deployments.setting('prices', ['usd-coin', 'dai', 'wrapped-bitcoin', 'elk-finance', 'vnx-gold', 'weth', 'q-protocol'])
+PRICES_URL = f"{COINGECKO_URL}/api/v3/simple/price?ids={','.join(PRICE_IDS)}&vs_currencies=usd"
 
 def fetch_prices():
-    token_ids = 'usd-coin,dai,wrapped-bitcoin,elk-finance,vnx-gold,weth,q-protocol'
-    url = f"https://api.coingecko.com/api/v3/simple/price?ids={token_ids}&vs_currencies=usd"
-    try:
-        response = requests.get(url)
-        response.raise_for_status()
-        return response.json()
-    except requests.RequestException as e:
-        print(f"Failed to fetch prices: {e}")
-        return {}
+    return fetch_data(PRICES_URL)
 
-def get_token_info(address):
-    data = fetch_data(f"https://explorer.q.org/api/v2/tokens/{address}")
-    time.sleep(15)  # Add delay
+# Token addresses whose /tokens/{address} info is read each snapshot. These
+# and the tables below are Q mainnet's; a deployment in deployments.json can
+# replace each of them (see deployments.py).
+TOKEN_ADDRESSES = deployments.setting('tokens', {
+    'wbtc_info': "0xde397e6C442A3E697367DecBF0d50733dc916b79",
+    'weth_info': "0xd56F9ffF3fe3BD0C7B52afF9A42eb70E05A287Cc",
+    'usdc_info': "0x79Cb92a2806BF4f82B614A84b6805963b8b1D8BB",
+    'dai_info': "0xDeb87c37Dcf7F5197026f574cd40B3Fc8Aa126D1",
+    'elk_info': "0xeEeEEb57642040bE42185f49C52F7E9B38f8eeeE",
+    'stQ_meta': "0x1CC2f3A24F5c826af7F98A91b98BeC2C05115d01",
+    'total_qusd': "0xE31DD093A2A0aDc80053bF2b929E56aBFE1B1632",
+})
+
+# Contract addresses whose /addresses/{address}/token-balances are read each snapshot
+CONTRACT_ADDRESSES = deployments.setting('vaults', {
+    'reservoir_supply_info': "0x42424242B0c0d8A19dCD0dF362815E242586354A",
+    'locked_contract_info': "0xb9c29d9A24B233C53020891D47F82043da615Dcc",
+    'saved_qusd': "0x7CCa96c630329c1972547e95B9f3F82eC31A916A",
+    'elk_locked_wbtc': "0x38d54a9a8C622CD682398C2Bef7341D08b32e4b1",
+    'elk_locked_usdc': "0x2A36b45be4C04900A5946A1B6bf991aDec93ADdE",
+    'elk_locked_dai': "0x566989560917879868cb98C5EF72d9050298c49c",
+    'elk_locked_elk': "0x8490a1ece0363dE138d39022629785e060422571",
+    'elk_locked_vnxau': "0x4300B43659e2d4300FF9379Db65cBFb036Ab9096",
+    #Infinity
+    'inf_elk': "0x1EAf38375CA45685D3FCa0c53e9fa6b02bb9B0D5",
+    'inf_weth': "0x367750af92a2C427Cc94E1c562DEa9753a42c27e",
+    'inf_usdc': "0x41AA6785b4ffE18A79bba796793E828059Ff342a",
+})
+
+# Tokens read from each contract's balances when TVL_SOURCE=rpc. The explorer
+# returns every balance; these are the ones the snapshot row uses.
+CONTRACT_TOKENS = deployments.setting('vault_tokens', {
+    'reservoir_supply_info': ['ELK'],
+    'locked_contract_info': ['WBTC', 'USDC', 'DAI'],
+    'saved_qusd': ['QUSD'],
+    'elk_locked_wbtc': ['WBTC', 'QUSD'],
+    'elk_locked_usdc': ['USDC', 'QUSD'],
+    'elk_locked_dai': ['DAI', 'QUSD'],
+    'elk_locked_elk': ['ELK', 'QUSD'],
+    'elk_locked_vnxau': ['VNXAU', 'QUSD'],
+    'inf_elk': ['ELK'],
+    'inf_weth': ['WETH'],
+    'inf_usdc': ['USDC'],
+})
+
+# Token address of each symbol in CONTRACT_TOKENS. VNXAU is not in
+# TOKEN_ADDRESSES; set VNXAU_ADDRESS or it is looked up once from the explorer,
+# like any symbol whose address is null.
+TOKEN_SYMBOLS = deployments.setting('symbols') or {
+    'WBTC': TOKEN_ADDRESSES['wbtc_info'],
+    'WETH': TOKEN_ADDRESSES['weth_info'],
+    'USDC': TOKEN_ADDRESSES['usdc_info'],
+    'DAI': TOKEN_ADDRESSES['dai_info'],
+    'ELK': TOKEN_ADDRESSES['elk_info'],
+    'QUSD': TOKEN_ADDRESSES['total_qusd'],
+    'VNXAU': os.getenv("VNXAU_ADDRESS"),
+}
+
+# Contract with the stQ conversion rate; an empty setting leaves the rate out
+STQ_CONTRACT = deployments.setting('stq_contract', "0x1CC2f3A24F5c826af7F98A91b98BeC2C05115d01")
+
+STQ_PRICE_URL = f"{EXPLORER_URL}/api/v2/smart-contracts/{STQ_CONTRACT}/methods-read-proxy?is_custom_abi=true&from=0xF61f5c4a3664501F499A9289AaEe76a709CE536e"
+
+# Snapshot columns of a deployment with its own tokens, see build_configured_row.
+# Without them the row is Q mainnet's, from build_row.
+COLUMNS = deployments.setting('columns')
+
+# Function to get a token's name, symbol and decimals, which never change, from the cache
+def get_token_meta(address):
+    key = f"token-meta:{address}"
+    cache = ttl_cache.get_cache()
+    def fetch():
+        data = fetch_data(f"{EXPLORER_URL}/api/v2/tokens/{address}")
+        return {'name': data.get('name'), 'symbol': data.get('symbol'), 'decimals': data.get('decimals')}
+    meta = cache.get_or_fetch(key, fetch)
+    # Entries cached before the symbol was kept are fetched again once
+    if 'symbol' not in meta:
+        meta = fetch()
+        cache.set(key, meta)
+    return meta
+
+def remember_token_meta(address, data):
+    key = f"token-meta:{address}"
+    cache = ttl_cache.get_cache()
+    if data.get('decimals') is not None and cache.get(key) is None:
+        meta = {'name': data.get('name'), 'decimals': data.get('decimals')}
+        if data.get('symbol') is not None:
+            meta['symbol'] = data['symbol']
+        cache.set(key, meta)
+
+def parse_token_info(data, meta=None):
+    meta = meta or {}
+    decimals = data.get('decimals') if data.get('decimals') is not None else meta.get('decimals', 0)
     return {
-        'name': data.get('name', 'Unknown'),
-        'total_supply': wei_to_token(data.get('total_supply', 0), int(data.get('decimals', 0))) if data.get('total_supply') else 'Unknown'
+        'name': data.get('name') or meta.get('name') or 'Unknown',
+        'total_supply': wei_to_token(data.get('total_supply', 0), int(decimals)) if data.get('total_supply') else 'Unknown'
     }
 
-def get_contract_balances(address):
-    data = fetch_data(f"https://explorer.q.org/api/v2/addresses/{address}/token-balances")
-    time.sleep(sleeptime)  # Add delay
+def parse_contract_balances(data):
     balances = {}
     for token in data:
         balances[token['token']['symbol']] = wei_to_token(token['value'], int(token['token']['decimals']))
     return balances
 
-prices = fetch_prices()
-time.sleep(sleeptime)  # Add delay
+def parse_stq_price(data):
+    for method in data or []:
+        if method.get('method_id') == 'f2f3fea8' and method['name'] == 'getStQPrice':
+            return wei_to_token(int(method['outputs'][0]['value']), 18)
+    return None
+
+def get_token_info(address):
+    return parse_token_info(fetch_data(f"{EXPLORER_URL}/api/v2/tokens/{address}"))
+
+def get_contract_balances(address):
+    return parse_contract_balances(fetch_data(f"{EXPLORER_URL}/api/v2/addresses/{address}/token-balances"))
 
 def get_stq_price():
-    url = "https://explorer.q.org/api/v2/smart-contracts/0x1CC2f3A24F5c826af7F98A91b98BeC2C05115d01/methods-read-proxy?is_custom_abi=true&from=0xF61f5c4a3664501F499A9289AaEe76a709CE536e"
-    try:
-        response = requests.get(url)
-        time.sleep(sleeptime)  # Add delay
-        response.raise_for_status()
-        data = response.json()
-        for method in data:
-            if method.get('method_id') == 'f2f3fea8' and method['name'] == 'getStQPrice':
-                return wei_to_token(int(method['outputs'][0]['value']), 18)
-    except requests.RequestException as e:
-        print(f"Failed to fetch STQ price: {e}")
+    return parse_stq_price(fetch_data(STQ_PRICE_URL))
+
+# Read prices, supplies, balances and the stQ rate from the explorer. All
+# explorer and CoinGecko requests are sent at once through the fetch engine,
+# which keeps each host within its rps budget.
+def read_explorer_values(cache):
+    urls = {'prices': PRICES_URL}
+    if STQ_CONTRACT:
+        urls['stq_price'] = STQ_PRICE_URL
+    for name, address in TOKEN_ADDRESSES.items():
+        urls[name] = f"{EXPLORER_URL}/api/v2/tokens/{address}"
+    for name, address in CONTRACT_ADDRESSES.items():
+        urls[name] = f"{EXPLORER_URL}/api/v2/addresses/{address}/token-balances"
+
+    # Prices and total supplies are served from the cache while fresh; only
+    # misses count against the host's rate limit
+    policies = {urls['prices']: (PRICE_TTL, PRICE_STALE_TTL)}
+    for name in TOKEN_ADDRESSES:
+        policies[urls[name]] = (TOTAL_SUPPLY_TTL, None)
+
+    def cached_fetch(url):
+        if url not in policies:
+            return rate_limited_fetch(url, fetch_data)
+        ttl, stale_ttl = policies[url]
+        return cache.get_or_fetch(url, lambda: rate_limited_fetch(url, fetch_data), ttl, stale_ttl)
+
+    started = time.time()
+    responses = fetch_all(urls, cached_fetch, rate_limit=False)
+    print(f"Fetched {len(urls)} endpoints in {time.time() - started:.2f}s")
+
+    info = {}
+    for name, address in TOKEN_ADDRESSES.items():
+        remember_token_meta(address, responses[name])
+        info[name] = parse_token_info(responses[name], cache.get(f"token-meta:{address}"))
+    balances = {name: parse_contract_balances(responses[name]) for name in CONTRACT_ADDRESSES}
+    return responses['prices'], info, balances, parse_stq_price(responses.get('stq_price'))
+
+# Function to find the address of a token held by `holder` from its explorer
+# balances. The answer is cached for good, like the token's decimals.
+def resolve_token_address(symbol, holder):
+    cache = ttl_cache.get_cache()
+    def fetch():
+        for token in fetch_data(f"{EXPLORER_URL}/api/v2/addresses/{holder}/token-balances"):
+            if token['token']['symbol'] == symbol:
+                address = token['token'].get('address_hash') or token['token'].get('address')
+                remember_token_meta(address, token['token'])
+                return address
         return None
+    return cache.get_or_fetch(f"token-address:{symbol}", fetch)
 
+# Function to get what the RPC reads need besides the calls themselves: the
+# address of each symbol, and token names and decimals. None of these change,
+# so after the first run they all come from the cache.
+def rpc_tokens(cache):
+    import rpc_reader
+    symbols = dict(TOKEN_SYMBOLS)
+    for symbol, address in TOKEN_SYMBOLS.items():
+        holders = [contract for contract, contract_symbols in CONTRACT_TOKENS.items() if symbol in contract_symbols]
+        if not address and holders:
+            symbols[symbol] = resolve_token_address(symbol, CONTRACT_ADDRESSES[holders[0]])
+    addresses = set(TOKEN_ADDRESSES.values()) | {address for address in symbols.values() if address}
+    decimals, names, missing = {}, {}, []
+    for address in addresses:
+        meta = cache.get(f"token-meta:{address}") or {}
+        names[address] = meta.get('name')
+        if meta.get('decimals') is not None:
+            decimals[address] = int(meta['decimals'])
+        else:
+            missing.append(address)
+    if missing:
+        results = rpc_reader.read([(address, rpc_reader.encode_call(rpc_reader.DECIMALS)) for address in missing])
+        for address, (success, data) in zip(missing, results):
+            if success and len(data) >= 32:
+                decimals[address] = rpc_reader.decode_uint(data)
+                remember_token_meta(address, {'decimals': decimals[address]})
+    return {'symbols': symbols, 'decimals': decimals, 'names': names}
 
-wbtc_info = get_token_info("0xde397e6C442A3E697367DecBF0d50733dc916b79")
-weth_info = get_token_info("0xd56F9ffF3fe3BD0C7B52afF9A42eb70E05A287Cc")
-usdc_info = get_token_info("0x79Cb92a2806BF4f82B614A84b6805963b8b1D8BB")
-dai_info = get_token_info("0xDeb87c37Dcf7F5197026f574cd40B3Fc8Aa126D1")
-elk_info = get_token_info("0xeEeEEb57642040bE42185f49C52F7E9B38f8eeeE")
-stQ_meta = get_token_info("0x1CC2f3A24F5c826af7F98A91b98BeC2C05115d01")
-reservoir_supply_info = get_contract_balances("0x42424242B0c0d8A19dCD0dF362815E242586354A")
-locked_contract_info = get_contract_balances("0xb9c29d9A24B233C53020891D47F82043da615Dcc")
-total_qusd = get_token_info("0xE31DD093A2A0aDc80053bF2b929E56aBFE1B1632")
-saved_qusd = get_contract_balances("0x7CCa96c630329c1972547e95B9f3F82eC31A916A")
-elk_locked_wbtc = get_contract_balances("0x38d54a9a8C622CD682398C2Bef7341D08b32e4b1")
-elk_locked_usdc = get_contract_balances("0x2A36b45be4C04900A5946A1B6bf991aDec93ADdE")
-elk_locked_dai = get_contract_balances("0x566989560917879868cb98C5EF72d9050298c49c")
-elk_locked_elk = get_contract_balances("0x8490a1ece0363dE138d39022629785e060422571")
-elk_locked_vnxau = get_contract_balances("0x4300B43659e2d4300FF9379Db65cBFb036Ab9096")
-
-#Infinity 
-inf_elk = get_contract_balances("0x1EAf38375CA45685D3FCa0c53e9fa6b02bb9B0D5")
-inf_weth = get_contract_balances("0x367750af92a2C427Cc94E1c562DEa9753a42c27e")
-inf_usdc = get_contract_balances("0x41AA6785b4ffE18A79bba796793E828059Ff342a")
-
-
-
-
-
-wbtc_usd_price = prices.get('wrapped-bitcoin', {}).get('usd', 0)
-elk_usd_price = prices.get('elk-finance', {}).get('usd', 0)
-vnxau_usd_price = prices.get('vnx-gold', {}).get('usd', 0)
-weth_usd_price = prices.get('weth', {}).get('usd', 0)
-qgov_usd_price = prices.get('q-protocol', {}).get('usd', 0)
-stq_price = get_stq_price()
-
-elk_locked_qusd_total = sum([
-    elk_locked_wbtc.get('QUSD', 0),
-    elk_locked_usdc.get('QUSD', 0),
-    elk_locked_dai.get('QUSD', 0),
-    elk_locked_elk.get('QUSD', 0),
-    elk_locked_vnxau.get('QUSD', 0)
-])
-
-bridged_elk = float(elk_info['total_supply']) - float(reservoir_supply_info.get('ELK', 0))
-
-data_row = {
-    'date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-    'btc_in_usd': wbtc_usd_price,
-    'elk_in_usd': elk_usd_price,
-    'vnxau_in_usd': vnxau_usd_price,
-    'weth_in_usd': weth_usd_price,
-    'stq_conv_rate': stq_price,
-    'bridged_wbtc': wbtc_info['total_supply'],
-    'bridged_usdc': usdc_info['total_supply'],
-    'bridged_dai': dai_info['total_supply'],
-    'bridged_weth': weth_info['total_supply'],
-    'bridged_elk': bridged_elk,
-    'total_qusd': total_qusd['total_supply'],
-    'locked_wbtc': locked_contract_info.get('WBTC', 'Unknown'),
-    'locked_usdc': locked_contract_info.get('USDC', 'Unknown'),
-    'locked_dai': locked_contract_info.get('DAI', 'Unknown'),
-    'saving_tvl': saved_qusd.get('QUSD', 'Unknown'),
-    'elk_locked_wbtc': elk_locked_wbtc.get('WBTC', 'Unknown'),
-    'elk_locked_usdc': elk_locked_usdc.get('USDC', 'Unknown'),
-    'elk_locked_dai': elk_locked_dai.get('DAI', 'Unknown'),
-    'elk_locked_elk': elk_locked_elk.get('ELK', 'Unknown'),
-    'elk_locked_qusd': elk_locked_qusd_total,
-    'elk_locked_vnxau': elk_locked_vnxau.get('VNXAU', 'Unknown'),
-    'stq_supply': stQ_meta['total_supply'],
-    'extra_1': inf_elk.get('ELK', 'Unknown'),
-    'extra_2': inf_weth.get('WETH', 'Unknown'),
-    'extra_3': inf_usdc.get('USDC', 'Unknown'),
-    'extra_4': qgov_usd_price,
-    'extra_5': 0.0,
-    'extra_6': 0.0,
-    'extra_7': 0.0,
-    'extra_8': 0.0,
-    'extra_9': 0.0,
-    'extra_10': 0.0,
-    'extra_11': 0.0,
-    'extra_12': 0.0,
-    'extra_13': 0.0,
-    'extra_14': 0.0,
-    'extra_15': 0.0,
-    'extra_16': 0.0,
-    'extra_17': 0.0,
-    'extra_18': 0.0,
-    'extra_19': 0.0,
-    'extra_20': 0.0
-}
+# Function to list the contract calls of one snapshot. Returns (calls, keys)
+# where keys[i] says what calls[i] reads.
+def rpc_calls(tokens):
+    import rpc_reader
+    symbols = tokens['symbols']
+    calls, keys = [], []
+    for name, address in TOKEN_ADDRESSES.items():
+        calls.append((address, rpc_reader.encode_call(rpc_reader.TOTAL_SUPPLY)))
+        keys.append(('supply', name))
+    for contract, contract_symbols in CONTRACT_TOKENS.items():
+        for symbol in contract_symbols:
+            if symbols[symbol]:
+                calls.append((symbols[symbol], rpc_reader.encode_call(rpc_reader.BALANCE_OF, CONTRACT_ADDRESSES[contract])))
+                keys.append(('balance', contract, symbol))
+    if STQ_CONTRACT:
+        calls.append((STQ_CONTRACT, rpc_reader.encode_call(rpc_reader.GET_STQ_PRICE)))
+        keys.append(('stq_price',))
+    return calls, keys
+
+# Function to turn call results back into (info, balances, stq_price), the
+# same shapes the explorer path produces
+def decode_rpc_values(keys, results, tokens):
+    import rpc_reader
+    results = dict(zip(keys, results))
+    decimals = tokens['decimals']
+
+    # A failed call, or a call to a contract not deployed yet (empty return
+    # data), reads as 'Unknown', like a token missing from the explorer
+    def amount(key, address):
+        success, data = results[key]
+        if not success or len(data) < 32 or address not in decimals:
+            return None
+        return wei_to_token(rpc_reader.decode_uint(data), decimals[address])
+
+    info = {}
+    for name, address in TOKEN_ADDRESSES.items():
+        total_supply = amount(('supply', name), address)
+        info[name] = {'name': tokens['names'].get(address) or 'Unknown',
+                      'total_supply': total_supply if total_supply is not None else 'Unknown'}
+    balances = {}
+    for contract, contract_symbols in CONTRACT_TOKENS.items():
+        balances[contract] = {}
+        for symbol in contract_symbols:
+            if ('balance', contract, symbol) in results:
+                value = amount(('balance', contract, symbol), tokens['symbols'][symbol])
+                if value is not None:
+                    balances[contract][symbol] = value
+    success, data = results.get(('stq_price',), (False, b''))
+    stq_price = wei_to_token(rpc_reader.decode_uint(data), 18) if success and len(data) >= 32 else None
+    return info, balances, stq_price
+
+# Read supplies, balances and the stQ rate in one Multicall3 call at a single
+# block, and prices from CoinGecko through the cache
+def read_rpc_values(cache):
+    import rpc_reader
+    prices = cache.get_or_fetch(PRICES_URL, lambda: rate_limited_fetch(PRICES_URL, fetch_data), PRICE_TTL, PRICE_STALE_TTL)
+    tokens = rpc_tokens(cache)
+    calls, keys = rpc_calls(tokens)
+    info, balances, stq_price = decode_rpc_values(keys, rpc_reader.read(calls), tokens)
+    return prices, info, balances, stq_price
+
+# Function to list the (vault, token address) pairs tvl_events follows.
+# Returns (pairs, {pair key: "contract symbol" label}).
+def event_pairs(tokens):
+    import tvl_events
+    pairs, labels = [], {}
+    for contract, contract_symbols in CONTRACT_TOKENS.items():
+        for symbol in contract_symbols:
+            token = tokens['symbols'][symbol]
+            if token:
+                pairs.append((CONTRACT_ADDRESSES[contract], token))
+                labels[tvl_events.pair_key(CONTRACT_ADDRESSES[contract], token)] = f"{contract} {symbol}"
+    return pairs, labels
+
+# Read vault balances from the transfer-log ledger, and supplies and the stQ
+# rate over RPC at the ledger's block, so the whole row is from one block
+def read_event_values(cache):
+    import rpc_reader
+    import tvl_events
+    prices = cache.get_or_fetch(PRICES_URL, lambda: rate_limited_fetch(PRICES_URL, fetch_data), PRICE_TTL, PRICE_STALE_TTL)
+    tokens = rpc_tokens(cache)
+    ledger = tvl_events.VaultLedger(event_pairs(tokens)[0])
+    block = ledger.advance()
+    calls, keys = rpc_calls(tokens)
+    reads = [(call, key) for call, key in zip(calls, keys) if key[0] != 'balance']
+    results = dict(zip([key for _, key in reads], rpc_reader.read([call for call, _ in reads], block=hex(block))))
+    for key in keys:
+        if key[0] == 'balance':
+            value = ledger.balance(CONTRACT_ADDRESSES[key[1]], tokens['symbols'][key[2]])
+            # A negative balance means missed logs; it reads as unknown until the next reconciliation
+            known = value is not None and value >= 0
+            results[key] = (known, value.to_bytes(32, 'big') if known else b'')
+    info, balances, stq_price = decode_rpc_values(keys, [results[key] for key in keys], tokens)
+    return prices, info, balances, stq_price
+
+# Build a snapshot row from the source selected by TVL_SOURCE
+def collect_snapshot():
+    cache = ttl_cache.get_cache()
+    if TVL_SOURCE == 'rpc':
+        prices, info, balances, stq_price = read_rpc_values(cache)
+    elif TVL_SOURCE == 'events':
+        prices, info, balances, stq_price = read_event_values(cache)
+    else:
+        prices, info, balances, stq_price = read_explorer_values(cache)
+    cache.print_stats()
+    return make_row(prices, info, balances, stq_price, datetime.now())
+
+# Function to build a snapshot row with the deployment's columns, or Q mainnet's
+def make_row(prices, info, balances, stq_price, date):
+    if COLUMNS:
+        return build_configured_row(prices, info, balances, stq_price, date, COLUMNS)
+    return build_row(prices, info, balances, stq_price, date)
+
+# Function to build the token_and_contract_data row for one point in time
+def build_row(prices, info, balances, stq_price, date):
+    wbtc_usd_price = prices.get('wrapped-bitcoin', {}).get('usd', 0)
+    elk_usd_price = prices.get('elk-finance', {}).get('usd', 0)
+    vnxau_usd_price = prices.get('vnx-gold', {}).get('usd', 0)
+    weth_usd_price = prices.get('weth', {}).get('usd', 0)
+    qgov_usd_price = prices.get('q-protocol', {}).get('usd', 0)
+
+    elk_locked_wbtc = balances['elk_locked_wbtc']
+    elk_locked_usdc = balances['elk_locked_usdc']
+    elk_locked_dai = balances['elk_locked_dai']
+    elk_locked_elk = balances['elk_locked_elk']
+    elk_locked_vnxau = balances['elk_locked_vnxau']
+    locked_contract_info = balances['locked_contract_info']
+
+    elk_locked_qusd_total = sum([
+        elk_locked_wbtc.get('QUSD', 0),
+        elk_locked_usdc.get('QUSD', 0),
+        elk_locked_dai.get('QUSD', 0),
+        elk_locked_elk.get('QUSD', 0),
+        elk_locked_vnxau.get('QUSD', 0)
+    ])
+
+    elk_supply = info['elk_info']['total_supply']
+    bridged_elk = float(elk_supply) - float(balances['reservoir_supply_info'].get('ELK', 0)) if elk_supply != 'Unknown' else 'Unknown'
+
+    data_row = {
+        'date': date.strftime('%Y-%m-%d %H:%M:%S'),
+        'btc_in_usd': wbtc_usd_price,
+        'elk_in_usd': elk_usd_price,
+        'vnxau_in_usd': vnxau_usd_price,
+        'weth_in_usd': weth_usd_price,
+        'stq_conv_rate': stq_price,
+        'bridged_wbtc': info['wbtc_info']['total_supply'],
+        'bridged_usdc': info['usdc_info']['total_supply'],
+        'bridged_dai': info['dai_info']['total_supply'],
+        'bridged_weth': info['weth_info']['total_supply'],
+        'bridged_elk': bridged_elk,
+        'total_qusd': info['total_qusd']['total_supply'],
+        'locked_wbtc': locked_contract_info.get('WBTC', 'Unknown'),
+        'locked_usdc': locked_contract_info.get('USDC', 'Unknown'),
+        'locked_dai': locked_contract_info.get('DAI', 'Unknown'),
+        'saving_tvl': balances['saved_qusd'].get('QUSD', 'Unknown'),
+        'elk_locked_wbtc': elk_locked_wbtc.get('WBTC', 'Unknown'),
+        'elk_locked_usdc': elk_locked_usdc.get('USDC', 'Unknown'),
+        'elk_locked_dai': elk_locked_dai.get('DAI', 'Unknown'),
+        'elk_locked_elk': elk_locked_elk.get('ELK', 'Unknown'),
+        'elk_locked_qusd': elk_locked_qusd_total,
+        'elk_locked_vnxau': elk_locked_vnxau.get('VNXAU', 'Unknown'),
+        'stq_supply': info['stQ_meta']['total_supply'],
+        'extra_1': balances['inf_elk'].get('ELK', 'Unknown'),
+        'extra_2': balances['inf_weth'].get('WETH', 'Unknown'),
+        'extra_3': balances['inf_usdc'].get('USDC', 'Unknown'),
+        'extra_4': qgov_usd_price,
+    }
+    for i in range(5, 21):
+        data_row[f'extra_{i}'] = 0.0
+    return data_row
+
+# Function to build a row from a deployment's {column: terms}. Each term is
+# "price:<coingecko id>", "supply:<token>", "balance:<vault>:<symbol>" or
+# "stq_rate"; a list of terms is summed and a leading "-" subtracts a term.
+# A column with an unknown supply or balance is 'Unknown'; a missing price is 0.
+def build_configured_row(prices, info, balances, stq_price, date, columns):
+    def term_value(term):
+        sign = -1 if term.startswith('-') else 1
+        kind, _, name = term.lstrip('-').partition(':')
+        if kind == 'price':
+            value = prices.get(name, {}).get('usd', 0)
+        elif kind == 'supply':
+            value = info.get(name, {}).get('total_supply', 'Unknown')
+        elif kind == 'balance':
+            vault, _, symbol = name.partition(':')
+            value = balances.get(vault, {}).get(symbol, 'Unknown')
+        elif kind == 'stq_rate':
+            value = stq_price
+        else:
+            raise ValueError(f"unknown column term {term!r}")
+        return None if value in ('Unknown', None) else sign * float(value)
+
+    data_row = {'date': date.strftime('%Y-%m-%d %H:%M:%S')}
+    for column, terms in columns.items():
+        values = [term_value(term) for term in ([terms] if isinstance(terms, str) else terms)]
+        data_row[column] = 'Unknown' if None in values else sum(values)
+    return data_row
 
-new_row = pd.DataFrame([data_row])
 csv_file_path = 'token_and_contract_data.csv'
-print(f"Attempting to write to CSV at: {os.path.abspath(csv_file_path)}")
 
 # Manually set this flag to True for the first run, then False for subsequent runs
 first_run = False
@@ -170,43 +467,78 @@ dune_user = NAMESPACE  # Replace with your Dune user name
 dune_table = TABLE_NAME  # Replace with your Dune table name
 api_key = DUNE_API_KEY # Replace with your Dune api
 
+# Function to store snapshot rows: queue them for Dune, append them to the CSV
+# and the columnar store, and fold them into the rollups. Live snapshots and
+# backfill.py both go through here. File errors are raised to the caller.
+def store_rows(rows, outbox):
+    fieldnames = list(rows[0])
+    if DUNE_FORMAT != 'long':
+        dune_outbox.enqueue(outbox, dune_user, dune_table, fieldnames, rows, ['date'])
+    csv_store.append_rows(csv_file_path, fieldnames, rows)
+    columnar_store.append_if_enabled('token_and_contract_data', rows)
+    if DUNE_FORMAT != 'wide':
+        import tvl_metrics
+        metrics_conn = tvl_metrics.connect()
+        print(f"Queued {tvl_metrics.enqueue_changes(metrics_conn, outbox, rows, dune_user)} changed metrics.")
+        metrics_conn.close()
+    # The rollups are computed from Q mainnet's columns
+    if COLUMNS:
+        return
+    rollup_conn = rollups.connect()
+    rollup_changes = rollups.update_tvl(rollup_conn, rows)
+    rollup_conn.close()
+    rollups.enqueue_changes(outbox, rollup_changes, dune_user)
 
-try:
-    if os.path.exists(csv_file_path):
-        print("File exists. Reading and appending...")
-        df = pd.read_csv(csv_file_path)
-        df = pd.concat([df, new_row], ignore_index=True)
-        df.to_csv(csv_file_path, index=False)
-        print("Data appended and saved.")
-    else:
-        print("File does not exist. Creating new file...")
-        new_row.to_csv(csv_file_path, index=False)
-        print("New file created and data written.")
-
-    df = pd.read_csv(csv_file_path)
-    print("Data successfully written. Here's a preview:")
-    print(df.tail())
-except Exception as e:
-    print(f"Error during file operation: {e}")
-
-def upload_to_dune(csv_path, namespace, table_name, api_key):
-    url = f"https://api.dune.com/api/v1/table/{namespace}/{table_name}/insert"
-    headers = {
-        "X-DUNE-API-KEY": api_key,
-        "Content-Type": "text/csv"
-    }
-    with open(csv_path, "rb") as data:
-        response = requests.request("POST", url, data=data, headers=headers)
-    print(response.text)
-
-if first_run:
-    print("First run: Uploading entire CSV.")
-    upload_to_dune(csv_file_path, dune_user, dune_table, api_key)
-else:
-    print("Subsequent run: Uploading new data only.")
-    temp_csv_path = 'temp_new_data.csv'
-    print("Subsequent run: Created tempfile")
-    new_row.to_csv(temp_csv_path, index=False)
-    upload_to_dune(temp_csv_path, dune_user, dune_table, api_key)
-    os.remove(temp_csv_path)
-    print("Subsequent run: Deleted tempfile")
\ No newline at end of file
+# Function to store a live snapshot. Returns False when high-frequency mode
+# kept it in the delta store only.
+def store_snapshot(data_row, outbox):
+    if HIGH_FREQUENCY:
+        import delta_store
+        delta_store.DeltaStore().append([data_row])
+        last_rows = csv_store.tail_rows(csv_file_path, 1) if os.path.exists(csv_file_path) else []
+        if last_rows and (delta_store.to_epoch(last_rows[0]['date']) // CSV_INTERVAL
+                          == delta_store.to_epoch(data_row['date']) // CSV_INTERVAL):
+            return False
+    store_rows([data_row], outbox)
+    return True
+
+# Take one snapshot, store it and upload it. Returns the new row.
+def main():
+    started = time.time()
+    with metrics.stage('tvl_data', 'fetch'):
+        data_row = collect_snapshot()
+    metrics.rows('tvl_data', 'fetched', 1)
+
+    print(f"Attempting to write to CSV at: {os.path.abspath(csv_file_path)}")
+
+    outbox = dune_outbox.connect()
+    try:
+        with metrics.stage('tvl_data', 'persist'):
+            stored = store_snapshot(data_row, outbox)
+        metrics.rows('tvl_data', 'written', 1)
+        if not stored:
+            print(f"Stored the snapshot in the delta store; the CSV already has a row in this {CSV_INTERVAL}s interval.")
+        print("Data successfully written. Here's a preview:")
+        for row in csv_store.tail_rows(csv_file_path, 5):
+            print(row)
+    except Exception as e:
+        print(f"Error during file operation: {e}")
+
+    # On the first run queue the whole history as well, then deliver
+    # everything pending. Rows are keyed on date, so re-queuing is harmless.
+    if first_run and DUNE_FORMAT != 'long':
+        print("First run: Queuing entire CSV.")
+        with open(csv_file_path, newline='') as file:
+            dune_outbox.enqueue(outbox, dune_user, dune_table, list(data_row), list(csv.DictReader(file)), ['date'])
+    with metrics.stage('tvl_data', 'upload'):
+        uploaded = dune_outbox.flush(outbox, dune_user, api_key)
+    metrics.rows('tvl_data', 'uploaded', uploaded)
+    print(f"Uploaded {uploaded} rows to Dune, {dune_outbox.pending_count(outbox)} pending.")
+    outbox.close()
+
+    http_client.print_stats()
+    metrics.write_run('tvl_data', started)
+    return data_row
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+
+import metrics
+import rpc_reader
+
+# Vault balances kept up to date from ERC-20 Transfer logs (TVL_SOURCE=events).
+#
+# The balances of the tracked (vault, token) pairs are polled once with
+# balanceOf at a block. After that, each snapshot asks the node for the
+# Transfer logs into and out of the vaults since the cursor block, in one
+# JSON-RPC batch, and applies each log as a delta. The cursor and balances are
+# checkpointed after every snapshot. A full balanceOf poll only runs every
+# TVL_EVENTS_RECONCILE_INTERVAL seconds to catch anything the logs missed
+# (e.g. rebasing tokens); differences are reported as drift.
+#
+# The cursor stays TVL_EVENTS_CONFIRMATIONS blocks behind the head, so a
+# short reorg never reaches the applied logs.
+
+CHECKPOINT_PATH = os.getenv("TVL_EVENTS_CHECKPOINT", "tvl_events_checkpoint.json")
+CONFIRMATIONS = int(os.getenv("TVL_EVENTS_CONFIRMATIONS", "5"))
+# Largest block range of one eth_getLogs request; longer gaps are split
+MAX_LOG_RANGE = int(os.getenv("TVL_EVENTS_MAX_RANGE", "5000"))
+RECONCILE_INTERVAL = float(os.getenv("TVL_EVENTS_RECONCILE_INTERVAL", "86400"))
+
+# keccak256("Transfer(address,address,uint256)")
+TRANSFER_TOPIC = "0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef"
+
+def _topic(address):
+    return '0x' + '0' * 24 + address[2:].lower()
+
+def _address(topic):
+    return '0x' + topic[-40:].lower()
+
+def pair_key(holder, token):
+    return f"{holder.lower()}:{token.lower()}"
+
+# Function to read balanceOf of every (holder, token) pair at a block,
+# returns {pair key: raw amount}. Pairs whose call fails are left out.
+def poll_balances(pairs, block):
+    calls = [(token, rpc_reader.encode_call(rpc_reader.BALANCE_OF, holder)) for holder, token in pairs]
+    balances = {}
+    for (holder, token), (success, data) in zip(pairs, rpc_reader.read(calls, block=hex(block))):
+        if success and len(data) >= 32:
+            balances[pair_key(holder, token)] = rpc_reader.decode_uint(data)
+    return balances
+
+# Function to get the Transfer logs from or to the holders, in blocks start..end,
+# sorted by block and log index. Transfers between two tracked holders match
+# both filters and are returned once.
+def transfer_logs(pairs, start, end):
+    tokens = sorted({token.lower() for _, token in pairs})
+    holders = sorted({_topic(holder) for holder, _ in pairs})
+    requests = []
+    for low in range(start, end + 1, MAX_LOG_RANGE):
+        span = {'fromBlock': hex(low), 'toBlock': hex(min(low + MAX_LOG_RANGE - 1, end)), 'address': tokens}
+        requests.append(('eth_getLogs', [dict(span, topics=[TRANSFER_TOPIC, holders])]))
+        requests.append(('eth_getLogs', [dict(span, topics=[TRANSFER_TOPIC, None, holders])]))
+    logs = {}
+    for reply in rpc_reader.batch(requests):
+        if reply is None:
+            # A missing range would silently corrupt the balances
+            raise rpc_reader.RPCError(f"eth_getLogs failed for blocks {start}..{end}")
+        for log in reply:
+            logs[(int(log['blockNumber'], 16), int(log['logIndex'], 16))] = log
+    return [logs[key] for key in sorted(logs)]
+
+# Function to apply Transfer logs to {pair key: raw amount} in place. Calls
+# on_block(block, balances) after the last log of each block, for TVL at
+# block resolution. Returns the number of logs that moved a tracked balance.
+def apply_logs(balances, logs, on_block=None):
+    applied = 0
+    for i, log in enumerate(logs):
+        token = log['address'].lower()
+        amount = int(log['data'], 16) if log['data'] not in ('0x', '') else 0
+        sender, receiver = _address(log['topics'][1]), _address(log['topics'][2])
+        moved = False
+        for holder, delta in ((sender, -amount), (receiver, amount)):
+            key = f"{holder}:{token}"
+            if key in balances:
+                balances[key] += delta
+                moved = True
+        applied += moved
+        if on_block and (i + 1 == len(logs) or logs[i + 1]['blockNumber'] != log['blockNumber']):
+            on_block(int(log['blockNumber'], 16), balances)
+    return applied
+
+class VaultLedger:
+    def __init__(self, pairs, path=CHECKPOINT_PATH):
+        self.pairs = list(pairs)
+        self.path = path
+        self.cursor = None
+        self.balances = {}
+        self.reconciled_at = 0.0
+        try:
+            with open(path) as file:
+                state = json.load(file)
+        except FileNotFoundError:
+            return
+        self.cursor = state['cursor']
+        self.balances = {key: int(value) for key, value in state['balances'].items()}
+        self.reconciled_at = state.get('reconciled_at', 0.0)
+
+    def save(self):
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump({'cursor': self.cursor, 'reconciled_at': self.reconciled_at,
+                       'balances': {key: str(value) for key, value in self.balances.items()}}, file)
+        os.replace(temp_path, self.path)
+
+    def balance(self, holder, token):
+        return self.balances.get(pair_key(holder, token))
+
+    # Function to replace the balances with a balanceOf poll at `block`.
+    # Returns {pair key: polled - tracked} for the pairs that differed.
+    def reconcile(self, block):
+        polled = poll_balances(self.pairs, block)
+        drift = {key: value - self.balances[key] for key, value in polled.items()
+                 if key in self.balances and value != self.balances[key]}
+        for key, delta in drift.items():
+            print(f"Vault balance drift for {key}: {delta:+d} at block {block}")
+        metrics.inc('tvl_events_drift', len(drift))
+        self.balances = polled
+        self.cursor = block
+        self.reconciled_at = time.time()
+        return drift
+
+    # Function to bring the balances up to the confirmed head and checkpoint
+    # them. Returns the block the balances are at.
+    def advance(self):
+        head = rpc_reader.block_number() - CONFIRMATIONS
+        known = all(pair_key(holder, token) in self.balances for holder, token in self.pairs)
+        if self.cursor is None or not known:
+            print(f"Polling vault balances at block {head} to start following transfers.")
+            self.reconcile(head)
+        elif head > self.cursor:
+            logs = transfer_logs(self.pairs, self.cursor + 1, head)
+            applied = apply_logs(self.balances, logs)
+            metrics.inc('tvl_events_logs', applied)
+            print(f"Applied {applied} transfer logs from blocks {self.cursor + 1}..{head}")
+            self.cursor = head
+            if time.time() - self.reconciled_at > RECONCILE_INTERVAL:
+                self.reconcile(head)
+        self.save()
+        return self.cursor
+
+# Function to print the tracked balances after every block with a transfer,
+# from start to end (needs an archive node for the starting poll)
+def print_block_history(pairs, start, end, labels):
+    balances = poll_balances(pairs, start - 1)
+    keys = [pair_key(holder, token) for holder, token in pairs]
+    writer = csv.writer(sys.stdout)
+    writer.writerow(['block'] + [labels[key] for key in keys])
+    writer.writerow([start - 1] + [balances.get(key, '') for key in keys])
+    apply_logs(balances, transfer_logs(pairs, start, end),
+               on_block=lambda block, values: writer.writerow([block] + [values.get(key, '') for key in keys]))
+
+if __name__ == "__main__":
+    import tvl_data
+    import ttl_cache
+    parser = argparse.ArgumentParser(description="Follow vault balances from Transfer logs.")
+    parser.add_argument('command', choices=['advance', 'reconcile', 'history'])
+    parser.add_argument('--from-block', type=int)
+    parser.add_argument('--to-block', type=int)
+    args = parser.parse_args()
+
+    tokens = tvl_data.rpc_tokens(ttl_cache.get_cache())
+    pairs, labels = tvl_data.event_pairs(tokens)
+    if args.command == 'history':
+        if args.from_block is None or args.to_block is None:
+            parser.error("history needs --from-block and --to-block")
+        print_block_history(pairs, args.from_block, args.to_block, labels)
+    else:
+        ledger = VaultLedger(pairs)
+        if args.command == 'reconcile':
+            ledger.reconcile(rpc_reader.block_number() - CONFIRMATIONS)
+            ledger.save()
+        else:
+            ledger.advance()
+        print(f"Balances at block {ledger.cursor}:")
+        for key, value in sorted(ledger.balances.items()):
+            print(f"{labels.get(key, key)}: {value}")
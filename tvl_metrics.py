@@ -0,0 +1,195 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import sys
+from datetime import datetime
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+
+import deployments
+import dune_outbox
+
+# Long-format copy of the TVL snapshots: one (timestamp, metric_id, value)
+# sample per metric, instead of the 44-column token_and_contract_data row.
+#
+# CATALOG names and describes every metric. Wide columns map to metric ids
+# one to one, except the extra_N placeholders: extra_1..extra_4 get real
+# names and the unused ones are dropped. Columns of a deployment's own row
+# (see deployments.py) that are not in the catalog become metrics under
+# their column name, so a new metric needs no schema change.
+#
+# A sample is kept, and queued for the Dune table TABLE_NAME_TVL_METRICS,
+# only when the value differs from the metric's previous sample, or when the
+# previous one is older than LONG_FORMAT_HEARTBEAT seconds. A metric's value
+# at time T is its last sample at or before T. The times of all stored rows
+# are kept too, so a backfilled sample can be placed between them without
+# changing what later times read. dune_tables.py creates the
+# Dune tables and uploads the catalog to TABLE_NAME_METRIC_CATALOG.
+
+DB_PATH = os.getenv("TVL_METRICS_DB", "tvl_metrics.sqlite")
+# Seconds after which an unchanged metric is sampled again, so every day has
+# a value for each metric without carrying values forward across days
+HEARTBEAT = float(os.getenv("LONG_FORMAT_HEARTBEAT", "86400"))
+DUNE_TABLE = os.getenv("TABLE_NAME_TVL_METRICS")
+CATALOG_DUNE_TABLE = os.getenv("TABLE_NAME_METRIC_CATALOG")
+
+FIELDNAMES = ['timestamp', 'metric_id', 'value']
+CATALOG_FIELDNAMES = ['metric_id', 'unit', 'description', 'source_column', 'updated_at']
+
+# metric id -> (unit, description)
+CATALOG = {
+    'btc_in_usd': ('usd', "WBTC price (CoinGecko wrapped-bitcoin)"),
+    'elk_in_usd': ('usd', "ELK price (CoinGecko elk-finance)"),
+    'vnxau_in_usd': ('usd', "VNXAU price (CoinGecko vnx-gold)"),
+    'weth_in_usd': ('usd', "WETH price (CoinGecko weth)"),
+    'qgov_in_usd': ('usd', "QGOV price (CoinGecko q-protocol)"),
+    'stq_conv_rate': ('Q', "Q per stQ, from getStQPrice"),
+    'bridged_wbtc': ('WBTC', "WBTC total supply on Q"),
+    'bridged_usdc': ('USDC', "USDC total supply on Q"),
+    'bridged_dai': ('DAI', "DAI total supply on Q"),
+    'bridged_weth': ('WETH', "WETH total supply on Q"),
+    'bridged_elk': ('ELK', "ELK total supply on Q minus the reservoir balance"),
+    'total_qusd': ('QUSD', "QUSD total supply"),
+    'locked_wbtc': ('WBTC', "WBTC held by the borrowing contract"),
+    'locked_usdc': ('USDC', "USDC held by the borrowing contract"),
+    'locked_dai': ('DAI', "DAI held by the borrowing contract"),
+    'saving_tvl': ('QUSD', "QUSD held by the saving contract"),
+    'elk_locked_wbtc': ('WBTC', "WBTC in the ELK WBTC/QUSD pair"),
+    'elk_locked_usdc': ('USDC', "USDC in the ELK USDC/QUSD pair"),
+    'elk_locked_dai': ('DAI', "DAI in the ELK DAI/QUSD pair"),
+    'elk_locked_elk': ('ELK', "ELK in the ELK ELK/QUSD pair"),
+    'elk_locked_qusd': ('QUSD', "QUSD across the five ELK QUSD pairs"),
+    'elk_locked_vnxau': ('VNXAU', "VNXAU in the ELK VNXAU/QUSD pair"),
+    'stq_supply': ('stQ', "stQ total supply"),
+    'infinity_elk': ('ELK', "ELK held by the Infinity ELK vault"),
+    'infinity_weth': ('WETH', "WETH held by the Infinity WETH vault"),
+    'infinity_usdc': ('USDC', "USDC held by the Infinity USDC vault"),
+}
+
+# Wide columns whose metric id differs from the column name
+WIDE_COLUMNS = {'extra_1': 'infinity_elk', 'extra_2': 'infinity_weth', 'extra_3': 'infinity_usdc', 'extra_4': 'qgov_in_usd'}
+SOURCE_COLUMNS = {metric_id: column for column, metric_id in WIDE_COLUMNS.items()}
+PLACEHOLDER = re.compile(r'extra_\d+$')
+
+def connect(path=DB_PATH):
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE IF NOT EXISTS samples (metric_id TEXT NOT NULL, timestamp TEXT NOT NULL, "
+                 "value REAL NOT NULL, PRIMARY KEY (metric_id, timestamp))")
+    conn.execute("CREATE TABLE IF NOT EXISTS snapshots (timestamp TEXT PRIMARY KEY) WITHOUT ROWID")
+    # Stores from before the snapshots table know their rows only by their samples
+    if conn.execute("SELECT 1 FROM snapshots LIMIT 1").fetchone() is None:
+        conn.execute("INSERT INTO snapshots SELECT DISTINCT timestamp FROM samples")
+        conn.commit()
+    return conn
+
+# Function to get the metric id of a wide column, None for placeholders
+def metric_id(column):
+    if column in WIDE_COLUMNS:
+        return WIDE_COLUMNS[column]
+    if PLACEHOLDER.match(column):
+        return None
+    return column
+
+# Function to split a wide row into {metric id: value}, leaving out unknown values
+def to_samples(row):
+    samples = {}
+    for column, value in row.items():
+        metric = metric_id(column) if column != 'date' else None
+        if metric is None:
+            continue
+        try:
+            samples[metric] = float(value)
+        except (TypeError, ValueError):
+            continue
+    return samples
+
+# Function to get the catalog rows of every metric: CATALOG plus the
+# deployment's own columns
+def catalog_rows():
+    entries = dict(CATALOG)
+    for column, terms in (deployments.setting('columns') or {}).items():
+        entries.setdefault(column, ('', ' + '.join([terms] if isinstance(terms, str) else terms)))
+    return [{'metric_id': metric, 'unit': unit, 'description': description,
+             'source_column': SOURCE_COLUMNS.get(metric, metric)} for metric, (unit, description) in sorted(entries.items())]
+
+# Function to store the samples of the rows that changed. Rows may be older
+# than stored rows (backfill.py); each is compared with the sample just
+# before it. A sample stored before a later row also writes that row's old
+# value explicitly, as the row read it from the earlier sample until now.
+# Returns the new samples.
+def update(conn, rows):
+    new_samples = []
+    for row in sorted(rows, key=lambda row: row['date']):
+        timestamp = row['date']
+        moment = datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S')
+        conn.execute("INSERT OR IGNORE INTO snapshots (timestamp) VALUES (?)", (timestamp,))
+        following = conn.execute("SELECT MIN(timestamp) FROM snapshots WHERE timestamp > ?", (timestamp,)).fetchone()[0]
+        for metric, value in to_samples(row).items():
+            previous = conn.execute("SELECT timestamp, value FROM samples WHERE metric_id = ? AND timestamp <= ? "
+                                    "ORDER BY timestamp DESC LIMIT 1", (metric, timestamp)).fetchone()
+            if previous is not None:
+                if previous[0] == timestamp:
+                    continue
+                age = (moment - datetime.strptime(previous[0], '%Y-%m-%d %H:%M:%S')).total_seconds()
+                if previous[1] == value and age < HEARTBEAT:
+                    continue
+            conn.execute("INSERT INTO samples (metric_id, timestamp, value) VALUES (?, ?, ?)", (metric, timestamp, value))
+            new_samples.append({'timestamp': timestamp, 'metric_id': metric, 'value': value})
+            if following and previous is not None and previous[1] != value and conn.execute(
+                    "SELECT 1 FROM samples WHERE metric_id = ? AND timestamp = ?", (metric, following)).fetchone() is None:
+                conn.execute("INSERT INTO samples (metric_id, timestamp, value) VALUES (?, ?, ?)",
+                             (metric, following, previous[1]))
+                new_samples.append({'timestamp': following, 'metric_id': metric, 'value': previous[1]})
+    conn.commit()
+    return new_samples
+
+# Function to store the changed samples of the rows and queue them, with the
+# catalog, for Dune. Returns the number of new samples.
+def enqueue_changes(conn, outbox, rows, namespace):
+    samples = update(conn, rows)
+    dune_outbox.enqueue(outbox, namespace, DUNE_TABLE, FIELDNAMES, samples, ['timestamp', 'metric_id'])
+    enqueue_catalog(outbox, namespace)
+    return len(samples)
+
+# Function to queue the catalog rows that are new or changed. Unchanged rows
+# have the same outbox key and are not queued again.
+def enqueue_catalog(outbox, namespace):
+    if not CATALOG_DUNE_TABLE:
+        return 0
+    rows = catalog_rows()
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    for row in rows:
+        row['updated_at'] = now
+    def key(row):
+        entry = json.dumps([row[field] for field in CATALOG_FIELDNAMES[:-1]])
+        return f"{row['metric_id']}|{hashlib.sha256(entry.encode()).hexdigest()[:16]}"
+    return dune_outbox.enqueue(outbox, namespace, CATALOG_DUNE_TABLE, CATALOG_FIELDNAMES, rows, key)
+
+# Function to get {metric id: value} at a time, from the last sample of each metric
+def values_at(conn, timestamp):
+    rows = conn.execute("SELECT metric_id, value FROM samples s WHERE timestamp = (SELECT MAX(timestamp) FROM samples "
+                        "WHERE metric_id = s.metric_id AND timestamp <= ?)", (timestamp,)).fetchall()
+    return dict(rows)
+
+# Function to load the long samples from the wide CSV history
+def import_csv(conn, path='token_and_contract_data.csv'):
+    import csv
+    with open(path, newline='') as file:
+        rows = list(csv.DictReader(file))
+    return len(update(conn, rows))
+
+if __name__ == "__main__":
+    conn = connect()
+    if len(sys.argv) > 1 and sys.argv[1] == 'import':
+        print(f"Stored {import_csv(conn)} samples from the CSV history.")
+    elif len(sys.argv) > 1 and sys.argv[1] == 'at':
+        for metric, value in sorted(values_at(conn, sys.argv[2].replace('T', ' ')).items()):
+            print(f"{metric}: {value}")
+    else:
+        count = conn.execute("SELECT COUNT(*), COUNT(DISTINCT metric_id) FROM samples").fetchone()
+        print(f"{count[0]} samples of {count[1]} metrics in {DB_PATH}")
+    conn.close()
@@ -0,0 +1,157 @@
+import csv
+import hashlib
+import os
+import sqlite3
+
+BLOOM_BITS = 1 << 23  # 1 MiB of bits, ~1% false positives at 800k keys
+BLOOM_HASHES = 7
+
+# Bloom filter kept in front of the SQLite lookup. A negative answer means the
+# key was never added, so most new events skip the database entirely.
+class BloomFilter:
+    def __init__(self, bits=None, size=BLOOM_BITS, hashes=BLOOM_HASHES):
+        self.size = size
+        self.hashes = hashes
+        self.bits = bytearray(bits) if bits else bytearray(size // 8)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+# On-disk index of processed mint/burn events keyed on (tx_hash, log_index, token).
+#
+# The index also records how many bytes of the event CSV were committed with it.
+# Rows are appended to the CSV and inserted into the index inside one SQLite
+# transaction; commit() fsyncs the CSV, stores its new size and then commits.
+# If a run dies before commit, the next open truncates the CSV back to the
+# committed size, so the CSV and the index never disagree.
+class TxIndex:
+    def __init__(self, path='mint_burn_index.sqlite', csv_path='mint_burn_data.csv', use_bloom=False):
+        self.csv_path = csv_path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS events (
+                tx_hash TEXT NOT NULL,
+                log_index INTEGER NOT NULL,
+                token TEXT NOT NULL,
+                PRIMARY KEY (tx_hash, log_index, token)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS legacy_tx (
+                tx_hash TEXT NOT NULL,
+                token TEXT NOT NULL,
+                PRIMARY KEY (tx_hash, token)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value);
+        """)
+        self.bloom = None
+        if use_bloom:
+            bits = self._get_meta('bloom')
+            self.bloom = BloomFilter(bits)
+            if bits is None:
+                self._fill_bloom()
+        if self._get_meta('csv_offset') is None:
+            self._import_legacy_csv()
+        self._recover_csv()
+
+    def _get_meta(self, key):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key, value):
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def _csv_size(self):
+        return os.path.getsize(self.csv_path) if os.path.exists(self.csv_path) else 0
+
+    def _import_legacy_csv(self):
+        # One-time import of the rows already in the CSV. Rows from a file
+        # without a log_index column (legacy) are matched on (tx_hash, token) only.
+        count = 0
+        if os.path.exists(self.csv_path):
+            with open(self.csv_path, mode='r', newline='') as file:
+                for row in csv.DictReader(file):
+                    if row.get('log_index'):
+                        self.add(row['tx_hash'], int(row['log_index']), row['token_symbol'])
+                    else:
+                        self.conn.execute("INSERT OR IGNORE INTO legacy_tx (tx_hash, token) VALUES (?, ?)",
+                                          (row['tx_hash'], row['token_symbol']))
+                        if self.bloom is not None:
+                            self.bloom.add(self._legacy_key(row['tx_hash'], row['token_symbol']))
+                    count += 1
+        self._set_meta('csv_offset', self._csv_size())
+        if self.bloom is not None:
+            self._set_meta('bloom', bytes(self.bloom.bits))
+        self.conn.commit()
+        print(f"Imported {count} existing rows from {self.csv_path} into the index.")
+
+    def _fill_bloom(self):
+        for tx_hash, log_index, token in self.conn.execute("SELECT tx_hash, log_index, token FROM events"):
+            self.bloom.add(self._key(tx_hash, log_index, token))
+        for tx_hash, token in self.conn.execute("SELECT tx_hash, token FROM legacy_tx"):
+            self.bloom.add(self._legacy_key(tx_hash, token))
+        self._set_meta('bloom', bytes(self.bloom.bits))
+        self.conn.commit()
+
+    # Drop what a failed run left uncommitted, both index rows and CSV bytes.
+    # A caller keeping the index open between runs calls this before each run.
+    def recover(self):
+        self.conn.rollback()
+        if self.bloom is not None:
+            self.bloom = BloomFilter(self._get_meta('bloom'))
+        self._recover_csv()
+
+    def _recover_csv(self):
+        committed = self._get_meta('csv_offset')
+        size = self._csv_size()
+        if size > committed:
+            print(f"Truncating {size - committed} uncommitted bytes from {self.csv_path}.")
+            with open(self.csv_path, 'r+b') as file:
+                file.truncate(committed)
+        elif size < committed:
+            raise RuntimeError(f"{self.csv_path} is shorter than the index expects; "
+                               f"delete the index file to rebuild it from the CSV")
+
+    @staticmethod
+    def _key(tx_hash, log_index, token):
+        return f"{tx_hash}:{log_index}:{token}"
+
+    @staticmethod
+    def _legacy_key(tx_hash, token):
+        return f"{tx_hash}:*:{token}"
+
+    def seen(self, tx_hash, log_index, token):
+        if self.bloom is not None and self._key(tx_hash, log_index, token) not in self.bloom \
+                and self._legacy_key(tx_hash, token) not in self.bloom:
+            return False
+        if self.conn.execute("SELECT 1 FROM events WHERE tx_hash = ? AND log_index = ? AND token = ?",
+                             (tx_hash, log_index, token)).fetchone():
+            return True
+        return self.conn.execute("SELECT 1 FROM legacy_tx WHERE tx_hash = ? AND token = ?",
+                                 (tx_hash, token)).fetchone() is not None
+
+    def add(self, tx_hash, log_index, token):
+        self.conn.execute("INSERT OR IGNORE INTO events (tx_hash, log_index, token) VALUES (?, ?, ?)",
+                          (tx_hash, log_index, token))
+        if self.bloom is not None:
+            self.bloom.add(self._key(tx_hash, log_index, token))
+
+    # Make the CSV rows written since the last commit durable, then commit the index with them
+    def commit(self, csv_file):
+        csv_file.flush()
+        os.fsync(csv_file.fileno())
+        self._set_meta('csv_offset', self._csv_size())
+        if self.bloom is not None:
+            self._set_meta('bloom', bytes(self.bloom.bits))
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()